@@ -0,0 +1,102 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Default asynchronous backend class"""
+
+import abc
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import exception
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+
+def client_session():
+    """Return a HTTP client session to be shared by asynchronous backends.
+
+    The connection pool of the session is bounded like the synchronous
+    operations: ``sync_workers`` connections at most, ``backend_workers``
+    for each host.
+
+    :return: a HTTP client session
+    :rtype: aiohttp.ClientSession
+    """
+    if aiohttp is None:
+        raise exception.MissingDependency(feature='asynchronous backend',
+                                          dependency='aiohttp')
+    connector = aiohttp.TCPConnector(limit=CONF.sync_workers,
+                                     limit_per_host=CONF.backend_workers)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class AsyncBackend(object, metaclass=abc.ABCMeta):
+    """ImageKeeper Asynchronous Backend Metaclass.
+
+    The asynchronous variant of :class:`imagekeeper.backend.base.Backend`:
+    the operations are coroutines, so that the operations of many backends
+    can be run on a single event loop. To correctly use this class,
+    inherit from it and implement all functions.
+    """
+
+    @abc.abstractmethod
+    async def connect(self):
+        """Connect to the backend."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def close(self):
+        """Release the connections of the backend."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def get_image_list(self, properties=None):
+        """Retrieve the image list from the backend."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def add_appliance(self, appliance, image_data=None):
+        """Add an appliance."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def deprecate_appliance(self, appliance_id):
+        """Set an appliance as deprecated."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def deprecate_many(self, appliance_ids):
+        """Set several appliances as deprecated."""
+        raise exception.FunctionNotImplemented()
+
+    @abc.abstractmethod
+    async def delete_appliances_bulk(self, image_ids=None):
+        """Delete several deprecated images."""
+        raise exception.FunctionNotImplemented()
+
+    async def __aenter__(self):
+        """Connect to the backend."""
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Release the connections of the backend."""
+        await self.close()
@@ -15,16 +15,25 @@
 """Default backend class"""
 
 import abc
+import collections
+import time
+
 import six
 
 from oslo_config import cfg
 from oslo_log import log
 
-from imagekeeper import exception
+from imagekeeper.common import exception
 
 LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
+# Outcome of an operation run on a single image
+ImageResult = collections.namedtuple(
+    'ImageResult',
+    ['image_id', 'identifier', 'succeeded', 'error', 'elapsed']
+)
+
 
 @six.add_metaclass(abc.ABCMeta)
 class Backend(object):
@@ -34,11 +43,33 @@ class Backend(object):
     all functions.
     """
 
+    # Name of the backend type in the backend file
+    feature = None
+
+    # Journal of the operations, set by the synchronization engine
+    journal = None
+
+    # Disk format of the images preferred by the backend, None to upload
+    # the images in their original format
+    disk_format = None
+
+    # Retries and circuit breaker of the calls decorated with
+    # resilience.idempotent or resilience.guarded, None to call directly
+    resilience = None
+
+    @classmethod
+    def get_feature(cls):
+        """Return the name of the backend type."""
+        return cls.feature
+
     @abc.abstractmethod
     def connect(self):
         """Connect to the backend."""
         raise exception.FunctionNotImplemented()
 
+    def disconnect(self):
+        """Release the connections of the backend."""
+
     @abc.abstractmethod
     def get_appliance_list(self, **kwargs):
         """Retrieve the appliance list from the backend."""
@@ -59,7 +90,70 @@ class Backend(object):
         """Try to delete deprecated appliances."""
         raise exception.FunctionNotImplemented()
 
+    def deprecate_many(self, appliance_ids):
+        """Set several appliances as deprecated.
+
+        The appliances are deprecated one after the other, the backends
+        able to do better override this method.
+
+        :param appliance_ids: the ids of the appliances
+        :type appliance_ids: iterable
+        :return: the result of each appliance
+        :rtype: list of ImageResult
+        """
+        results = []
+        for appliance_id in appliance_ids:
+            start = time.monotonic()
+            error = None
+            try:
+                succeeded = bool(self.deprecate_appliance(appliance_id))
+            except Exception as err:
+                LOG.exception(err)
+                succeeded = False
+                error = err
+            results.append(ImageResult(None, appliance_id, succeeded, error,
+                                       time.monotonic() - start))
+        return results
+
+    def delete_appliances_bulk(self, image_ids=None):
+        """Delete several deprecated images.
+
+        All the deprecated images are deleted by delete_appliance, whose
+        outcome is reported for each image, the backends able to delete
+        given images override this method.
+
+        :param image_ids: the ids of the images, by default all the
+                          deprecated images
+        :type image_ids: iterable
+        :return: the result of each image
+        :rtype: list of ImageResult
+        """
+        start = time.monotonic()
+        error = None
+        try:
+            succeeded = bool(self.delete_appliance())
+        except Exception as err:
+            LOG.exception(err)
+            succeeded = False
+            error = err
+        elapsed = time.monotonic() - start
+        if image_ids is None:
+            image_ids = [None]
+        return [ImageResult(image_id, None, succeeded, error, elapsed)
+                for image_id in image_ids]
+
     @abc.abstractmethod
     def update_appliance(self, **kwargs):
         """Update an appliance."""
         raise exception.FunctionNotImplemented()
+
+    def replay_journal(self, keep=()):
+        """Complete the operations interrupted by a previous run.
+
+        :param keep: the identifiers of the appliances about to be added,
+                     whose interrupted uploads can be reused
+        :type keep: iterable
+        :return: True if all the operations have been completed
+        :rtype: bool
+        """
+        return True
@@ -0,0 +1,140 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Indexed snapshot of the images available on a backend."""
+
+import collections
+import threading
+
+
+class ImageCatalogue(object):
+    """Snapshot of the images of a backend.
+
+    The images are indexed by id, by name and by property value, so that
+    looking for the images matching a set of properties does not require
+    to list the images of the backend again. The snapshot must be kept up
+    to date with the images created, updated and deleted on the backend.
+    """
+
+    def __init__(self, images=()):
+        """Initialize the class.
+
+        :param images: the images of the backend
+        :type images: iterable
+        """
+        self._lock = threading.RLock()
+        self._images = {}
+        self._by_name = collections.defaultdict(set)
+        self._by_property = collections.defaultdict(set)
+        for image in images:
+            self.add(image)
+
+    @staticmethod
+    def _index_keys(image):
+        """Return the (property, value) pairs used to index an image."""
+        keys = []
+        for name, value in image.items():
+            if name == 'tags':
+                keys.extend(('tags', tag) for tag in value or ())
+            elif isinstance(value, (str, int, float, bool)):
+                keys.append((name, value))
+        return keys
+
+    def _unindex(self, image_id):
+        """Remove an image from the indexes."""
+        image = self._images.pop(image_id, None)
+        if image is None:
+            return None
+        ids = self._by_name.get(image.get('name'))
+        if ids is not None:
+            ids.discard(image_id)
+            if not ids:
+                del self._by_name[image.get('name')]
+        for key in self._index_keys(image):
+            ids = self._by_property.get(key)
+            if ids is not None:
+                ids.discard(image_id)
+                if not ids:
+                    del self._by_property[key]
+        return image
+
+    def add(self, image):
+        """Add an image, or replace it if it is already in the catalogue.
+
+        :param image: the image as returned by Glance
+        :type image: dict
+        """
+        with self._lock:
+            image_id = image['id']
+            self._unindex(image_id)
+            self._images[image_id] = image
+            self._by_name[image.get('name')].add(image_id)
+            for key in self._index_keys(image):
+                self._by_property[key].add(image_id)
+
+    def remove(self, image_id):
+        """Remove an image from the catalogue.
+
+        :param image_id: the id of the image
+        :type image_id: str
+        :return: the removed image, None if it was not found
+        :rtype: dict
+        """
+        with self._lock:
+            return self._unindex(image_id)
+
+    def get(self, image_id):
+        """Return an image given its id.
+
+        :param image_id: the id of the image
+        :type image_id: str
+        :return: the image, None if it was not found
+        :rtype: dict
+        """
+        return self._images.get(image_id)
+
+    def find(self, name=None, **properties):
+        """Return the images matching a name and a set of properties.
+
+        A tag is matched with ``tags='<tag>'``.
+
+        :param name: the name of the images
+        :type name: str
+        :return: the matching images
+        :rtype: list
+        """
+        with self._lock:
+            candidates = []
+            if name is not None:
+                candidates.append(self._by_name.get(name, set()))
+            for key in properties.items():
+                candidates.append(self._by_property.get(key, set()))
+            if not candidates:
+                return list(self._images.values())
+            candidates.sort(key=len)
+            ids = candidates[0].intersection(*candidates[1:])
+            return [self._images[image_id] for image_id in ids]
+
+    def __contains__(self, image_id):
+        """Return whether an image is in the catalogue."""
+        return image_id in self._images
+
+    def __iter__(self):
+        """Iterate over a copy of the images of the catalogue."""
+        with self._lock:
+            return iter(list(self._images.values()))
+
+    def __len__(self):
+        """Return the number of images in the catalogue."""
+        return len(self._images)
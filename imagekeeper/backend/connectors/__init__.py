@@ -16,6 +16,7 @@
 
 from oslo_config import cfg
 
+from imagekeeper.backend import base
 from imagekeeper import pluginloader
 
 CONF = cfg.CONF
@@ -44,18 +45,15 @@ class BaseConnector(object):
 
 
 class CloudConnectorHandler(pluginloader.PluginLoader):
-    """Base class to handle Cloud connector classe."""
+    """Base class to handle Cloud connector classe.
+
+    The connectors are the subclasses of ``base.Backend`` named after their
+    ``feature``, the type of the backends in the backend file. They are
+    created with the name and the parameters of a backend.
+    """
 
     def __init__(self):
         """Initialize the class."""
         super(CloudConnectorHandler, self).__init__(
-            'imagekeeper.backend.connectors', BaseConnector
+            'imagekeeper.backend.connectors', base.Backend
         )
-
-    def load_handler(self, class_type):
-        """Load the connector handler for a Cloud type."""
-        connector_handler = None
-        connector_classes = self._get_all_classes()
-        if class_type in connector_classes.keys():
-            connector_handler = connector_classes[class_type]
-        return connector_handler
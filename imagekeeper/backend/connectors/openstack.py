@@ -14,23 +14,119 @@
 
 """OpenStack backend class"""
 
+from concurrent import futures
+import threading
+import time
+
+from glanceclient import exc as glance_exc
 import glanceclient.v2.client as glanceclient
+from keystoneauth1 import exceptions as ksa_exc
 from keystoneauth1 import loading
 from keystoneauth1 import session
 from oslo_config import cfg
 from oslo_log import log
-
-from imagekeeper.backends import base
+import requests
+
+from imagekeeper.backend import base
+from imagekeeper.backend import catalogue
+from imagekeeper.backend import ratelimit
+from imagekeeper.backend import resilience
+from imagekeeper.common import exception
+from imagekeeper.common import metrics
 from imagekeeper.common import utils
-from imagekeeper import exception
+from imagekeeper.image import stream
+from imagekeeper.sync import journal
 
 LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
 
+def _retry_after(response):
+    """Return the delay in seconds asked by a response, if any."""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LimitedSession(session.Session):
+    """Keystone session sending its requests through a rate limiter.
+
+    The authentication requests are not limited, as they are sent while
+    an authenticated request is waiting for its token.
+    """
+
+    def __init__(self, limiter, **kwargs):
+        """Initialize the class.
+
+        :param limiter: the rate limiter of the backend
+        :type limiter: ratelimit.RateLimiter
+        """
+        super(LimitedSession, self).__init__(**kwargs)
+        self.limiter = limiter
+        self._local = threading.local()
+
+    @property
+    def last_status(self):
+        """Return the HTTP status of the last request of this thread."""
+        return getattr(self._local, 'status', None)
+
+    def _authenticate(self, url, method, **kwargs):
+        """Send an authentication request, recording its duration."""
+        start = time.monotonic()
+        try:
+            response = super(LimitedSession, self).request(url, method,
+                                                           **kwargs)
+        except Exception as err:
+            metrics.record(self.limiter.name, 'auth',
+                           time.monotonic() - start, err)
+            raise
+        metrics.record(self.limiter.name, 'auth', time.monotonic() - start)
+        return response
+
+    def request(self, url, method, **kwargs):
+        """Send a request once the limiter allows it."""
+        if kwargs.get('authenticated') is False:
+            return self._authenticate(url, method, **kwargs)
+        # The latency of the image transfers reflects their size, not the
+        # load of the backend
+        data = kwargs.get('data')
+        measured = data is None or isinstance(data, (bytes, str))
+        self.limiter.acquire()
+        start = time.monotonic()
+        outcome = {}
+        try:
+            response = super(LimitedSession, self).request(url, method,
+                                                           **kwargs)
+            outcome['status'] = response.status_code
+            outcome['retry_after'] = _retry_after(response)
+            return response
+        except ksa_exc.ConnectTimeout:
+            outcome['timed_out'] = True
+            raise
+        except ksa_exc.HttpError as err:
+            outcome['status'] = err.http_status
+            outcome['retry_after'] = _retry_after(err.response)
+            raise
+        finally:
+            self._local.status = outcome.get('status')
+            if metrics.enabled():
+                metrics.REQUESTS.inc(backend=self.limiter.name,
+                                     method=method,
+                                     status=outcome.get('status', 'none'))
+            if outcome.get('status') in (408, 504):
+                outcome['timed_out'] = True
+            latency = None
+            if measured and 'status' in outcome:
+                latency = time.monotonic() - start
+            self.limiter.release(latency, **outcome)
+
+
 class OpenStackBackend(base.Backend):
     """OpenStack backend."""
 
+    feature = 'openstack'
+
     def __init__(self, cloud_id, config):
         """Class initialisation.
 
@@ -39,6 +135,36 @@ class OpenStackBackend(base.Backend):
         """
         self.cloud_id = cloud_id
         self.config = config
+        self.disk_format = config.get('disk_format')
+        self.limiter = ratelimit.RateLimiter.from_config(cloud_id, config)
+        self.resilience = resilience.Resilience.from_config(
+            cloud_id, config, self.is_transient
+        )
+        self._lock = threading.RLock()
+        self._session = None
+        self._glance = None
+        self._catalogue = None
+
+    def is_transient(self, error):
+        """Return whether an error of a call is worth retrying.
+
+        :param error: the exception raised by the call
+        :type error: Exception
+        :rtype: bool
+        """
+        if isinstance(error, (ksa_exc.ConnectionError,
+                              glance_exc.CommunicationError,
+                              requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout)):
+            return True
+        status = (getattr(error, 'http_status', None) or
+                  getattr(error, 'code', None))
+        if (not isinstance(status, int) and
+                isinstance(error, glance_exc.HTTPException) and
+                self._session is not None):
+            # Glance does not keep the statuses it does not know, like 429
+            status = self._session.last_status
+        return status in resilience.TRANSIENT_STATUSES
 
     def _v3oidcaccesstoken_options(self):
         """Return the required options for OIDC auth_type.
@@ -47,7 +173,7 @@ class OpenStackBackend(base.Backend):
         :rtype: dict
         """
         required_options = ['auth_url', 'project_name',
-                            'project_domain_name', 'oidc_access_token'
+                            'project_domain_name', 'oidc_access_token',
                             'oidc_identity_provider', 'oidc_protocol']
         missing_options = utils.validate_options(
             self.config, required_options
@@ -74,8 +200,8 @@ class OpenStackBackend(base.Backend):
         :rtype: dict
         """
         required_options = ['auth_url', 'project_name',
-                            'project_domain_name', 'oidc_access_token'
-                            'oidc_identity_provider', 'oidc_protocol']
+                            'project_domain_name', 'username', 'password',
+                            'user_domain_name']
         missing_options = utils.validate_options(
             self.config, required_options
         )
@@ -110,81 +236,488 @@ class OpenStackBackend(base.Backend):
 
         raise exception.UnknownAuthMethod(auth_type=auth_type)
 
+    def _http_session(self):
+        """Return a HTTP session keeping the connections alive.
+
+        The connection pool is sized to the number of requests run
+        concurrently on the backend, so that no connection is dropped
+        between two requests.
+
+        :return: a HTTP session
+        :rtype: requests.Session
+        """
+        http_session = requests.Session()
+        pool_size = max(CONF.backend_workers,
+                        self.limiter.concurrency.maximum)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+        )
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        return http_session
+
     def connect(self):
         """Manage authentification depending the authentication type.
 
+        The session is created on the first call and shared by all the
+        following ones. The token is only requested again by keystoneauth
+        when it is about to expire or has been rejected.
+
         :return: an OpenStack session
         :rtype: session.Session
         """
-        auth_type = self.config['auth_type']
-        loader = loading.get_plugin_loader(auth_type)
-        auth = loader.load_from_options(**self._auth_options(auth_type))
-        return session.Session(auth=auth)
+        with self._lock:
+            if self._session is None:
+                auth_type = self.config['auth_type']
+                loader = loading.get_plugin_loader(auth_type)
+                auth = loader.load_from_options(
+                    **self._auth_options(auth_type)
+                )
+                self._session = LimitedSession(
+                    self.limiter, auth=auth, session=self._http_session()
+                )
+            return self._session
+
+    def disconnect(self):
+        """Drop the session and the client of the backend."""
+        with self._lock:
+            if self._session is not None:
+                self._session.session.close()
+            self._session = None
+            self._glance = None
+
+    @property
+    def glance(self):
+        """Return the Glance client of the backend.
+
+        :return: a Glance client sharing the session of the backend
+        :rtype: glanceclient.Client
+        """
+        with self._lock:
+            if self._glance is None:
+                self._glance = glanceclient.Client(session=self.connect())
+            return self._glance
+
+    @property
+    def catalogue(self):
+        """Return the snapshot of the images of the backend.
+
+        The images are listed from Glance on first access only, the
+        snapshot is then kept up to date by the operations of the backend.
+
+        :return: the image catalogue of the backend
+        :rtype: catalogue.ImageCatalogue
+        """
+        with self._lock:
+            if self._catalogue is None:
+                LOG.debug("Retrieving the image catalogue of the backend "
+                          "'%s'" % self.cloud_id)
+                try:
+                    self._catalogue = catalogue.ImageCatalogue(
+                        self._list_images()
+                    )
+                except exception.ImagekeeperException:
+                    raise
+                except Exception as err:
+                    raise exception.UnknownError(exception=err)
+            return self._catalogue
+
+    def reset_catalogue(self):
+        """Drop the image snapshot, it is retrieved again on next use."""
+        with self._lock:
+            self._catalogue = None
+
+    def _update_catalogue(self, image):
+        """Record a new or updated image in the catalogue if loaded."""
+        if self._catalogue is not None:
+            self._catalogue.add(image)
+
+    @resilience.idempotent
+    @metrics.timed('list')
+    def _list_page(self, filters, marker=None):
+        """Return a page of the images matching a set of Glance filters.
+
+        :param filters: the Glance filters
+        :type filters: dict
+        :param marker: the id of the last image of the previous page
+        :type marker: str
+        :return: the images of the page
+        :rtype: list
+        """
+        # The filters are modified by the client
+        filters = dict(filters)
+        if marker is not None:
+            filters['marker'] = marker
+        return list(self.glance.images.list(filters=filters,
+                                            page_size=CONF.image_page_size,
+                                            limit=CONF.image_page_size))
+
+    def _list_images(self, **properties):
+        """List the images matching a set of properties from Glance.
+
+        The filtering is done by Glance. The pages are retrieved as the
+        images are consumed, a failed page being retried on its own. A tag
+        is matched with ``tags='<tag>'``.
+
+        :return: the matching images
+        :rtype: generator
+        """
+        filters = dict(properties)
+        if 'tags' in filters:
+            filters['tag'] = [filters.pop('tags')]
+        marker = None
+        while True:
+            page = self._list_page(filters, marker)
+            for image in page:
+                yield image
+            if len(page) < CONF.image_page_size:
+                return
+            marker = page[-1]['id']
+
+    def _find_images(self, **properties):
+        """Return the images matching a set of properties.
+
+        The lookup is done in the catalogue if it has already been
+        retrieved, otherwise the filters are sent to Glance.
+
+        :return: the matching images
+        :rtype: iterable
+        """
+        if self._catalogue is not None:
+            return list(self._catalogue.find(**properties))
+        return self._list_images(**properties)
 
     def get_image_list(self, properties=None):
         """Return the list of images.
 
         :param properties: a list of properties to use for filtering
         :type properties: dict
+        :return: the matching images
+        :rtype: list
+        """
+        try:
+            # The pages are retrieved here, so that their errors are wrapped
+            return list(self._find_images(**(properties or {})))
+        except exception.ImagekeeperException:
+            raise
+        except Exception as err:
+            raise exception.UnknownError(exception=err)
+
+    def get_appliance_list(self, **kwargs):
+        """Return the list of images of the backend.
+
         :return: a list of appliances
         :rtype: list
         """
-        glance = glanceclient.Client(session=self.connect())
+        return self.get_image_list(**kwargs)
+
+    def _delete_image(self, image_id):
+        """Delete an image, logging instead of raising on failure.
+
+        :param image_id: the id of the image
+        :type image_id: str
+        :return: True if the image has been deleted
+        :rtype: bool
+        """
         try:
-            img_generator = glance.images.list()
-            image_list = list(img_generator)
+            self._remove_image(image_id)
         except Exception as err:
-            raise exception.UnknownError(err)
-        return image_list
+            LOG.error("Image '%s' cannot be deleted" % image_id)
+            LOG.error(err)
+            return False
+        return True
 
-    def add_appliance(self, appliance):
+    @resilience.idempotent
+    @metrics.timed('delete')
+    def _remove_image(self, image_id):
+        """Delete an image, an image already deleted being ignored."""
+        LOG.debug("Deleting image '%s'" % image_id)
+        try:
+            self.glance.images.delete(image_id)
+        except glance_exc.HTTPNotFound:
+            LOG.debug("Image '%s' already deleted" % image_id)
+        if self._catalogue is not None:
+            self._catalogue.remove(image_id)
+
+    @resilience.guarded
+    @metrics.timed('create')
+    def _create_image(self, **properties):
+        """Create an image, without data."""
+        return self.glance.images.create(**properties)
+
+    @resilience.guarded
+    @metrics.timed('upload', size=lambda image_id, image_data: image_data.size)
+    def _upload_image(self, image_id, image_data):
+        """Send the data of an image, which cannot be read again."""
+        self.glance.images.upload(image_id, image_data,
+                                  image_size=image_data.size)
+
+    @resilience.idempotent
+    @metrics.timed('update')
+    def _update_image(self, image_id, **properties):
+        """Set properties of an image and return the updated image."""
+        return self.glance.images.update(image_id, **properties)
+
+    @resilience.idempotent
+    @metrics.timed('get')
+    def _get_image(self, image_id):
+        """Return an image, None if it does not exist anymore."""
+        try:
+            return self.glance.images.get(image_id)
+        except glance_exc.HTTPNotFound:
+            return None
+
+    def _journal_begin(self, operation, identifier=None, **data):
+        """Record the beginning of an operation in the journal, if any."""
+        if self.journal is None:
+            return None
+        return self.journal.begin(self.cloud_id, operation, identifier,
+                                  **data)
+
+    def _journal_step(self, entry_id, step, **data):
+        """Record a step of an operation in the journal, if any."""
+        if entry_id is not None:
+            self.journal.step(entry_id, step, **data)
+
+    def _journal_finish(self, entry_id):
+        """Record the end of an operation in the journal, if any."""
+        if entry_id is not None:
+            self.journal.finish(entry_id)
+
+    def _resume_upload(self, appliance):
+        """Find the image left by an interrupted upload of an appliance.
+
+        An image whose data has been entirely received, or has not been
+        received at all, is reused. An enabled image is returned as it is:
+        its upload was completed, only its end was not recorded. Any other
+        image is deleted.
+
+        :return: the id of the operation in the journal and the image to
+                 reuse, (None, None) if there is none
+        :rtype: tuple
+        """
+        if self.journal is None:
+            return None, None
+        for entry in self.journal.pending(self.cloud_id, journal.ADD):
+            if (entry.identifier != appliance['identifier'] or
+                    entry.data.get('version') != appliance.get('version') or
+                    entry.data.get('checksum') != appliance.get('checksum')):
+                continue
+            image_id = entry.data.get('image_id')
+            image = None
+            if image_id is not None:
+                image = self._get_image(image_id)
+            if (image is not None and
+                    image.get('IK_STATUS') == 'UPLOADING' and
+                    image.get('status') in ('queued', 'active')):
+                LOG.info("Resuming the interrupted upload of the image "
+                         "'%s'" % image_id)
+                return entry.id, image
+            if image is not None and image.get('IK_STATUS') == 'ENABLED':
+                LOG.info("Image '%s' has already been uploaded" % image_id)
+                self._journal_finish(entry.id)
+                return None, image
+            if image is None or self._delete_image(image_id):
+                self._journal_finish(entry.id)
+        return None, None
+
+    def add_appliance(self, appliance, image_data=None):
         """Add an appliance.
 
+        The image file is read once: the checksums are computed while the
+        data is uploaded. The image is only marked as ENABLED once the
+        checksums match the appliance and the image stored by Glance,
+        otherwise it is deleted.
+
+        Each step is recorded in the journal, so that the image left by an
+        interrupted upload is reused by the next run: the data is only
+        sent again if Glance did not receive all of it.
+
         :param appliance: an appliance to add to Glance
         :type appliance: dict
-        :return: True if the appliance could be added successfully
-        :rtype: bool
+        :param image_data: a reader for the image, shared with other
+                           backends, by default the image file is opened
+        :type image_data: stream.ChecksumReader
+        :return: the id of the Glance image, False if the appliance could
+                 not be added
+        :rtype: str
         """
-        glance = glanceclient.Client(session=self.connect())
         LOG.info('Adding appliance: ' + appliance['title'])
         filename = appliance['location']
         image_format = appliance['format']
-        image_properties = {}
         min_ram = 0
-        if appliance.min_ram:
-            min_ram = appliance.min_ram
+        if appliance['min_ram']:
+            min_ram = appliance['min_ram']
         if CONF.min_ram > min_ram:
             min_ram = CONF.min_ram
-        try:
-            image_data = open(filename, 'rb')
-        except IOError as err:
-            LOG.error("Cannot open image file: '%s'" % filename)
-            LOG.exception(err)
-            return False
+        checksum = appliance['checksum']
+        checksum_algo = utils.checksum_algorithm(checksum)
+        if image_data is None:
+            try:
+                image_data = stream.open_image(appliance)
+            except (IOError, OSError) as err:
+                LOG.error("Cannot open image file: '%s'" % filename)
+                LOG.exception(err)
+                return False
 
-        image_properties['IK_STATUS'] = 'ENABLED'
+        image_properties = {
+            'IK_ID': appliance['identifier'],
+            'IK_STATUS': 'UPLOADING',
+        }
+        if appliance.get('version'):
+            image_properties['IK_VERSION'] = appliance['version']
 
         LOG.debug(
             "Creating image '%s' (format: '%s', "
-            "properties %s)" % (appliance.title,
+            "properties %s)" % (appliance['title'],
                                 str.lower(image_format),
                                 image_properties)
         )
 
-        glance_image = glance.images.create(
-            name=appliance['title'],
-            disk_format=str.lower(image_format),
-            container_format="bare",
-            visibility=CONF.image_visibility,
-        )
-        glance.images.upload(glance_image.id, image_data)
-        glance.images.update(glance_image.id, **image_properties)
-        if (min_ram > 0):
-            glance.images.update(glance_image.id, min_ram=min_ram)
+        entry_id, glance_image = self._resume_upload(appliance)
+        if (glance_image is not None and
+                glance_image.get('IK_STATUS') == 'ENABLED'):
+            image_data.close()
+            self._update_catalogue(glance_image)
+            return glance_image['id']
+        try:
+            with image_data:
+                if glance_image is None:
+                    entry_id = self._journal_begin(
+                        journal.ADD, appliance['identifier'],
+                        version=appliance.get('version'),
+                        checksum=appliance.get('checksum')
+                    )
+                    glance_image = self._create_image(
+                        name=appliance['title'],
+                        disk_format=str.lower(image_format),
+                        container_format="bare",
+                        visibility=CONF.image_visibility,
+                        **image_properties
+                    )
+                    self._journal_step(entry_id, 'created',
+                                       image_id=glance_image['id'])
+                if glance_image.get('status') == 'active':
+                    # Only compute the checksums of the data already sent
+                    while image_data.read(CONF.upload_chunk_size):
+                        pass
+                else:
+                    self._upload_image(glance_image['id'], image_data)
+                self._journal_step(entry_id, 'uploaded')
+            if checksum_algo:
+                utils.verify_checksum(appliance['title'], checksum_algo,
+                                      checksum,
+                                      image_data.hexdigest(checksum_algo))
+
+            image_properties = {
+                'IK_HASH_ALGO': CONF.image_hash_algo,
+                'IK_HASH_VALUE': image_data.hexdigest(CONF.image_hash_algo),
+            }
+            if (min_ram > 0):
+                image_properties['min_ram'] = min_ram
+            glance_image = self._update_image(glance_image['id'],
+                                              **image_properties)
+
+            # Make sure that Glance stored the data that has been read
+            utils.verify_checksum(appliance['title'], 'md5',
+                                  image_data.hexdigest('md5'),
+                                  glance_image.get('checksum'))
+            hash_algo = glance_image.get('os_hash_algo')
+            if hash_algo in image_data.algorithms:
+                utils.verify_checksum(appliance['title'], hash_algo,
+                                      image_data.hexdigest(hash_algo),
+                                      glance_image.get('os_hash_value'))
+
+            glance_image = self._update_image(glance_image['id'],
+                                              IK_STATUS='ENABLED')
+        except Exception as err:
+            LOG.error("Could not add the appliance '%s' to the backend "
+                      "'%s'" % (appliance['title'], self.cloud_id))
+            LOG.exception(err)
+            if glance_image is None or self._delete_image(
+                    glance_image['id']):
+                self._journal_finish(entry_id)
+            return False
 
-        image_data.close()
+        self._journal_finish(entry_id)
 
-        return True
+        LOG.debug("Image '%s' uploaded (%d bytes)" %
+                  (glance_image['id'], image_data.bytes_read))
+        self._update_catalogue(glance_image)
+        return glance_image['id']
+
+    def _run_bulk(self, func, images):
+        """Run an operation on several images over a bounded thread pool.
+
+        At most ``backend_workers`` calls are run at once, which is the
+        size of the connection pool of the session shared by the threads.
+        A failure is recorded in the result of its image and does not stop
+        the other calls.
+
+        :param func: callable run on each image, called as
+                     ``func(image_id)``
+        :type func: callable
+        :param images: the (image id, appliance identifier) pairs
+        :type images: list
+        :return: the result of each image, in order
+        :rtype: list of base.ImageResult
+        """
+        if not images:
+            return []
+        # Create the client before the threads share it
+        self.glance
+
+        def run(image):
+            image_id, identifier = image
+            start = time.monotonic()
+            try:
+                func(image_id)
+            except Exception as err:
+                LOG.error("Operation failed on the image '%s' of the "
+                          "backend '%s': %s" % (image_id, self.cloud_id, err))
+                return base.ImageResult(image_id, identifier, False, err,
+                                        time.monotonic() - start)
+            return base.ImageResult(image_id, identifier, True, None,
+                                    time.monotonic() - start)
+
+        workers = min(CONF.backend_workers, len(images))
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, images))
+
+    def _log_bulk(self, operation, results, start):
+        """Log the outcome of a bulk operation."""
+        failed = [result.image_id for result in results
+                  if not result.succeeded]
+        LOG.info("%s %d image(s) of the backend '%s' in %.1fs, %d failed%s" %
+                 (operation, len(results), self.cloud_id,
+                  time.monotonic() - start, len(failed),
+                  ": %s" % ', '.join(failed) if failed else ''))
+
+    def _deprecate_images(self, images, identifier=None):
+        """Mark images as deprecated.
+
+        The images are recorded at once in the journal, an interrupted
+        deprecation being completed by checking each of them again.
+
+        :param images: the images to mark
+        :type images: list
+        :param identifier: the identifier of the appliance, if there is a
+                           single one
+        :type identifier: str
+        :return: the result of each image
+        :rtype: list of base.ImageResult
+        """
+        start = time.monotonic()
+        entry_id = self._journal_begin(
+            journal.DEPRECATE, identifier,
+            image_ids=[image['id'] for image in images]
+        )
+        results = self._run_bulk(self._disable_image,
+                                 [(image['id'], image.get('IK_ID'))
+                                  for image in images])
+        self._journal_finish(entry_id)
+        self._log_bulk('Deprecated', results, start)
+        return results
 
     def deprecate_appliance(self, appliance_id):
         """Mark an appliance in glance as deprecated.
@@ -196,9 +729,8 @@ class OpenStackBackend(base.Backend):
         """
         LOG.info("Marking appliance '%s' as deprecated" % appliance_id)
         try:
-            glance = glanceclient.Client(session=self.connect())
-
-            glance_images = utils.find_images(glance, appliance_id)
+            glance_images = list(self._find_images(IK_ID=appliance_id,
+                                                   IK_STATUS='ENABLED'))
             if not glance_images:
                 LOG.error(
                     "Cannot mark image for removal: image '%s' "
@@ -210,11 +742,71 @@ class OpenStackBackend(base.Backend):
                       " for the backend '%s'" % (appliance_id, self.cloud_id))
             LOG.exception(err)
             raise exception.UnknownError(err)
-        properties = {'IK_STATUS': 'DISABLED'}
-        for image in glance_images:
-            LOG.debug("Marking image for removal: '%s'" % image.id)
-            glance.images.update(image.id, visibility='private', **properties)
-        return True
+        return all(result.succeeded for result in
+                   self._deprecate_images(glance_images, appliance_id))
+
+    def deprecate_many(self, appliance_ids):
+        """Mark several appliances as deprecated.
+
+        The enabled images are listed once, then marked concurrently.
+
+        :param appliance_ids: the ids of the appliances
+        :type appliance_ids: iterable
+        :return: the result of each image of the appliances
+        :rtype: list of base.ImageResult
+        """
+        appliance_ids = set(appliance_ids)
+        LOG.info("Marking %d appliance(s) as deprecated" %
+                 len(appliance_ids))
+        try:
+            glance_images = [image for image in
+                             self._find_images(IK_STATUS='ENABLED')
+                             if image.get('IK_ID') in appliance_ids]
+        except Exception as err:
+            LOG.error("Could not retrieve the image list for "
+                      "the backend '%s'" % self.cloud_id)
+            LOG.exception(err)
+            raise exception.UnknownError(exception=err)
+        return self._deprecate_images(glance_images)
+
+    def _disable_image(self, image_id):
+        """Mark an image as deprecated."""
+        LOG.debug("Marking image for removal: '%s'" % image_id)
+        self._update_catalogue(self._update_image(
+            image_id, visibility='private', IK_STATUS='DISABLED'
+        ))
+
+    def delete_appliances_bulk(self, image_ids=None):
+        """Delete several images concurrently.
+
+        :param image_ids: the ids of the images, by default all the
+                          images marked as DISABLED
+        :type image_ids: iterable
+        :return: the result of each image
+        :rtype: list of base.ImageResult
+        """
+        if image_ids is None:
+            # The matching images are retrieved before being deleted, as
+            # Glance rejects a page request whose marker has been deleted.
+            try:
+                images = [(image['id'], image.get('IK_ID')) for image in
+                          self._find_images(IK_STATUS='DISABLED')]
+            except Exception as err:
+                LOG.error("Could not retrieve the image list for "
+                          "the backend '%s'" % self.cloud_id)
+                LOG.exception(err)
+                raise exception.UnknownError(exception=err)
+        else:
+            images = [(image_id, None) for image_id in image_ids]
+
+        start = time.monotonic()
+        entry_id = self._journal_begin(
+            journal.DELETE, image_ids=[image_id for image_id, _ in images]
+        )
+        results = self._run_bulk(self._remove_image, images)
+        self._journal_finish(entry_id)
+        self._log_bulk('Deleted', results, start)
+        return results
 
     def delete_appliances(self):
         """Remove all appliances marked as DISABLED.
@@ -223,32 +815,77 @@ class OpenStackBackend(base.Backend):
         :rtype: bool
         """
         LOG.info("Cleaning up appliances")
-        glance = glanceclient.Client(session=self.connect())
         try:
-            img_generator = glance.images.list()
-            image_list = list(img_generator)
-        except Exception as err:
-            LOG.error("Could not retrieve the image list for "
-                      "the backend '%s'" % self.cloud_id)
-            LOG.exception(err)
+            results = self.delete_appliances_bulk()
+        except exception.UnknownError:
             return False
+        return all(result.succeeded for result in results)
 
-        is_deleted = True
-        for image in image_list:
-            if image.get('IK_STATUS') == 'DISABLED':
-                try:
-                    LOG.debug("Deleting image '%s'" % image['id'])
-                    glance.images.delete(image['id'])
-                    LOG.debug(
-                        "Image '%s' successfully deleted" % image['id']
-                    )
-                except Exception as err:
-                    LOG.error(
-                        "Image '%s' cannot be deleted" % image['id']
-                    )
-                    LOG.error(err)
-                    is_deleted = False
-        return is_deleted
+    def replay_journal(self, keep=()):
+        """Complete the operations interrupted by a previous run.
+
+        The images left by the interrupted uploads of the appliances that
+        are not about to be added again are deleted, the interrupted
+        deprecations and deletions are completed.
+
+        :param keep: the identifiers of the appliances about to be added,
+                     whose interrupted uploads can be reused
+        :type keep: iterable
+        :return: True if all the operations have been completed
+        :rtype: bool
+        """
+        if self.journal is None:
+            return True
+        keep = set(keep)
+        is_completed = True
+        for entry in self.journal.pending(self.cloud_id):
+            LOG.info("Completing the interrupted %s operation %s" %
+                     (entry.operation, entry.id))
+            try:
+                if entry.operation == journal.ADD:
+                    if entry.identifier in keep:
+                        continue
+                    image_id = entry.data.get('image_id')
+                    image = None
+                    if image_id is not None:
+                        image = self._get_image(image_id)
+                    if (image is not None and
+                            image.get('IK_STATUS') != 'ENABLED' and
+                            not self._delete_image(image_id)):
+                        is_completed = False
+                        continue
+                elif entry.operation == journal.DEPRECATE:
+                    for image_id in entry.data.get('image_ids', []):
+                        image = self._get_image(image_id)
+                        if (image is not None and
+                                image.get('IK_STATUS') == 'ENABLED'):
+                            self._disable_image(image_id)
+                elif entry.operation == journal.DELETE:
+                    image_ids = [
+                        image_id for image_id in entry.data.get('image_ids',
+                                                                [])
+                        if self._get_image(image_id) is not None
+                    ]
+                    if not all([self._delete_image(image_id)
+                                for image_id in image_ids]):
+                        is_completed = False
+                        continue
+            except Exception as err:
+                LOG.error("Could not complete the operation %s on the "
+                          "backend '%s'" % (entry.id, self.cloud_id))
+                LOG.exception(err)
+                is_completed = False
+                continue
+            self.journal.finish(entry.id)
+        return is_completed
+
+    def delete_appliance(self, **kwargs):
+        """Remove all appliances marked as DISABLED.
+
+        :return: True if the cleaning was successfull
+        :rtype: bool
+        """
+        return self.delete_appliances()
 
     def update_appliance(self, appliance):
         """Update an appliance stored in glance.
@@ -256,7 +893,7 @@ class OpenStackBackend(base.Backend):
         :param appliance:
         :type appliance:
         :return: True if the appliance could be successfully added
-        :rtype: bool 
+        :rtype: bool
         """
         LOG.info("Updating appliance '%s'" % appliance['id'])
         if not self.deprecate_appliance(appliance['id']):
@@ -275,6 +912,8 @@ class OpenStackBackend(base.Backend):
     def list_appliance(self, tag_name=None, tag_value=None):
         """List the appliance given a specific tag and value.
 
+        All the images are listed when no tag is given.
+
         :param tag_name: the name of the tag to filter against
         :type tag_name: str
         :param tag_value: the value of the tag
@@ -284,27 +923,30 @@ class OpenStackBackend(base.Backend):
         """
         LOG.debug("List appliances having the tag '%s' set with the "
                   "value '%s'" % (tag_name, tag_value))
-        image_list = []
-        glance = glanceclient.Client(session=self.connect())
+        appliance_list = []
+        properties = {}
+        if tag_name is not None:
+            properties[tag_name] = tag_value
 
         # On some Cloud, the user may not be allowed to list the
         # images. It is required to manage this case.
         try:
-            img_generator = glance.images.list()
-            image_list = list(img_generator)
-        except Exception as err:
-            LOG.error("Not authorized to retrieve the image list from "
-                      "this cloud: %s" % self.cloud_id)
-            LOG.exception(err)
-            return image_list
-        for image in image_list:
-            if image.get(tag_name) == tag_value:
-                if image.get('IMAGE_STATUS') == 'DISABLED':
+            for image in self._find_images(**properties):
+                if image.get('IK_STATUS') == 'DISABLED':
                     LOG.debug("Skipping deprecated image %s" % image['id'])
+                elif image.get('IK_STATUS') == 'UPLOADING':
+                    LOG.debug("Skipping incomplete image %s" % image['id'])
                 else:
                     LOG.debug(
                         "Appending image with id '%s' to the image "
                         "list." % (image['id'])
                     )
-                    image_list.append(image['id'])
-        return image_list
+                    appliance_list.append(image['id'])
+        except Exception as err:
+            LOG.error("Could not retrieve the image list from the "
+                      "backend '%s'" % self.cloud_id)
+            LOG.exception(err)
+            if isinstance(err, exception.ImagekeeperException):
+                raise
+            raise exception.UnknownError(exception=err)
+        return appliance_list
@@ -0,0 +1,398 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Asynchronous OpenStack backend class"""
+
+import asyncio
+import json
+import re
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.backend import asyncbase
+from imagekeeper.backend import base
+from imagekeeper.backend.connectors import openstack
+from imagekeeper.common import exception
+from imagekeeper.common import metrics
+from imagekeeper.common import utils
+from imagekeeper.image import stream
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# A token expiring within this number of seconds is renewed
+TOKEN_STALE_DURATION = 120
+
+JSON_PATCH = 'application/openstack-images-v2.1-json-patch'
+
+
+class AsyncOpenStackBackend(asyncbase.AsyncBackend):
+    """Asynchronous OpenStack backend.
+
+    The Glance v2 REST API is used directly through an asynchronous HTTP
+    client. The authentication is delegated to the keystoneauth session of
+    a synchronous backend, run in a thread when a token is requested.
+    """
+
+    def __init__(self, cloud_id, config, http_session=None):
+        """Class initialisation.
+
+        :param cloud_id: the name of the backend
+        :type cloud_id: str
+        :param config: the configuration data
+        :type config: dict
+        :param http_session: a HTTP client session shared with other
+                             backends, by default the backend has its own
+        :type http_session: aiohttp.ClientSession
+        """
+        self.cloud_id = cloud_id
+        self.config = config
+        self._keystone = openstack.OpenStackBackend(cloud_id, config)
+        self._http = http_session
+        self._own_http = http_session is None
+        self._endpoint = None
+        self._auth_lock = None
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call in a thread."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    @staticmethod
+    def _cached_token(keystone):
+        """Return the token of a session, None if it is about to expire."""
+        auth_ref = getattr(keystone.auth, 'auth_ref', None)
+        if auth_ref is None or auth_ref.will_expire_soon(
+                TOKEN_STALE_DURATION):
+            return None
+        return auth_ref.auth_token
+
+    async def _token(self):
+        """Return a valid token, requesting a new one if needed.
+
+        The token is requested in a thread, by one coroutine at a time.
+        """
+        keystone = self._keystone.connect()
+        token = self._cached_token(keystone)
+        if token is None:
+            async with self._auth_lock:
+                # Another coroutine may have renewed the token meanwhile
+                token = self._cached_token(keystone)
+                if token is None:
+                    token = await self._run(keystone.get_token)
+        return token
+
+    async def connect(self):
+        """Authenticate and retrieve the Glance endpoint.
+
+        :return: the Glance endpoint
+        :rtype: str
+        """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        if self._http is None:
+            self._http = asyncbase.client_session()
+        if self._endpoint is None:
+            await self._token()
+            endpoint = await self._run(self._keystone.connect().get_endpoint,
+                                       service_type='image',
+                                       interface='public')
+            # The API version is part of the paths
+            self._endpoint = re.sub(r'/v2(\.\d+)?/?$', '',
+                                    endpoint.rstrip('/'))
+        return self._endpoint
+
+    async def close(self):
+        """Release the connections of the backend."""
+        if self._own_http and self._http is not None:
+            await self._http.close()
+            self._http = None
+        self._keystone.disconnect()
+        self._endpoint = None
+
+    async def _request(self, method, path, expected=(200,), **kwargs):
+        """Send a request to Glance.
+
+        A request rejected because of an expired token is sent again with
+        a new token, unless its body is a stream.
+
+        :param method: the HTTP method
+        :type method: str
+        :param path: the path of the resource, or the absolute URL
+        :type path: str
+        :param expected: the status codes of a successful response
+        :type expected: tuple
+        :return: the decoded JSON body of the response, if any
+        :rtype: dict
+        """
+        url = path
+        if not url.startswith('http'):
+            url = await self.connect() + path
+        headers = kwargs.pop('headers', {})
+        for attempt in (1, 2):
+            headers['X-Auth-Token'] = await self._token()
+            async with self._http.request(method, url, headers=headers,
+                                          **kwargs) as response:
+                if metrics.enabled():
+                    metrics.REQUESTS.inc(backend=self.cloud_id, method=method,
+                                         status=response.status)
+                if (response.status == 401 and attempt == 1 and
+                        'data' not in kwargs):
+                    self._keystone.connect().invalidate()
+                    continue
+                if response.status not in expected:
+                    raise exception.BackendRequestError(
+                        method=method, url=url, status=response.status,
+                        reason=(await response.text())[:200]
+                    )
+                if response.content_type == 'application/json':
+                    return await response.json()
+                return None
+
+    async def _list_images(self, **properties):
+        """List the images matching a set of properties from Glance.
+
+        :return: the matching images, retrieved one page at a time
+        :rtype: async iterator
+        """
+        params = dict(properties)
+        if 'tags' in params:
+            params['tag'] = params.pop('tags')
+        params['limit'] = CONF.image_page_size
+        path = '/v2/images'
+        while path:
+            body = await self._request('GET', path, params=params)
+            for image in body.get('images', []):
+                yield image
+            path = body.get('next')
+            # The query of the next page is part of its path
+            params = None
+
+    async def get_image_list(self, properties=None):
+        """Return the list of images.
+
+        :param properties: a list of properties to use for filtering
+        :type properties: dict
+        :return: the matching images
+        :rtype: list
+        """
+        try:
+            return [image async for image in
+                    self._list_images(**(properties or {}))]
+        except Exception as err:
+            raise exception.UnknownError(exception=err)
+
+    async def _update_image(self, image, **properties):
+        """Update the properties of an image.
+
+        :param image: the current image
+        :type image: dict
+        :return: the updated image
+        :rtype: dict
+        """
+        patch = [{'op': 'replace' if key in image else 'add',
+                  'path': '/%s' % key, 'value': value}
+                 for key, value in properties.items()]
+        return await self._request(
+            'PATCH', '/v2/images/%s' % image['id'], data=json.dumps(patch),
+            headers={'Content-Type': JSON_PATCH}
+        )
+
+    async def _read_chunks(self, image_data):
+        """Read an image in a thread, one chunk at a time."""
+        while True:
+            chunk = await self._run(image_data.read, CONF.upload_chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    async def add_appliance(self, appliance, image_data=None):
+        """Add an appliance.
+
+        The image is only marked as ENABLED once the checksums match the
+        appliance and the image stored by Glance, otherwise it is deleted.
+
+        :param appliance: an appliance to add to Glance
+        :type appliance: dict
+        :param image_data: a reader for the image, by default the image
+                           file is opened
+        :type image_data: stream.ChecksumReader
+        :return: the id of the Glance image, False if the appliance could
+                 not be added
+        :rtype: str
+        """
+        LOG.info('Adding appliance: ' + appliance['title'])
+        min_ram = max(appliance['min_ram'] or 0, CONF.min_ram)
+        checksum = appliance['checksum']
+        checksum_algo = utils.checksum_algorithm(checksum)
+        if image_data is None:
+            try:
+                image_data = stream.open_image(appliance)
+            except (IOError, OSError) as err:
+                LOG.error("Cannot open image file: '%s'" %
+                          appliance['location'])
+                LOG.exception(err)
+                return False
+
+        image = {
+            'name': appliance['title'],
+            'disk_format': str.lower(appliance['format']),
+            'container_format': 'bare',
+            'visibility': CONF.image_visibility,
+            'IK_ID': appliance['identifier'],
+            'IK_STATUS': 'UPLOADING',
+        }
+        if appliance.get('version'):
+            image['IK_VERSION'] = appliance['version']
+
+        glance_image = None
+        try:
+            with image_data:
+                glance_image = await self._request('POST', '/v2/images',
+                                                   expected=(201,),
+                                                   json=image)
+                await self._request(
+                    'PUT', '/v2/images/%s/file' % glance_image['id'],
+                    expected=(204,), data=self._read_chunks(image_data),
+                    headers={'Content-Type': 'application/octet-stream'}
+                )
+            if checksum_algo:
+                utils.verify_checksum(appliance['title'], checksum_algo,
+                                      checksum,
+                                      image_data.hexdigest(checksum_algo))
+
+            properties = {
+                'IK_HASH_ALGO': CONF.image_hash_algo,
+                'IK_HASH_VALUE': image_data.hexdigest(CONF.image_hash_algo),
+            }
+            if min_ram > 0:
+                properties['min_ram'] = min_ram
+            glance_image = await self._update_image(glance_image,
+                                                    **properties)
+
+            # Make sure that Glance stored the data that has been read
+            utils.verify_checksum(appliance['title'], 'md5',
+                                  image_data.hexdigest('md5'),
+                                  glance_image.get('checksum'))
+            hash_algo = glance_image.get('os_hash_algo')
+            if hash_algo in image_data.algorithms:
+                utils.verify_checksum(appliance['title'], hash_algo,
+                                      image_data.hexdigest(hash_algo),
+                                      glance_image.get('os_hash_value'))
+
+            glance_image = await self._update_image(glance_image,
+                                                    IK_STATUS='ENABLED')
+        except Exception as err:
+            LOG.error("Could not add the appliance '%s' to the backend "
+                      "'%s'" % (appliance['title'], self.cloud_id))
+            LOG.exception(err)
+            if glance_image is not None:
+                await self._run_bulk(self._delete_image,
+                                     [glance_image['id']])
+            return False
+        return glance_image['id']
+
+    async def _run_bulk(self, func, images):
+        """Run an operation on several images concurrently.
+
+        The number of requests sent at once is bounded by the connection
+        pool of the HTTP session. A failure is recorded in the result of
+        its image and does not stop the other operations.
+
+        :param func: coroutine function run on each image, called as
+                     ``func(image)``
+        :type func: callable
+        :param images: the images, or their ids
+        :type images: list
+        :return: the result of each image, in order
+        :rtype: list of base.ImageResult
+        """
+        async def run(image):
+            if not isinstance(image, dict):
+                image = {'id': image}
+            start = time.monotonic()
+            try:
+                await func(image)
+            except Exception as err:
+                LOG.error("Operation failed on the image '%s' of the "
+                          "backend '%s': %s" % (image['id'], self.cloud_id,
+                                                err))
+                return base.ImageResult(image['id'], image.get('IK_ID'),
+                                        False, err, time.monotonic() - start)
+            return base.ImageResult(image['id'], image.get('IK_ID'), True,
+                                    None, time.monotonic() - start)
+
+        await self.connect()
+        return list(await asyncio.gather(*[run(image) for image in images]))
+
+    async def _disable_image(self, image):
+        """Mark an image as deprecated."""
+        LOG.debug("Marking image for removal: '%s'" % image['id'])
+        await self._update_image(image, visibility='private',
+                                 IK_STATUS='DISABLED')
+
+    async def _delete_image(self, image):
+        """Delete an image."""
+        LOG.debug("Deleting image '%s'" % image['id'])
+        await self._request('DELETE', '/v2/images/%s' % image['id'],
+                            expected=(204, 404))
+
+    async def deprecate_appliance(self, appliance_id):
+        """Mark an appliance in glance as deprecated.
+
+        :param appliance_id: the id of the appliance
+        :type appliance_id: str
+        :return: True if the appliance has been successfully marked
+        :rtype: bool
+        """
+        LOG.info("Marking appliance '%s' as deprecated" % appliance_id)
+        images = await self.get_image_list({'IK_ID': appliance_id,
+                                            'IK_STATUS': 'ENABLED'})
+        if not images:
+            LOG.error("Cannot mark image for removal: image '%s' "
+                      "not found" % appliance_id)
+            return False
+        results = await self._run_bulk(self._disable_image, images)
+        return all(result.succeeded for result in results)
+
+    async def deprecate_many(self, appliance_ids):
+        """Mark several appliances as deprecated.
+
+        :param appliance_ids: the ids of the appliances
+        :type appliance_ids: iterable
+        :return: the result of each image of the appliances
+        :rtype: list of base.ImageResult
+        """
+        appliance_ids = set(appliance_ids)
+        images = [image for image in
+                  await self.get_image_list({'IK_STATUS': 'ENABLED'})
+                  if image.get('IK_ID') in appliance_ids]
+        return await self._run_bulk(self._disable_image, images)
+
+    async def delete_appliances_bulk(self, image_ids=None):
+        """Delete several images concurrently.
+
+        :param image_ids: the ids of the images, by default all the
+                          images marked as DISABLED
+        :type image_ids: iterable
+        :return: the result of each image
+        :rtype: list of base.ImageResult
+        """
+        if image_ids is None:
+            images = await self.get_image_list({'IK_STATUS': 'DISABLED'})
+        else:
+            images = list(image_ids)
+        return await self._run_bulk(self._delete_image, images)
@@ -12,69 +12,251 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""Class for managing backends."""
+"""Class for managing backends.
 
+The backend file is compiled once into a validated model, cached for the
+process and keyed by the modification time and the digest of the file, so
+that an unchanged file is neither parsed nor validated again. The
+connectors are only created when a backend is first used, and are kept
+when the file is reloaded, unless their configuration has changed.
+"""
+
+import collections
+import hashlib
 import json
 import os
+import threading
 
 from oslo_config import cfg
+from oslo_log import log
 
-from imagekeeper.common import exception
 from imagekeeper.backend import connectors
+from imagekeeper.common import exception
 
+LOG = log.getLogger(__name__)
 CONF = cfg.CONF
 
+# Keys of a backend in the backend file, and their types
+SCHEMA = {
+    'name': str,
+    'type': str,
+    'parameters': dict
+}
+
+# Validated configuration of a backend, the digest identifying it
+BackendConfig = collections.namedtuple(
+    'BackendConfig', ['name', 'type', 'parameters', 'digest']
+)
+
+BackendFileDiff = collections.namedtuple(
+    'BackendFileDiff', ['added', 'changed', 'removed']
+)
+
+# Compiled backend files, indexed by path
+_COMPILED = {}
+_LOCK = threading.Lock()
+
+
+class CompiledBackendFile(object):
+    """Validated content of a backend file."""
+
+    def __init__(self, path, stat, digest, backends):
+        """Initialize the class.
+
+        :param path: the path of the backend file
+        :type path: str
+        :param stat: the modification time and size of the file
+        :type stat: tuple
+        :param digest: the sha256 digest of the file
+        :type digest: str
+        :param backends: the configuration of each backend, indexed by name
+        :type backends: collections.OrderedDict
+        """
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+        self.backends = backends
+
+    def __len__(self):
+        """Return the number of backends."""
+        return len(self.backends)
+
+
+def _validate(json_data):
+    """Validate the structure of the JSON configuration file.
+
+    :return: the reason why the file is invalid, None if it is valid
+    :rtype: str
+    """
+    if not isinstance(json_data, list):
+        return "a list of backends is expected"
+    names = set()
+    for index, backend in enumerate(json_data):
+        if not isinstance(backend, dict) or set(backend) != set(SCHEMA):
+            return ("backend #%d must have the keys %s" %
+                    (index, ', '.join(sorted(SCHEMA))))
+        for key in SCHEMA:
+            if not isinstance(backend[key], SCHEMA[key]):
+                return ("the %s of backend #%d must be a %s" %
+                        (key, index, SCHEMA[key].__name__))
+        if backend['name'] in names:
+            return "the backend name '%s' is duplicated" % backend['name']
+        names.add(backend['name'])
+    return None
+
+
+def _compile(path, stat, data):
+    """Parse and validate the content of a backend file."""
+    try:
+        backend_configs = json.loads(data.decode('utf-8'))
+    except ValueError as err:
+        raise exception.InvalidBackendFile(backend_file=path, exception=err)
+    reason = _validate(backend_configs)
+    if reason is not None:
+        raise exception.InvalidBackendFile(backend_file=path,
+                                           exception=reason)
+    backends = collections.OrderedDict()
+    for backend in backend_configs:
+        digest = hashlib.sha256(
+            json.dumps(backend, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        backends[backend['name']] = BackendConfig(
+            backend['name'], backend['type'], backend['parameters'], digest
+        )
+    return CompiledBackendFile(path, stat, hashlib.sha256(data).hexdigest(),
+                               backends)
+
+
+def compile_backend_file(cloud_backend_path):
+    """Return the validated content of a backend file.
+
+    The file is only read again when its modification time or size has
+    changed, and only parsed again when its content has changed.
+
+    :param cloud_backend_path: the path of the backend file
+    :type cloud_backend_path: str
+    :return: the compiled backend file
+    :rtype: CompiledBackendFile
+    """
+    try:
+        stat = os.stat(cloud_backend_path)
+    except OSError as err:
+        raise exception.BackendFileNotFound(backend_file=cloud_backend_path,
+                                            exception=err)
+    stat = (stat.st_mtime_ns, stat.st_size)
+    with _LOCK:
+        compiled = _COMPILED.get(cloud_backend_path)
+        if compiled is not None and compiled.stat == stat:
+            return compiled
+    with open(cloud_backend_path, 'rb') as config_file:
+        data = config_file.read()
+    with _LOCK:
+        compiled = _COMPILED.get(cloud_backend_path)
+        if (compiled is not None and
+                compiled.digest == hashlib.sha256(data).hexdigest()):
+            # Touched but not modified
+            compiled.stat = stat
+            return compiled
+        compiled = _compile(cloud_backend_path, stat, data)
+        _COMPILED[cloud_backend_path] = compiled
+        return compiled
+
 
 class BackendManager(object):
     """A class for managing Cloud backends."""
 
-    def __init__(self):
-        """Initialize the class."""
-        self.backends = {}
-        self.schema = {
-            'name': str,
-            'type': str,
-            'parameters': dict
-        }
-        if not os.path.isfile(CONF.cloud_backend_path):
-            raise exception.BackendFileNotFound(
-                cloud_backend_file=CONF.cloud_backend_path,
-            )
-
-        # parse config file
-        self._parse_config_file(CONF.cloud_backend_path)
+    def __init__(self, cloud_backend_path=None):
+        """Initialize the class.
+
+        :param cloud_backend_path: the path of the backend file, by default
+                                   the cloud_backend_path option
+        :type cloud_backend_path: str
+        """
+        self.path = cloud_backend_path or CONF.cloud_backend_path
+        self.schema = SCHEMA
         self.backend_handler = connectors.CloudConnectorHandler()
+        self.config = compile_backend_file(self.path)
+        self.backends = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of backends."""
+        return len(self.config)
+
+    def names(self):
+        """Return the names of the backends."""
+        return list(self.config.backends)
+
+    def get_backend(self, name):
+        """Return a backend, creating its connector when first used.
+
+        :param name: the name of the backend
+        :type name: str
+        :return: the backend
+        :rtype: base.Backend
+        """
+        with self._lock:
+            backend = self.backends.get(name)
+            if backend is not None:
+                return backend
+            backend_config = self.config.backends.get(name)
+            if backend_config is None:
+                raise exception.BackendNotFound(
+                    backend=name, exception='not in the backend file'
+                )
+            handler = self.backend_handler.load_handler(backend_config.type)
+            if handler is None:
+                raise exception.BackendNotFound(
+                    backend=name,
+                    exception="unknown type '%s'" % backend_config.type
+                )
+            backend = handler(name, dict(backend_config.parameters))
+            self.backends[name] = backend
+            return backend
 
     def get_backends(self):
-        """Return the backend list."""
-        return self.backends
-
-    def _parse_config_file(self, cloud_backend_path):
-        """Parse the backend configuration file."""
-        config_file = open(cloud_backend_path, 'r')
-        backend_configs = json.load(config_file)
-        if not self._validate(backend_configs):
-            raise exception.InvalidBackendFile(
-                cloud_backend_file=CONF.cloud_backend_path,
-            )
-        for backend in backend_configs:
-            handler = self.backend_handler.load_handler(
-                backend['type']
-            )
-            self.backends[backend['name']] = handler(
-                parameters=backend['parameters']
-            )
-
-    def _validate(self, json_data):
-        """Validate the structure of the JSON configuration file."""
-        name_list = []
-        for backend in json_data:
-            if set(backend) != set(self.schema):
-                return False
-            for key in self.schema:
-                if not isinstance(backend[key], self.schema[key]):
-                    return False
-            if backend['name'] in name_list:
-                return False
-            name_list.append(backend['name'])
-        return True
+        """Return the backend list.
+
+        :return: the backends, indexed by name
+        :rtype: collections.OrderedDict
+        """
+        return collections.OrderedDict(
+            (name, self.get_backend(name)) for name in self.names()
+        )
+
+    def close(self):
+        """Disconnect the backends created so far."""
+        with self._lock:
+            for backend in self.backends.values():
+                backend.disconnect()
+
+    def refresh(self):
+        """Load the backend file again if it has been modified.
+
+        The connectors of the backends removed or changed are disconnected
+        and dropped, the changed ones being created again when used. The
+        connectors of the unchanged backends are kept.
+
+        :return: the names of the backends added, changed and removed since
+                 the previous loading
+        :rtype: BackendFileDiff
+        """
+        config = compile_backend_file(self.path)
+        if config is self.config:
+            return BackendFileDiff([], [], [])
+        previous = self.config.backends
+        added = [name for name in config.backends if name not in previous]
+        changed = [name for name, backend in config.backends.items()
+                   if name in previous and
+                   previous[name].digest != backend.digest]
+        removed = [name for name in previous if name not in config.backends]
+        with self._lock:
+            self.config = config
+            for name in changed + removed:
+                backend = self.backends.pop(name, None)
+                if backend is not None:
+                    backend.disconnect()
+        if added or changed or removed:
+            LOG.info("Backend file reloaded: %d added, %d changed, %d "
+                     "removed" % (len(added), len(changed), len(removed)))
+        return BackendFileDiff(added, changed, removed)
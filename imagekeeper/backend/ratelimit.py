@@ -0,0 +1,275 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Rate limiting and adaptive concurrency of the requests to a backend.
+
+The requests sent to a backend first take a token from a bucket refilled
+at a fixed rate, then a slot among a number of concurrent requests adapted
+to the backend: the limit grows by one slot per window of successful
+requests (additive increase) and is halved when the backend is overloaded
+or slower than the latency target (multiplicative decrease).
+
+The limiter is configured in the ``parameters`` block of a backend in the
+backend file, for example::
+
+  "rate_limit": 10,
+  "rate_burst": 20,
+  "min_concurrency": 1,
+  "max_concurrency": 16,
+  "latency_target": 5
+"""
+
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import exception
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# HTTP statuses telling that a backend is overloaded
+OVERLOAD_STATUSES = frozenset([413, 429, 503])
+
+
+class TokenBucket(object):
+    """Token bucket limiting the rate of the requests."""
+
+    def __init__(self, rate, burst=None):
+        """Initialize the class.
+
+        :param rate: the number of tokens added per second, 0 for no limit
+        :type rate: float
+        :param burst: the maximum number of tokens, by default the rate
+        :type burst: float
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Add the tokens accumulated since the last update."""
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+
+    def acquire(self):
+        """Take a token, waiting for it if needed.
+
+        The token is reserved right away, so that the waiting callers are
+        served in order. Without rate, only the holds are waited for.
+
+        :return: the time waited in seconds
+        :rtype: float
+        """
+        if not self.rate:
+            delay = self._updated - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+                return delay
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            # During a hold, the tokens are added from its end only
+            delay = (max(0.0, self._updated - now) +
+                     max(0.0, -self._tokens) / self.rate)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def hold(self, delay):
+        """Stop handing out tokens for some time.
+
+        The hold applies whether a rate is set or not.
+
+        :param delay: the time in seconds, as asked by the backend
+        :type delay: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = max(self._updated, now + delay)
+
+
+class AdaptiveLimit(object):
+    """Limit of concurrent requests adapted with AIMD."""
+
+    def __init__(self, minimum, maximum, initial=None, latency_target=0,
+                 decrease=0.5):
+        """Initialize the class.
+
+        :param minimum: the minimum number of concurrent requests
+        :type minimum: int
+        :param maximum: the maximum number of concurrent requests
+        :type maximum: int
+        :param initial: the initial limit, by default the maximum
+        :type initial: float
+        :param latency_target: the latency in seconds above which the
+                               limit is decreased, 0 to ignore the latency
+        :type latency_target: float
+        :param decrease: the factor applied to decrease the limit
+        :type decrease: float
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(initial or maximum)
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cooldown_until = 0.0
+        self._slots = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting for one to be free."""
+        with self._slots:
+            while self.in_flight >= int(self.limit):
+                self._slots.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """Free a slot and adapt the limit to the outcome of the request.
+
+        :param latency: the time taken by the request in seconds, None if
+                        it does not reflect the load of the backend
+        :type latency: float
+        :param overloaded: whether the backend rejected the request
+        :type overloaded: bool
+        """
+        with self._slots:
+            self.in_flight -= 1
+            now = time.monotonic()
+            slow = (self.latency_target and latency is not None and
+                    latency > self.latency_target)
+            if overloaded or slow:
+                # Decrease once per round trip, the requests already sent
+                # were sent with the previous limit
+                if now >= self._cooldown_until:
+                    self.limit = max(self.minimum,
+                                     self.limit * self.decrease)
+                    self._cooldown_until = now + (latency or 1.0)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._slots.notify_all()
+
+
+class RateLimiter(object):
+    """Rate limiter and adaptive concurrency of a backend."""
+
+    def __init__(self, name, rate=0, burst=None, min_concurrency=1,
+                 max_concurrency=None, latency_target=0):
+        """Initialize the class.
+
+        :param name: the name of the backend
+        :type name: str
+        :param rate: the maximum number of requests per second, 0 for no
+                     limit
+        :type rate: float
+        :param burst: the number of requests that can be sent at once
+                      before the rate applies, by default the rate
+        :type burst: float
+        :param min_concurrency: the minimum number of concurrent requests
+        :type min_concurrency: int
+        :param max_concurrency: the maximum number of concurrent requests,
+                                by default the backend_workers option
+        :type max_concurrency: int
+        :param latency_target: the latency in seconds above which the
+                               concurrency is decreased, 0 to ignore it
+        :type latency_target: float
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveLimit(
+            min_concurrency, max_concurrency or CONF.backend_workers,
+            latency_target=latency_target
+        )
+
+    @classmethod
+    def from_config(cls, name, config):
+        """Create the limiter of a backend from its configuration.
+
+        :param name: the name of the backend
+        :type name: str
+        :param config: the parameters of the backend
+        :type config: dict
+        :return: the limiter
+        :rtype: RateLimiter
+        """
+        options = {}
+        for option, key, convert in (
+                ('rate', 'rate_limit', float),
+                ('burst', 'rate_burst', float),
+                ('min_concurrency', 'min_concurrency', int),
+                ('max_concurrency', 'max_concurrency', int),
+                ('latency_target', 'latency_target', float)):
+            if key not in config:
+                continue
+            try:
+                options[option] = convert(config[key])
+            except (TypeError, ValueError):
+                options[option] = -1
+            if options[option] < 0:
+                raise exception.InvalidBackendOption(
+                    backend=name, option=key,
+                    reason="a positive number is expected"
+                )
+        limiter = cls(name, **options)
+        if not (1 <= limiter.concurrency.minimum <=
+                limiter.concurrency.maximum):
+            raise exception.InvalidBackendOption(
+                backend=name, option='min_concurrency',
+                reason="it must be between 1 and max_concurrency"
+            )
+        return limiter
+
+    @property
+    def limit(self):
+        """Return the current number of concurrent requests allowed."""
+        return int(self.concurrency.limit)
+
+    def acquire(self):
+        """Wait until a request can be sent to the backend."""
+        self.bucket.acquire()
+        self.concurrency.acquire()
+
+    def release(self, latency=None, status=None, timed_out=False,
+                retry_after=None):
+        """Record the outcome of a request sent to the backend.
+
+        :param latency: the time taken by the request in seconds, None if
+                        it does not reflect the load of the backend
+        :type latency: float
+        :param status: the HTTP status of the response, if any
+        :type status: int
+        :param timed_out: whether the request timed out
+        :type timed_out: bool
+        :param retry_after: the delay in seconds asked by the backend
+        :type retry_after: float
+        """
+        overloaded = timed_out or status in OVERLOAD_STATUSES
+        previous = self.limit
+        self.concurrency.release(latency, overloaded)
+        if overloaded:
+            if retry_after:
+                self.bucket.hold(retry_after)
+            if self.limit < previous:
+                LOG.warning("Backend '%s' is overloaded, reducing the "
+                            "concurrency to %d" % (self.name, self.limit))
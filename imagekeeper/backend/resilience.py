@@ -0,0 +1,304 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Retries, circuit breaker and time budget of the calls to a backend.
+
+The methods of a connector are wrapped with the ``idempotent`` decorator,
+retrying them on transient errors with a jittered exponential backoff, or
+with the ``guarded`` decorator for the calls that cannot be repeated. Both
+go through the circuit breaker of the backend, which fails the calls at
+once after too many consecutive failures, and stop when the time budget of
+the run is exhausted. A connector enables them by setting its
+``resilience`` attribute, the default values being overridden in the
+``parameters`` block of the backend in the backend file::
+
+  "retry_attempts": 5,
+  "retry_delay": 0.5,
+  "retry_max_delay": 10,
+  "breaker_threshold": 3,
+  "breaker_reset_timeout": 120
+"""
+
+import functools
+import random
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import exception
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# HTTP statuses of the errors worth retrying
+TRANSIENT_STATUSES = frozenset([408, 413, 429, 500, 502, 503, 504])
+
+
+class RunBudget(object):
+    """Time allowed to a synchronization run."""
+
+    def __init__(self, seconds=None):
+        """Initialize the class.
+
+        :param seconds: the time allowed in seconds, 0 for no limit, by
+                        default the run_budget option
+        :type seconds: float
+        """
+        if seconds is None:
+            seconds = CONF.run_budget
+        self.seconds = seconds
+        self.deadline = None
+        if seconds:
+            self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        """Return the time left in seconds, None if there is no limit."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def expired(self):
+        """Return whether the budget has been spent."""
+        return self.remaining() == 0.0
+
+    def check(self, name):
+        """Raise an exception if the budget has been spent.
+
+        :param name: the name of the backend called
+        :type name: str
+        """
+        if self.expired:
+            raise exception.RunBudgetExhausted(backend=name,
+                                               budget=self.seconds)
+
+
+class CircuitBreaker(object):
+    """Stop calling a backend failing repeatedly.
+
+    The circuit opens after ``threshold`` consecutive failures: the calls
+    fail at once during ``reset_timeout`` seconds, then a single call is
+    let through to probe the backend, closing the circuit if it succeeds.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold, reset_timeout):
+        """Initialize the class.
+
+        :param name: the name of the backend
+        :type name: str
+        :param threshold: the number of consecutive failures opening the
+                          circuit
+        :type threshold: int
+        :param reset_timeout: the time in seconds before probing again
+        :type reset_timeout: float
+        """
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise an exception if the backend must not be called."""
+        with self._lock:
+            if self.state == self.OPEN:
+                wait = self._opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    raise exception.BackendUnavailable(backend=self.name,
+                                                       delay=int(wait) + 1)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise exception.BackendUnavailable(backend=self.name,
+                                                       delay=0)
+                self._probing = True
+
+    def record_success(self):
+        """Record that the backend answered."""
+        with self._lock:
+            if self.state != self.CLOSED:
+                LOG.info("Backend '%s' is available again" % self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """Record that the backend could not be reached."""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if (self.state == self.HALF_OPEN or
+                    (self.state == self.CLOSED and
+                     self.failures >= self.threshold)):
+                LOG.warning("Backend '%s' failed %d time(s) in a row, not "
+                            "calling it for %ds" %
+                            (self.name, self.failures, self.reset_timeout))
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Resilience(object):
+    """Retries, circuit breaker and time budget of a backend."""
+
+    def __init__(self, name, transient=None, attempts=None, delay=None,
+                 max_delay=None, threshold=None, reset_timeout=None):
+        """Initialize the class.
+
+        The values not set are taken from the options of the same name.
+
+        :param name: the name of the backend
+        :type name: str
+        :param transient: callable telling whether an exception is worth
+                          retrying, by default none is
+        :type transient: callable
+        :param attempts: the maximum number of attempts of a call
+        :type attempts: int
+        :param delay: the base delay between two attempts in seconds
+        :type delay: float
+        :param max_delay: the maximum delay between two attempts
+        :type max_delay: float
+        :param threshold: the number of consecutive failures opening the
+                          circuit breaker
+        :type threshold: int
+        :param reset_timeout: the time in seconds the circuit stays open
+        :type reset_timeout: float
+        """
+        self.name = name
+        self.transient = transient or (lambda error: False)
+        self.attempts = (CONF.retry_attempts if attempts is None
+                         else attempts)
+        self.delay = CONF.retry_delay if delay is None else delay
+        self.max_delay = (CONF.retry_max_delay if max_delay is None
+                          else max_delay)
+        self.breaker = CircuitBreaker(
+            name,
+            CONF.breaker_threshold if threshold is None else threshold,
+            CONF.breaker_reset_timeout if reset_timeout is None
+            else reset_timeout
+        )
+        # Time budget of the current run, set by the synchronization engine
+        self.budget = None
+
+    @classmethod
+    def from_config(cls, name, config, transient=None):
+        """Create the resilience layer of a backend from its configuration.
+
+        :param name: the name of the backend
+        :type name: str
+        :param config: the parameters of the backend
+        :type config: dict
+        :param transient: callable telling whether an exception is worth
+                          retrying
+        :type transient: callable
+        :return: the resilience layer
+        :rtype: Resilience
+        """
+        options = {}
+        for option, key, convert, minimum in (
+                ('attempts', 'retry_attempts', int, 1),
+                ('delay', 'retry_delay', float, 0),
+                ('max_delay', 'retry_max_delay', float, 0),
+                ('threshold', 'breaker_threshold', int, 1),
+                ('reset_timeout', 'breaker_reset_timeout', float, 0)):
+            if key not in config:
+                continue
+            try:
+                options[option] = convert(config[key])
+            except (TypeError, ValueError):
+                options[option] = minimum - 1
+            if options[option] < minimum:
+                raise exception.InvalidBackendOption(
+                    backend=name, option=key,
+                    reason="a number of at least %d is expected" % minimum
+                )
+        return cls(name, transient, **options)
+
+    def backoff(self, attempt):
+        """Return the delay before a new attempt, with full jitter.
+
+        :param attempt: the number of attempts already made
+        :type attempt: int
+        :rtype: float
+        """
+        # The jitter only spreads the retries, it needs no secure source
+        return random.uniform(0, min(self.max_delay,  # nosec B311
+                                     self.delay * 2 ** (attempt - 1)))
+
+    def call(self, func, idempotent, *args, **kwargs):
+        """Call a function of the backend.
+
+        :param func: the function
+        :type func: callable
+        :param idempotent: whether the call can be repeated
+        :type idempotent: bool
+        :return: the result of the function
+        """
+        attempt = 0
+        while True:
+            if self.budget is not None:
+                self.budget.check(self.name)
+            self.breaker.allow()
+            attempt += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                if not self.transient(err):
+                    # The backend answered, the call itself is wrong
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not idempotent or attempt >= self.attempts:
+                    raise
+                delay = self.backoff(attempt)
+                remaining = (self.budget.remaining()
+                             if self.budget is not None else None)
+                if remaining is not None and remaining < delay:
+                    raise
+                LOG.warning("Call to the backend '%s' failed (%s), retrying "
+                            "in %.1fs (attempt %d/%d)" %
+                            (self.name, err, delay, attempt + 1,
+                             self.attempts))
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+
+def _wrap(func, idempotent):
+    """Return a method going through the resilience layer of its object."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.resilience is None:
+            return func(self, *args, **kwargs)
+        return self.resilience.call(func, idempotent, self, *args, **kwargs)
+    return wrapper
+
+
+def idempotent(func):
+    """Decorate a method that can be retried on transient errors."""
+    return _wrap(func, True)
+
+
+def guarded(func):
+    """Decorate a method that must not be repeated."""
+    return _wrap(func, False)
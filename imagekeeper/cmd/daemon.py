@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Starter script for the ImageKeeper daemon.
+
+The daemon synchronizes the backends periodically until it receives
+SIGTERM or SIGINT, then completes the uploads in progress and exits.
+
+The image store and its users are imported once the image list and the
+backend file have been read, so that a wrong configuration is reported
+without loading them.
+"""
+
+import signal
+import sys
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.backend import manager as backend_manager
+from imagekeeper.common import config
+from imagekeeper.common import exception
+from imagekeeper.common import metrics
+from imagekeeper.image import manager as image_manager
+from imagekeeper.sync import daemon
+from imagekeeper.sync import state
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+
+def main():
+    """Imagekeeper daemon script."""
+    config.parse_args(sys.argv)
+    log.setup(CONF, 'imagekeeper')
+
+    images = image_manager.ImageListManager()
+    backends = backend_manager.BackendManager()
+    if not backends:
+        raise exception.NoBackendDefined(
+            cloud_config=CONF.cloud_backend_path,
+            exception='the backend list is empty'
+        )
+
+    from imagekeeper.image import convert
+    from imagekeeper.image import download
+    from imagekeeper.image import store as image_store
+    from imagekeeper.sync import journal
+
+    metrics.setup()
+    sync_state = state.SyncState()
+    store = image_store.ImageStore()
+    sync_journal = journal.Journal()
+    downloader = download.Downloader(store)
+    converter = convert.Converter(store)
+    sync_daemon = daemon.SyncDaemon(images, backends, sync_state, store,
+                                    sync_journal, downloader, converter)
+    signal.signal(signal.SIGTERM, sync_daemon.stop)
+    signal.signal(signal.SIGINT, sync_daemon.stop)
+    try:
+        sync_daemon.run()
+    finally:
+        backends.close()
+        converter.close()
+        downloader.close()
+        sync_journal.close()
+        store.close()
+        sync_state.close()
+        metrics.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as err:
+        sys.stderr.write(err.__str__())
+        sys.exit(1)
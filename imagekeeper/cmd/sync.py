@@ -13,29 +13,131 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""Starter script for ImageKeeper."""
+"""Starter script for ImageKeeper.
+
+The modules are imported by the functions needing them: printing the
+version or checking the configuration does not import the synchronization
+engine nor the clients of the cloud backends, so that the script starts
+fast when run from cron or from health probes.
+"""
 
 import sys
 
-from oslo_config import cfg
-from oslo_log import log
 
-from imagekeeper.common import config
-from imagekeeper.common import exception
-from imagekeeper.backend import manager as backend_manager
-from imagekeeper.image import manager as image_manager
+def print_version():
+    """Print the version of imagekeeper."""
+    from imagekeeper import version
+
+    sys.stdout.write("%s\n" % version.version_string())
+
+
+def print_plan(plans):
+    """Print the operations needed to synchronize the backends.
+
+    :param plans: the plan of each backend, indexed by backend name
+    :type plans: dict
+    """
+    sys.stdout.write("Synchronization plan:\n")
+    for name, plan in plans.items():
+        sys.stdout.write("  %s: %d operation(s), %d up to date\n" %
+                         (name, len(plan), plan.up_to_date))
+        for action in plan:
+            sys.stdout.write("    %s\n" % action)
+
+
+def check_config():
+    """Check the configuration, the image list and the backend file.
+
+    The backends are not created, only their type is checked.
+    """
+    from oslo_config import cfg
+
+    from imagekeeper.backend import connectors
+    from imagekeeper.backend import manager as backend_manager
+    from imagekeeper.common import config
+    from imagekeeper.common import exception
+    from imagekeeper.image import manager as image_manager
+
+    CONF = cfg.CONF
+    # The values are only checked against their type when read
+    for opt in config.DEFAULT_OPTS:
+        getattr(CONF, opt.dest)
+    images = image_manager.ImageListManager()
+    backend_file = backend_manager.compile_backend_file(
+        CONF.cloud_backend_path
+    )
+    supported = connectors.CloudConnectorHandler().get_supported_handler()
+    for backend in backend_file.backends.values():
+        if backend.type not in supported:
+            raise exception.BackendNotFound(
+                backend=backend.name,
+                exception="unknown type '%s'" % backend.type
+            )
+    sys.stdout.write("Configuration OK: %d appliance(s), %d backend(s)\n" %
+                     (len(images), len(backend_file)))
+
+
+def execute(sync_engine, plans):
+    """Run a synchronization plan.
+
+    :param sync_engine: the synchronization engine
+    :type sync_engine: sync.engine.SyncEngine
+    :param plans: the plan of each backend, indexed by backend name
+    :type plans: dict
+    :return: the report of each backend, indexed by backend name
+    :rtype: collections.OrderedDict
+    """
+    from imagekeeper.image import convert
+    from imagekeeper.image import download
+    from imagekeeper.image import store as image_store
+    from imagekeeper.sync import journal
 
-CONF = cfg.CONF
-LOG = log.getLogger(__name__)
+    store = image_store.ImageStore()
+    sync_engine.journal = journal.Journal()
+    sync_engine.downloader = download.Downloader(store)
+    sync_engine.converter = convert.Converter(store)
+    try:
+        reports = sync_engine.execute(plans)
+        # Drop the images of the appliances removed from the image list
+        store.retain(sync_engine.images.get_images().values())
+        store.evict()
+    finally:
+        sync_engine.converter.close()
+        sync_engine.downloader.close()
+        sync_engine.journal.close()
+        store.close()
+    return reports
 
 
 def main():
     """Imagekeeper main script."""
+    if '--version' in sys.argv[1:]:
+        print_version()
+        return
+
+    from oslo_config import cfg
+    from oslo_log import log
+
+    from imagekeeper.common import config
+    from imagekeeper.common import exception
+
+    CONF = cfg.CONF
     config.parse_args(sys.argv)
     log.setup(CONF, 'imagekeeper')
+    LOG = log.getLogger(__name__)
 
-    LOG.info('Starting imagekeeper')
+    if CONF.check_config:
+        check_config()
+        return
+
+    from imagekeeper.backend import manager as backend_manager
+    from imagekeeper.common import metrics
+    from imagekeeper.image import manager as image_manager
+    from imagekeeper.sync import engine
+    from imagekeeper.sync import state
 
+    LOG.info('Starting imagekeeper')
+    metrics.setup()
     # Read the content of the image list
     images = image_manager.ImageListManager()
     if not images:
@@ -47,13 +149,31 @@ def main():
     backends = backend_manager.BackendManager()
     if not backends:
         raise exception.NoBackendDefined(
-            cloud_config=CONF.cloud_backend_file,
+            cloud_config=CONF.cloud_backend_path,
+            exception='the backend list is empty'
+        )
+
+    sync_state = state.SyncState()
+    try:
+        sync_engine = engine.SyncEngine(
+            backends.get_backends(), images, sync_state
         )
+        plans = sync_engine.plan()
+        if CONF.dry_run:
+            print_plan(plans)
+            return
+        reports = execute(sync_engine, plans)
+    finally:
+        sync_state.close()
+        metrics.shutdown()
 
-    for backend in backends.get_backends():
-        LOG.info("Managing images at %s" % backend['name'])
-        for image in images.get_images():
-            LOG.info(image)
+    sys.stdout.write("Synchronization summary:\n")
+    for report in reports.values():
+        sys.stdout.write("  %s\n" % report)
+    if sync_engine.stages:
+        sys.stdout.write("Pipeline stages:\n")
+        for report in sync_engine.stages.values():
+            sys.stdout.write("  %s\n" % report)
 
 
 if __name__ == "__main__":
@@ -36,9 +36,138 @@ DEFAULT_OPTS = [
     cfg.StrOpt('work_dir', default='/var/lib/imagekeeper/tmp',
                help='Work directory where the VM images are downloaded '
                     'and processed.'),
+    cfg.IntOpt('sync_workers', default=8, min=1,
+               help='Maximum number of appliance operations run '
+                    'concurrently over all the cloud backends.'),
+    cfg.IntOpt('backend_workers', default=2, min=1,
+               help='Maximum number of appliance operations run '
+                    'concurrently on a single cloud backend.'),
+    cfg.IntOpt('backend_timeout', default=0, min=0,
+               help='Maximum time in seconds allowed to synchronize a '
+                    'cloud backend. Appliances not yet processed when the '
+                    'timeout expires are skipped. 0 means no timeout.'),
+    cfg.IntOpt('retry_attempts', default=3, min=1,
+               help='Maximum number of attempts of a call to a cloud '
+                    'backend failing with a transient error.'),
+    cfg.FloatOpt('retry_delay', default=1.0, min=0,
+                 help='Base delay in seconds between two attempts of a '
+                      'call, doubled at each attempt and randomized.'),
+    cfg.FloatOpt('retry_max_delay', default=30.0, min=0,
+                 help='Maximum delay in seconds between two attempts of a '
+                      'call.'),
+    cfg.IntOpt('breaker_threshold', default=5, min=1,
+               help='Number of consecutive failures of a cloud backend '
+                    'after which it is not called anymore for a while.'),
+    cfg.FloatOpt('breaker_reset_timeout', default=60.0, min=0,
+                 help='Time in seconds during which a failing cloud backend '
+                      'is not called.'),
+    cfg.IntOpt('run_budget', default=0, min=0,
+               help='Maximum time in seconds of a synchronization run, '
+                    'after which the cloud backends are not called '
+                    'anymore. 0 means no limit.'),
+    cfg.IntOpt('image_page_size', default=100, min=1,
+               help='Number of images retrieved per request when listing '
+                    'the images of a cloud backend.'),
+    cfg.StrOpt('image_visibility', default='public',
+               choices=['public', 'private', 'shared', 'community'],
+               help='Visibility of the images registered on the cloud '
+                    'backends.'),
+    cfg.IntOpt('min_ram', default=0, min=0,
+               help='Minimum amount of RAM in MB required to boot the '
+                    'images, used when the appliance requires less.'),
+    cfg.IntOpt('upload_chunk_size', default=4194304, min=65536,
+               help='Size in bytes of the blocks read from the image files '
+                    'while they are uploaded.'),
+    cfg.StrOpt('image_hash_algo', default='sha512',
+               help='Hashlib algorithm used to compute the checksum of the '
+                    'images while they are uploaded. It should match the '
+                    'hashing algorithm of Glance so that the uploaded data '
+                    'can be verified.'),
+    cfg.IntOpt('fanout_buffer_chunks', default=4, min=1,
+               help='Number of image chunks buffered for each cloud backend '
+                    'when an image is uploaded to several backends at '
+                    'once. The slowest backend sets the pace once its '
+                    'buffer is full.'),
+    cfg.IntOpt('state_max_age', default=86400, min=0,
+               help='Time in seconds during which an appliance recorded as '
+                    'synchronized in the local state database is not '
+                    'verified again on the cloud backend. 0 means that the '
+                    'state database is always trusted.'),
+    cfg.IntOpt('store_quota', default=0, min=0,
+               help='Maximum size in bytes of the images kept in the store '
+                    'directory. The least recently used images are removed '
+                    'beyond it. 0 means no limit.'),
+    cfg.IntOpt('download_workers', default=4, min=1,
+               help='Maximum number of image segments downloaded at once.'),
+    cfg.IntOpt('download_host_workers', default=2, min=1,
+               help='Maximum number of image segments downloaded at once '
+                    'from the same host.'),
+    cfg.IntOpt('download_segment_size', default=67108864, min=1048576,
+               help='Size in bytes of the segments of an image downloaded '
+                    'in parallel. A download is resumed from the last '
+                    'completed segment.'),
+    cfg.IntOpt('download_timeout', default=60, min=1,
+               help='Time in seconds to wait for data from the server of '
+                    'an image.'),
+    cfg.IntOpt('fetch_workers', default=2, min=1,
+               help='Number of images downloaded at once by the fetch '
+                    'stage of the synchronization pipeline.'),
+    cfg.IntOpt('verify_workers', default=1, min=1,
+               help='Number of downloaded images verified at once by the '
+                    'verify stage of the synchronization pipeline.'),
+    cfg.IntOpt('convert_workers', default=0, min=0,
+               help='Number of images converted at once by the convert '
+                    'stage of the synchronization pipeline, each one in '
+                    'its own process. 0 means the number of processors.'),
+    cfg.StrOpt('qemu_img_path', default='qemu-img',
+               help='Path of the qemu-img command converting the images to '
+                    'the disk format preferred by a cloud backend.'),
+    cfg.IntOpt('upload_workers', default=2, min=1,
+               help='Number of appliances uploaded at once by the upload '
+                    'stage of the synchronization pipeline.'),
+    cfg.IntOpt('pipeline_queue_size', default=2, min=1,
+               help='Maximum number of images waiting between two stages '
+                    'of the synchronization pipeline.'),
+    cfg.IntOpt('sync_interval', default=3600, min=1,
+               help='Time in seconds between two synchronizations of a '
+                    'cloud backend by the daemon.'),
+    cfg.IntOpt('sync_jitter', default=300, min=0,
+               help='Maximum random delay in seconds added to the '
+                    'interval of each cloud backend, so that the backends '
+                    'are not synchronized all at once.'),
+    cfg.IntOpt('poll_interval', default=60, min=1,
+               help='Time in seconds between two checks of the image list '
+                    'and the backend file by the daemon. The backends are '
+                    'synchronized at once when the image list changes.'),
+    cfg.StrOpt('metrics_file',
+               help='File where the metrics of the cloud backend '
+                    'operations and synchronization stages are written '
+                    'after each synchronization. The metrics are only '
+                    'collected when they are written to a file or served '
+                    'on a port.'),
+    cfg.StrOpt('metrics_format', default='prometheus',
+               choices=['prometheus', 'json'],
+               help='Format of the metrics file.'),
+    cfg.StrOpt('metrics_host', default='127.0.0.1',
+               help='Address on which the metrics are served.'),
+    cfg.PortOpt('metrics_port',
+                help='Port on which the metrics are served over HTTP, in '
+                     'the Prometheus text format at /metrics and in JSON '
+                     'at /metrics.json.'),
+]
+
+CLI_OPTS = [
+    cfg.BoolOpt('dry_run', default=False,
+                help='Print the operations needed to synchronize the cloud '
+                     'backends without running them.'),
+    cfg.BoolOpt('check_config', default=False,
+                help='Check the configuration, the image list and the '
+                     'backend file, then exit without contacting the cloud '
+                     'backends.'),
 ]
 
 cfg.CONF.register_opts(DEFAULT_OPTS)
+cfg.CONF.register_cli_opts(CLI_OPTS)
 
 
 def parse_args(argv, default_config_files=None):
@@ -49,7 +178,7 @@ def parse_args(argv, default_config_files=None):
     """
     cfg.CONF(argv[1:],
              project='imagekeeper',
-             version=version.version_info.version_string(),
+             version=version.version_string(),
              default_config_files=default_config_files)
 
 
@@ -60,5 +189,5 @@ def list_opts():
     :rtype: list
     """
     return [
-        ('DEFAULT', DEFAULT_OPTS),
+        ('DEFAULT', DEFAULT_OPTS + CLI_OPTS),
     ]
@@ -65,28 +65,28 @@ class FunctionNotImplemented(ImagekeeperException):
 class BackendFileNotFound(ImagekeeperException):
     """Exception raised when the backend file is not found."""
 
-    msg_fmt = ("The backend file %(backend_file) could not be " +
+    msg_fmt = ("The backend file %(backend_file)s could not be " +
                "found: %(exception)s.")
 
 
 class InvalidBackendFile(ImagekeeperException):
     """Exception raised when the backend file is invalid."""
 
-    msg_fmt = ("The backend file %(backend_file) is invalid " +
+    msg_fmt = ("The backend file %(backend_file)s is invalid: " +
                "%(exception)s.")
 
 
 class NoBackendDefined(ImagekeeperException):
     """Exception raised when no backend is defined."""
 
-    msg_fmt = ("No backend is defined in the file %(cloud_config): "
+    msg_fmt = ("No backend is defined in the file %(cloud_config)s: "
                "%(exception)s.")
 
 
 class BackendNotFound(ImagekeeperException):
     """Exception raised when a backend is not found."""
 
-    msg_fmt = "Backend %(backend) could not be found: %(exception)s."
+    msg_fmt = "Backend %(backend)s could not be found: %(exception)s."
 
 
 class BackendConfigurationMissingOption(ImagekeeperException):
@@ -103,6 +103,13 @@ class ImageListFileNotFound(ImagekeeperException):
                "found: %(exception)s.")
 
 
+class InvalidImageListFile(ImagekeeperException):
+    """Exception raised when the image list file is invalid."""
+
+    msg_fmt = ("The image list file %(image_list_file)s is invalid: "
+               "%(exception)s.")
+
+
 class NoImageFound(ImagekeeperException):
     """Exception raised when no image is found in the image file."""
 
@@ -130,7 +137,61 @@ class UnknownAuthMethod(ImagekeeperException):
     msg_fmt = "Authentication type %(auth_type) is unknown: %(exception)s."
 
 
+class ChecksumMismatch(ImagekeeperException):
+    """Exception raised when the checksum of an image is wrong."""
+
+    msg_fmt = ("The %(algorithm)s checksum of the image %(image)s does not "
+               "match: expected %(expected)s, got %(actual)s.")
+
+
+class UnknownError(ImagekeeperException):
+    """Exception raised when an unexpected error occurs."""
+
+    msg_fmt = "An unexpected error occurred: %(exception)s."
+
+
 class ClassNotFound(ImagekeeperException):
     """Exception raised when a class is not found."""
 
     msg_fmt = "Class %(class_name)s could not be found: %(exception)s."
+
+
+class BackendRequestError(ImagekeeperException):
+    """Exception raised when a request to a backend fails."""
+
+    msg_fmt = ("Request %(method)s %(url)s failed with status %(status)s: "
+               "%(reason)s.")
+
+
+class MissingDependency(ImagekeeperException):
+    """Exception raised when an optional dependency is not installed."""
+
+    msg_fmt = "The %(feature)s feature requires %(dependency)s."
+
+
+class ImageConversionFailed(ImagekeeperException):
+    """Exception raised when an image cannot be converted."""
+
+    msg_fmt = ("The image %(image)s could not be converted to "
+               "%(disk_format)s: %(reason)s.")
+
+
+class InvalidBackendOption(ImagekeeperException):
+    """Exception raised when an option of a backend is invalid."""
+
+    msg_fmt = ("Option %(option)s of the backend %(backend)s is invalid: "
+               "%(reason)s.")
+
+
+class BackendUnavailable(ImagekeeperException):
+    """Exception raised when the circuit breaker of a backend is open."""
+
+    msg_fmt = ("Backend %(backend)s is failing repeatedly, it will be "
+               "called again in %(delay)ss.")
+
+
+class RunBudgetExhausted(ImagekeeperException):
+    """Exception raised when the time budget of a run is spent."""
+
+    msg_fmt = ("The time budget of %(budget)ss of the run is exhausted, "
+               "backend %(backend)s is not called anymore.")
@@ -0,0 +1,27 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""HTTP server handling each request in its own thread."""
+
+from http import server
+import socketserver
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, server.HTTPServer):
+    """HTTP server handling each request in a daemon thread.
+
+    http.server.ThreadingHTTPServer only exists from Python 3.7.
+    """
+
+    daemon_threads = True
@@ -0,0 +1,559 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Metrics of the backend operations and of the synchronization stages.
+
+The operations of the backends are counted and timed per backend, their
+errors classified by exception type, and the synchronization stages timed
+as nested spans. The metrics are only collected once ``setup`` enabled
+them, when the ``metrics_file`` or ``metrics_port`` option is set: until
+then, an instrumented call costs a single test. They are written in the
+Prometheus text format or in JSON::
+
+  imagekeeper_backend_operation_seconds_count{backend="cloud1",...} 12
+"""
+
+import bisect
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# Upper bounds of the buckets of the durations in seconds
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                10.0, 30.0, 60.0, 300.0)
+# Upper bounds of the buckets of the throughputs in bytes per second
+RATE_BUCKETS = (1e5, 1e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+# Number of finished spans kept for the JSON export
+MAX_SPANS = 1000
+
+_enabled = False
+_server = None
+
+
+class Metric(object):
+    """Values of a metric, indexed by their labels."""
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        """Initialize the class.
+
+        :param name: the name of the metric
+        :type name: str
+        :param description: the help text of the metric
+        :type description: str
+        :param labels: the names of the labels of the metric
+        :type labels: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """Return the label values, in the order of the label names."""
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """Return the labels and value of each sample.
+
+        :return: the label values, indexed by label name, and the value
+        :rtype: list of tuple
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(collections.OrderedDict(zip(self.labels, key)),
+                 self._copy(value)) for key, value in items]
+
+    def _copy(self, value):
+        """Return a value as it is exported."""
+        return value
+
+    def clear(self):
+        """Drop all the values."""
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """A value that only grows."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the value of the labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the value of the labels."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        """Increase the value of the labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Decrease the value of the labels."""
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values over buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        """Initialize the class.
+
+        :param buckets: the upper bounds of the buckets, in order
+        :type buckets: tuple
+        """
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Record a value for the labels."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _copy(self, value):
+        """Return the cumulative counts of the buckets, the sum and count."""
+        counts, total = value
+        cumulative = []
+        for count in counts:
+            cumulative.append(count + (cumulative[-1] if cumulative else 0))
+        return {'buckets': cumulative, 'sum': total, 'count': cumulative[-1]}
+
+
+class Registry(object):
+    """Set of metrics exported together."""
+
+    def __init__(self):
+        """Initialize the class."""
+        self.metrics = collections.OrderedDict()
+
+    def _add(self, metric):
+        """Register a metric and return it."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        """Add a counter."""
+        return self._add(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        """Add a gauge."""
+        return self._add(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        """Add a histogram."""
+        return self._add(Histogram(name, description, labels, buckets))
+
+    def clear(self):
+        """Drop the values of all the metrics."""
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+REGISTRY = Registry()
+OPERATIONS = REGISTRY.counter(
+    'imagekeeper_backend_operations_total',
+    'Number of operations run on the backends.', ('backend', 'operation')
+)
+ERRORS = REGISTRY.counter(
+    'imagekeeper_backend_errors_total',
+    'Number of failed operations, by exception type.',
+    ('backend', 'operation', 'error')
+)
+DURATIONS = REGISTRY.histogram(
+    'imagekeeper_backend_operation_seconds',
+    'Duration of the operations run on the backends.',
+    ('backend', 'operation')
+)
+IN_PROGRESS = REGISTRY.gauge(
+    'imagekeeper_backend_operations_in_progress',
+    'Number of operations running on the backends.',
+    ('backend', 'operation')
+)
+REQUESTS = REGISTRY.counter(
+    'imagekeeper_backend_requests_total',
+    'Number of HTTP requests sent to the backends, by status.',
+    ('backend', 'method', 'status')
+)
+UPLOADED = REGISTRY.counter(
+    'imagekeeper_backend_uploaded_bytes_total',
+    'Number of bytes of image data uploaded to the backends.', ('backend',)
+)
+UPLOAD_RATES = REGISTRY.histogram(
+    'imagekeeper_backend_upload_bytes_per_second',
+    'Throughput of the image uploads.', ('backend',), RATE_BUCKETS
+)
+SPANS = REGISTRY.histogram(
+    'imagekeeper_span_seconds',
+    'Duration of the synchronization stages.', ('span',)
+)
+
+_spans = collections.deque(maxlen=MAX_SPANS)
+_local = threading.local()
+
+
+def enabled():
+    """Return whether the metrics are collected."""
+    return _enabled
+
+
+def enable(value=True):
+    """Start or stop collecting the metrics."""
+    global _enabled
+    _enabled = value
+
+
+def record(backend, operation, elapsed, error=None):
+    """Record an operation run on a backend.
+
+    :param backend: the name of the backend
+    :type backend: str
+    :param operation: the name of the operation
+    :type operation: str
+    :param elapsed: the duration of the operation in seconds
+    :type elapsed: float
+    :param error: the error raised by the operation, if any
+    :type error: Exception
+    """
+    if not _enabled:
+        return
+    OPERATIONS.inc(backend=backend, operation=operation)
+    DURATIONS.observe(elapsed, backend=backend, operation=operation)
+    if error is not None:
+        ERRORS.inc(backend=backend, operation=operation,
+                   error=type(error).__name__)
+
+
+def timed(operation, size=None):
+    """Decorate a backend method whose calls are recorded.
+
+    The backend is identified by the ``cloud_id`` attribute of the object.
+
+    :param operation: the name of the operation
+    :type operation: str
+    :param size: callable returning the number of bytes uploaded by a call
+                 from its arguments, to record the upload throughput
+    :type size: callable
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _enabled:
+                return func(self, *args, **kwargs)
+            labels = {'backend': self.cloud_id, 'operation': operation}
+            IN_PROGRESS.inc(**labels)
+            start = time.monotonic()
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception as err:
+                record(self.cloud_id, operation, time.monotonic() - start,
+                       err)
+                raise
+            finally:
+                IN_PROGRESS.dec(**labels)
+            elapsed = time.monotonic() - start
+            record(self.cloud_id, operation, elapsed)
+            if size is not None:
+                count = size(*args, **kwargs) or 0
+                UPLOADED.inc(count, backend=self.cloud_id)
+                if elapsed > 0:
+                    UPLOAD_RATES.observe(count / elapsed,
+                                         backend=self.cloud_id)
+            return result
+        return wrapper
+    return decorator
+
+
+class Span(object):
+    """Timing of a step, nested in the step running in the same thread."""
+
+    def __init__(self, name):
+        """Initialize the class.
+
+        :param name: the name of the step
+        :type name: str
+        """
+        self.name = name
+        self.parent = None
+        self.started_at = None
+        self.elapsed = None
+        self.error = None
+        self._start = None
+
+    def __enter__(self):
+        """Start the span, as a child of the current one."""
+        stack = getattr(_local, 'spans', None)
+        if stack is None:
+            stack = _local.spans = []
+        if stack:
+            self.parent = stack[-1].name
+        stack.append(self)
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop the span and record it."""
+        self.elapsed = time.monotonic() - self._start
+        _local.spans.pop()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        SPANS.observe(self.elapsed, span=self.name)
+        _spans.append(self.as_dict())
+        return False
+
+    def as_dict(self):
+        """Return the span as a dictionary."""
+        return collections.OrderedDict([
+            ('name', self.name),
+            ('parent', self.parent),
+            ('thread', threading.current_thread().name),
+            ('started_at', self.started_at),
+            ('elapsed', self.elapsed),
+            ('error', self.error),
+        ])
+
+
+class _NullSpan(object):
+    """Span doing nothing, used when the metrics are disabled."""
+
+    def __enter__(self):
+        """Return the span."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Do nothing."""
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """Return a context manager timing a step.
+
+    :param name: the name of the step
+    :type name: str
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name)
+
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format."""
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(labels, **extra):
+    """Return the labels of a sample in the Prometheus text format."""
+    items = list(labels.items()) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(str(value)))
+                             for name, value in items)
+
+
+def _number(value):
+    """Return a value in the Prometheus text format."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def to_prometheus(registry=REGISTRY):
+    """Return the metrics in the Prometheus text format.
+
+    :rtype: str
+    """
+    lines = []
+    for metric in registry.metrics.values():
+        lines.append('# HELP %s %s' % (metric.name, metric.description))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for labels, value in metric.samples():
+            if metric.kind != 'histogram':
+                lines.append('%s%s %s' % (metric.name, _labels(labels),
+                                          _number(value)))
+                continue
+            bounds = metric.buckets + (float('inf'),)
+            for bound, count in zip(bounds, value['buckets']):
+                lines.append('%s_bucket%s %d' % (
+                    metric.name, _labels(labels, le=_number(bound)), count
+                ))
+            lines.append('%s_sum%s %s' % (metric.name, _labels(labels),
+                                          _number(value['sum'])))
+            lines.append('%s_count%s %d' % (metric.name, _labels(labels),
+                                            value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(registry=REGISTRY):
+    """Return the metrics and the last spans in JSON.
+
+    :rtype: str
+    """
+    metrics = collections.OrderedDict()
+    for metric in registry.metrics.values():
+        samples = []
+        for labels, value in metric.samples():
+            if metric.kind == 'histogram':
+                value = collections.OrderedDict([
+                    ('buckets', collections.OrderedDict(
+                        (_number(bound), count) for bound, count in
+                        zip(metric.buckets + (float('inf'),),
+                            value['buckets'])
+                    )),
+                    ('sum', value['sum']),
+                    ('count', value['count']),
+                ])
+            samples.append(collections.OrderedDict([('labels', labels),
+                                                    ('value', value)]))
+        metrics[metric.name] = collections.OrderedDict([
+            ('type', metric.kind),
+            ('help', metric.description),
+            ('samples', samples),
+        ])
+    return json.dumps(collections.OrderedDict([
+        ('metrics', metrics), ('spans', list(_spans)),
+    ]), indent=2)
+
+
+def export(path=None, fmt=None):
+    """Write the metrics to a file.
+
+    The file is replaced at once, so that it is never read partially
+    written.
+
+    :param path: the file, by default the metrics_file option
+    :type path: str
+    :param fmt: the format, 'prometheus' or 'json', by default the
+                metrics_format option
+    :type fmt: str
+    """
+    path = path or CONF.metrics_file
+    if not _enabled or not path:
+        return
+    fmt = fmt or CONF.metrics_format
+    data = to_json() if fmt == 'json' else to_prometheus()
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as metrics_file:
+        metrics_file.write(data)
+    os.replace(temp_path, path)
+
+
+def serve(host, port):
+    """Serve the metrics over HTTP in a background thread.
+
+    :param host: the address to listen on
+    :type host: str
+    :param port: the port to listen on, 0 for any free port
+    :type port: int
+    :return: the server
+    :rtype: http.server.HTTPServer
+    """
+    from http import server
+
+    from imagekeeper.common import httpserver
+
+    class Handler(server.BaseHTTPRequestHandler):
+        """Handler of the requests for the metrics."""
+
+        def do_GET(self):
+            """Return the metrics in the Prometheus or JSON format."""
+            if self.path == '/metrics':
+                data = to_prometheus()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                data = to_json()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = data.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Do not log the requests."""
+
+    metrics_server = httpserver.ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=metrics_server.serve_forever,
+                              name='metrics')
+    thread.daemon = True
+    thread.start()
+    LOG.info("Serving the metrics on %s:%d" %
+             metrics_server.server_address[:2])
+    return metrics_server
+
+
+def setup():
+    """Collect the metrics if they are written to a file or served.
+
+    :return: whether the metrics are collected
+    :rtype: bool
+    """
+    global _server
+    if not CONF.metrics_file and CONF.metrics_port is None:
+        return False
+    enable()
+    if CONF.metrics_port is not None and _server is None:
+        _server = serve(CONF.metrics_host, CONF.metrics_port)
+    return True
+
+
+def shutdown():
+    """Write the metrics a last time and stop serving them."""
+    global _server
+    export()
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+    enable(False)
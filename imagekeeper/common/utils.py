@@ -17,6 +17,8 @@
 
 import math
 
+from imagekeeper.common import exception
+
 
 def convert_ram(ram_value):
     """Convert ram in bytes to the nearest upper integer in megabytes
@@ -32,3 +34,24 @@ def validate_options(config, options):
         if option not in config:
             missing_options.append(option)
     return missing_options
+
+
+def checksum_algorithm(checksum):
+    """Return the hashlib algorithm matching the length of a checksum
+    """
+    return {
+        32: 'md5',
+        40: 'sha1',
+        64: 'sha256',
+        128: 'sha512',
+    }.get(len(checksum or ''))
+
+
+def verify_checksum(image, algorithm, expected, actual):
+    """Raise an exception if two checksums are known and differ
+    """
+    if expected and actual and expected.lower() != actual.lower():
+        raise exception.ChecksumMismatch(
+            image=image, algorithm=algorithm,
+            expected=expected, actual=actual
+        )
@@ -0,0 +1,104 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Appliance record shared by the image list formats."""
+
+
+class Appliance(object):
+    """An appliance of an image list.
+
+    The fields can be read either as attributes or as items, so that an
+    appliance can be used where a dictionary is expected.
+    """
+
+    __slots__ = ('identifier', 'version', 'title', 'format', 'location',
+                 'checksum', 'min_ram')
+
+    def __init__(self, identifier, version=None, title=None, format=None,
+                 location=None, checksum=None, min_ram=0):
+        """Initialize the class.
+
+        :param identifier: the unique identifier of the appliance
+        :type identifier: str
+        :param version: the version of the appliance
+        :type version: str
+        :param title: the title of the appliance
+        :type title: str
+        :param format: the disk format of the image
+        :type format: str
+        :param location: the path or the URL of the image
+        :type location: str
+        :param checksum: the hexadecimal checksum of the image
+        :type checksum: str
+        :param min_ram: the minimum amount of RAM in MB
+        :type min_ram: int
+        """
+        self.identifier = identifier
+        self.version = version
+        self.title = title
+        self.format = format
+        self.location = location
+        self.checksum = checksum
+        self.min_ram = min_ram
+
+    def _values(self):
+        """Return the values of the fields."""
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __getitem__(self, key):
+        """Return a field given its name."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        """Return a field given its name, or a default value."""
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def replace(self, **fields):
+        """Return a copy of the appliance with some fields changed."""
+        values = self.to_dict()
+        values.update(fields)
+        return Appliance(**values)
+
+    def to_dict(self):
+        """Return the fields as a dictionary."""
+        return dict(zip(self.__slots__, self._values()))
+
+    def __eq__(self, other):
+        """Return whether two appliances have the same fields."""
+        if not isinstance(other, Appliance):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __ne__(self, other):
+        """Return whether two appliances have different fields."""
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        """Return the hash of the fields."""
+        return hash(self._values())
+
+    def __repr__(self):
+        """Return the representation of the appliance."""
+        return "<Appliance %s %s>" % (self.identifier, self.version)
+
+    def __str__(self):
+        """Return the identifier of the appliance."""
+        return "%s (%s)" % (self.title, self.identifier)
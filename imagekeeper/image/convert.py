@@ -0,0 +1,211 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Conversion of the images to the disk format preferred by the backends.
+
+The images are converted with qemu-img in a pool of processes. The converted
+images are kept in the image store, indexed by the checksum of their source
+and their format, so that an image is converted once for all the backends
+preferring the same format, and not converted again by the next runs.
+"""
+
+from concurrent import futures
+import os
+# qemu-img is run without a shell, from the configured path
+import subprocess  # nosec B404
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import exception
+from imagekeeper.common import utils
+from imagekeeper.image import store as image_store
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# Names of the disk formats known to qemu-img
+QEMU_FORMATS = {
+    'raw': 'raw',
+    'qcow2': 'qcow2',
+    'vmdk': 'vmdk',
+    'vdi': 'vdi',
+    'vhd': 'vpc',
+    'vhdx': 'vhdx',
+}
+
+
+def convert_image(qemu_img, source, destination, source_format,
+                  target_format):
+    """Convert an image and return the sha256 digest of the result.
+
+    It is run in a worker process, which also computes the digest.
+
+    :param qemu_img: the path of the qemu-img command
+    :type qemu_img: str
+    :param source: the path of the image
+    :type source: str
+    :param destination: the path of the converted image
+    :type destination: str
+    :param source_format: the qemu-img format of the image
+    :type source_format: str
+    :param target_format: the qemu-img format of the converted image
+    :type target_format: str
+    :return: the digest of the converted image
+    :rtype: str
+    """
+    if source_format not in QEMU_FORMATS.values() or \
+            target_format not in QEMU_FORMATS.values():
+        raise ValueError("unknown qemu-img format")
+    # The formats are known ones and the paths are absolute, so that none
+    # of them is taken for an option; no shell is involved
+    subprocess.run([qemu_img, 'convert', '-f', source_format,  # nosec B603
+                    '-O', target_format, os.path.abspath(source),
+                    os.path.abspath(destination)],
+                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                   universal_newlines=True, check=True)
+    return image_store.file_digest(destination)
+
+
+class Converter(object):
+    """Convert the images of the appliances, caching them in the store."""
+
+    def __init__(self, store, max_workers=None):
+        """Initialize the class.
+
+        :param store: the image store
+        :type store: image.store.ImageStore
+        :param max_workers: the number of conversion processes, by default
+                            the convert_workers option, or the number of
+                            processors
+        :type max_workers: int
+        """
+        self.store = store
+        self.max_workers = (max_workers or CONF.convert_workers or
+                            os.cpu_count() or 1)
+        self._executor = futures.ProcessPoolExecutor(self.max_workers)
+        self._lock = threading.Lock()
+        self._running = {}
+
+    def _stored(self, appliance):
+        """Return whether the image of an appliance comes from the store."""
+        blob_dir = os.path.dirname(os.path.dirname(appliance['location']))
+        return blob_dir == self.store.blob_dir
+
+    def _source(self, appliance):
+        """Return the checksum identifying the image of an appliance."""
+        location = appliance['location']
+        if self._stored(appliance):
+            # The image comes from the store, its name is its digest
+            return os.path.basename(location)
+        if appliance['checksum']:
+            return appliance['checksum'].lower()
+        return image_store.file_digest(location)
+
+    def _verify(self, appliance):
+        """Check a local image against the checksum of the image list.
+
+        The images of the store were checked when they were downloaded.
+        """
+        checksum = appliance['checksum']
+        algorithm = utils.checksum_algorithm(checksum)
+        if self._stored(appliance) or algorithm is None:
+            return
+        actual = self._executor.submit(image_store.file_digest,
+                                       appliance['location'],
+                                       algorithm).result()
+        utils.verify_checksum(appliance['title'], algorithm, checksum, actual)
+
+    def _convert(self, appliance, source, disk_format):
+        """Convert an image into the store and return its digest."""
+        source_format = QEMU_FORMATS.get((appliance['format'] or '').lower())
+        if source_format is None:
+            raise exception.ImageConversionFailed(
+                image=appliance['title'], disk_format=disk_format,
+                reason="unsupported source format '%s'" % appliance['format']
+            )
+        self._verify(appliance)
+        if not os.path.isdir(CONF.work_dir):
+            os.makedirs(CONF.work_dir)
+        destination = os.path.join(CONF.work_dir, '%s.%s.part' %
+                                   (source, disk_format))
+        LOG.info("Converting the image of '%s' from %s to %s" %
+                 (appliance, appliance['format'], disk_format))
+        try:
+            digest = self._executor.submit(
+                convert_image, CONF.qemu_img_path, appliance['location'],
+                destination, source_format, QEMU_FORMATS[disk_format]
+            ).result()
+        except (OSError, ValueError, subprocess.CalledProcessError) as err:
+            if os.path.exists(destination):
+                os.remove(destination)
+            reason = getattr(err, 'stderr', None) or err
+            raise exception.ImageConversionFailed(
+                image=appliance['title'], disk_format=disk_format,
+                reason=str(reason).strip()
+            )
+        return self.store.add(destination, digest)
+
+    def convert(self, appliance, disk_format):
+        """Return an appliance whose image is in a given disk format.
+
+        The converted image replaces the image of the appliance, with its
+        sha256 digest as checksum. A local image is checked against the
+        checksum of the appliance before being converted.
+
+        :param appliance: the appliance, with a local image
+        :type appliance: appliance.Appliance
+        :param disk_format: the disk format
+        :type disk_format: str
+        :return: the appliance with the converted image
+        :rtype: appliance.Appliance
+        """
+        disk_format = disk_format.lower()
+        if (appliance['format'] or '').lower() == disk_format:
+            return appliance
+        if disk_format not in QEMU_FORMATS:
+            raise exception.ImageConversionFailed(
+                image=appliance['title'], disk_format=disk_format,
+                reason="unsupported target format"
+            )
+        source = self._source(appliance)
+        key = (source, disk_format)
+        while True:
+            # Wait for the same conversion run by another thread
+            with self._lock:
+                event = self._running.get(key)
+                if event is None:
+                    self._running[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            digest = self.store.conversion(source, disk_format)
+            if digest is None or self.store.get(digest) is None:
+                digest = self._convert(appliance, source, disk_format)
+            else:
+                LOG.debug("Image of '%s' already converted to %s" %
+                          (appliance, disk_format))
+            self.store.add_conversion(source, disk_format, digest,
+                                      appliance['identifier'],
+                                      appliance['version'])
+        finally:
+            with self._lock:
+                self._running.pop(key).set()
+        return appliance.replace(location=self.store.path(digest),
+                                 format=disk_format, checksum=digest)
+
+    def close(self):
+        """Stop the conversion processes."""
+        self._executor.shutdown()
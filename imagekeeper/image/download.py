@@ -0,0 +1,397 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Download of the appliance images into the image store.
+
+An image served with range support is downloaded as segments fetched in
+parallel and written in place into a partial file of the work directory.
+A failed segment is fetched again up to ``SEGMENT_ATTEMPTS`` times. The
+completed segments are recorded next to it, so that an interrupted
+download is resumed by the next run. Only the downloads from servers
+supporting ranges are resumed: the other images are streamed from their
+first byte by each attempt. The checksums are computed while the
+beginning of the file is complete, then the file is moved into the store.
+"""
+
+from concurrent import futures
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+
+from oslo_config import cfg
+from oslo_log import log
+import requests
+
+from imagekeeper.common import exception
+from imagekeeper.common import utils
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+READ_SIZE = 1048576
+# Number of times a segment is fetched before the download fails
+SEGMENT_ATTEMPTS = 3
+
+
+def is_remote(location):
+    """Return whether the location of an image is a HTTP(S) URL."""
+    scheme = urllib.parse.urlsplit(location or '').scheme
+    return scheme in ('http', 'https')
+
+
+class _PrefixHasher(object):
+    """Compute checksums over the completed beginning of a file."""
+
+    def __init__(self, path, algorithms):
+        """Initialize the class.
+
+        :param path: the path of the file
+        :type path: str
+        :param algorithms: the hashlib algorithms to compute
+        :type algorithms: iterable
+        """
+        self.path = path
+        self.offset = 0
+        self.hashes = dict((algorithm, hashlib.new(algorithm))
+                           for algorithm in algorithms)
+
+    def update(self, data):
+        """Add data following the hashed part of the file."""
+        self.offset += len(data)
+        for checksum in self.hashes.values():
+            checksum.update(data)
+
+    def advance(self, end):
+        """Hash the file up to an offset.
+
+        The data has just been written, so that it is read from the page
+        cache.
+        """
+        if end <= self.offset:
+            return
+        with open(self.path, 'rb') as image_file:
+            image_file.seek(self.offset)
+            while self.offset < end:
+                data = image_file.read(min(READ_SIZE, end - self.offset))
+                if not data:
+                    raise IOError("unexpected end of file '%s'" % self.path)
+                self.update(data)
+
+    def hexdigest(self, algorithm):
+        """Return the checksum of the data hashed so far."""
+        return self.hashes[algorithm].hexdigest()
+
+
+class Downloader(object):
+    """Download the images of the appliances into the image store."""
+
+    def __init__(self, store, max_workers=None, host_workers=None,
+                 segment_size=None):
+        """Initialize the class.
+
+        :param store: the image store
+        :type store: image.store.ImageStore
+        :param max_workers: the maximum number of segments downloaded at
+                            once, by default the download_workers option
+        :type max_workers: int
+        :param host_workers: the maximum number of segments downloaded at
+                             once from a host, by default the
+                             download_host_workers option
+        :type host_workers: int
+        :param segment_size: the size of the segments, by default the
+                             download_segment_size option
+        :type segment_size: int
+        """
+        self.store = store
+        self.max_workers = max_workers or CONF.download_workers
+        self.host_workers = host_workers or CONF.download_host_workers
+        self.segment_size = segment_size or CONF.download_segment_size
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(self.max_workers)
+        self._http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers
+        )
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+
+    def _host_slots(self, url):
+        """Return the semaphore limiting the downloads from a host."""
+        host = urllib.parse.urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(
+                    self.host_workers
+                )
+            return self._hosts[host]
+
+    def _paths(self, url):
+        """Return the paths of the partial file and of its metadata."""
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        path = os.path.join(CONF.work_dir, name + '.part')
+        return path, path + '.json'
+
+    def _probe(self, url):
+        """Return the size, the range support and the version of a file."""
+        response = self._http.head(url, allow_redirects=True,
+                                   timeout=CONF.download_timeout)
+        response.raise_for_status()
+        size = response.headers.get('Content-Length')
+        return (int(size) if size is not None else None,
+                response.headers.get('Accept-Ranges') == 'bytes',
+                response.headers.get('ETag') or
+                response.headers.get('Last-Modified'))
+
+    @staticmethod
+    def _load_meta(meta_path):
+        """Return the state of a partial download, None if unknown."""
+        try:
+            with open(meta_path) as meta_file:
+                return json.load(meta_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_meta(meta_path, meta):
+        """Record the state of a partial download atomically."""
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.rename(tmp_path, meta_path)
+
+    def _fetch_segment(self, url, fd, start, end, validator):
+        """Download a segment of a file and write it in place.
+
+        :return: the number of bytes written
+        :rtype: int
+        """
+        headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        if validator:
+            headers['If-Range'] = validator
+        response = self._http.get(url, headers=headers, stream=True,
+                                  timeout=CONF.download_timeout)
+        with response:
+            if response.status_code != 206:
+                raise IOError("%s: range %d-%d not served (status %d)" %
+                              (url, start, end, response.status_code))
+            offset = start
+            for data in response.iter_content(READ_SIZE):
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+        if offset != end + 1:
+            raise IOError("%s: range %d-%d truncated at %d" %
+                          (url, start, end, offset))
+        os.fdatasync(fd)
+        return offset - start
+
+    def _download_stream(self, url, path, hasher):
+        """Download a file as a single stream, hashing it on the fly.
+
+        The server not supporting ranges, the file is downloaded from its
+        first byte, even if a previous attempt was interrupted.
+        """
+        with self._host_slots(url):
+            response = self._http.get(url, stream=True,
+                                      timeout=CONF.download_timeout)
+            with response, open(path, 'wb') as part_file:
+                response.raise_for_status()
+                for data in response.iter_content(READ_SIZE):
+                    part_file.write(data)
+                    hasher.update(data)
+
+    def _download_segments(self, url, path, meta_path, meta, hasher):
+        """Download the missing segments of a file in parallel.
+
+        A failed segment is fetched again first, up to SEGMENT_ATTEMPTS
+        times, then the download stops once the running segments are over.
+        """
+        size = meta['size']
+        done = set(meta['done'])
+        segments = [(start, min(start + self.segment_size, size) - 1)
+                    for start in range(0, size, self.segment_size)]
+        queue = [segment for segment in segments if segment[0] not in done]
+        if len(queue) < len(segments):
+            LOG.info("Resuming the download of '%s' (%d/%d segments)" %
+                     (url, len(segments) - len(queue), len(segments)))
+        slots = self._host_slots(url)
+        attempts = {}
+        running = {}
+        error = None
+        fd = os.open(path, os.O_RDWR)
+        try:
+            while (queue and error is None) or running:
+                # Only wait for a free slot of the host when there is no
+                # segment to collect meanwhile
+                while (queue and error is None and
+                       slots.acquire(blocking=not running)):
+                    start, end = queue.pop(0)
+                    future = self._executor.submit(
+                        self._fetch_segment, url, fd, start, end,
+                        meta['validator']
+                    )
+                    future.add_done_callback(lambda _: slots.release())
+                    running[future] = (start, end)
+                if not running:
+                    continue
+                finished, _ = futures.wait(
+                    running, timeout=0.1 if queue else None,
+                    return_when=futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    start, end = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as err:
+                        attempts[start] = attempts.get(start, 0) + 1
+                        if attempts[start] < SEGMENT_ATTEMPTS:
+                            LOG.warning("Fetching again the range %d-%d of "
+                                        "'%s': %s" % (start, end, url, err))
+                            queue.insert(0, (start, end))
+                        else:
+                            error = err
+                        continue
+                    done.add(start)
+                    meta['done'] = sorted(done)
+                    self._save_meta(meta_path, meta)
+                # Hash the completed beginning of the file
+                for start, end in segments:
+                    if start not in done:
+                        break
+                    hasher.advance(end + 1)
+        finally:
+            os.close(fd)
+        if error is not None:
+            raise error
+        hasher.advance(size)
+
+    def download(self, url, algorithms=('sha256',)):
+        """Download a file into the work directory.
+
+        :param url: the URL of the file
+        :type url: str
+        :param algorithms: the hashlib algorithms to compute
+        :type algorithms: iterable
+        :return: the path of the file and its checksums
+        :rtype: tuple
+        """
+        path, meta_path = self._paths(url)
+        if not os.path.isdir(CONF.work_dir):
+            os.makedirs(CONF.work_dir)
+        hasher = _PrefixHasher(path, algorithms)
+        size, ranges, validator = self._probe(url)
+        if not ranges or not size:
+            LOG.debug("Downloading '%s' as a single stream" % url)
+            self._download_stream(url, path, hasher)
+            return path, hasher
+
+        meta = self._load_meta(meta_path)
+        if (meta is None or meta.get('size') != size or
+                meta.get('validator') != validator or
+                not os.path.isfile(path)):
+            meta = {'url': url, 'size': size, 'validator': validator,
+                    'done': []}
+            with open(path, 'wb') as part_file:
+                part_file.truncate(size)
+            self._save_meta(meta_path, meta)
+        self._download_segments(url, path, meta_path, meta, hasher)
+        return path, hasher
+
+    def cached(self, appliance):
+        """Return the digest of the image of an appliance in the store.
+
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :return: the sha256 digest, None if the image is not stored
+        :rtype: str
+        """
+        digest = self.store.lookup(appliance['identifier'],
+                                   appliance['version'])
+        if digest is not None and self.store.get(digest) is not None:
+            LOG.debug("Image of '%s' already in the store" % appliance)
+            return digest
+        return None
+
+    def retrieve(self, appliance):
+        """Download the image of an appliance into the work directory.
+
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :return: the path of the file and its checksums
+        :rtype: tuple
+        """
+        url = appliance['location']
+        algorithms = set(['sha256'])
+        checksum_algo = utils.checksum_algorithm(appliance['checksum'])
+        if checksum_algo:
+            algorithms.add(checksum_algo)
+        LOG.info("Downloading the image of '%s' from '%s'" % (appliance, url))
+        return self.download(url, algorithms)
+
+    def promote(self, appliance, path, hasher):
+        """Verify a downloaded image and move it into the store.
+
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :param path: the path of the downloaded file
+        :type path: str
+        :param hasher: the checksums of the file
+        :type hasher: _PrefixHasher
+        :return: the sha256 digest of the image in the store
+        :rtype: str
+        """
+        meta_path = self._paths(appliance['location'])[1]
+        checksum_algo = utils.checksum_algorithm(appliance['checksum'])
+        try:
+            if checksum_algo:
+                utils.verify_checksum(appliance['title'], checksum_algo,
+                                      appliance['checksum'],
+                                      hasher.hexdigest(checksum_algo))
+        except exception.ChecksumMismatch:
+            for stale in (path, meta_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            raise
+        digest = self.store.add(path, hasher.hexdigest('sha256'))
+        self.store.reference(appliance['identifier'], appliance['version'],
+                             digest)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        return digest
+
+    def fetch(self, appliance):
+        """Download the image of an appliance into the store.
+
+        Nothing is downloaded if the store already holds the image of
+        this version of the appliance.
+
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :return: the sha256 digest of the image in the store
+        :rtype: str
+        """
+        digest = self.cached(appliance)
+        if digest is not None:
+            return digest
+        path, hasher = self.retrieve(appliance)
+        return self.promote(appliance, path, hasher)
+
+    def close(self):
+        """Stop the download threads."""
+        self._executor.shutdown()
+        self._http.close()
@@ -0,0 +1,221 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Upload an image to several backends from a single read."""
+
+import queue
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.image import stream
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# Marker sent to the branches once the whole image has been read
+_EOF = object()
+
+
+class BranchReader(object):
+    """File object reading the chunks dispatched by a FanoutReader."""
+
+    def __init__(self, fanout, buffer_chunks):
+        """Initialize the class.
+
+        :param fanout: the reader dispatching the chunks
+        :type fanout: FanoutReader
+        :param buffer_chunks: the number of chunks buffered
+        :type buffer_chunks: int
+        """
+        self.fanout = fanout
+        self.closed = False
+        self.bytes_read = 0
+        self._queue = queue.Queue(maxsize=buffer_chunks)
+        self._chunk = b''
+        self._offset = 0
+        self._eof = False
+
+    @property
+    def size(self):
+        """Return the size of the image."""
+        return self.fanout.reader.size
+
+    @property
+    def algorithms(self):
+        """Return the algorithms of the checksums computed."""
+        return self.fanout.reader.algorithms
+
+    def hexdigest(self, algorithm):
+        """Return the checksum of the image, once it has been read."""
+        return self.fanout.reader.hexdigest(algorithm)
+
+    def _put(self, chunk):
+        """Queue a chunk, waiting while the buffer is full."""
+        while not self.closed:
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size=-1):
+        """Read data from the image.
+
+        :param size: the maximum number of bytes to read
+        :type size: int
+        :return: the data, an empty string at the end of the image
+        :rtype: bytes
+        """
+        if self._offset >= len(self._chunk):
+            if self._eof:
+                return b''
+            chunk = self._queue.get()
+            if chunk is _EOF:
+                self._eof = True
+                if self.fanout.error is not None:
+                    raise IOError("Cannot read image file '%s': %s" %
+                                  (self.fanout.reader.filename,
+                                   self.fanout.error))
+                return b''
+            self._chunk = chunk
+            self._offset = 0
+        if size is None or size < 0:
+            end = len(self._chunk)
+        else:
+            end = min(len(self._chunk), self._offset + size)
+        data = self._chunk[self._offset:end]
+        self._offset = end
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """Stop receiving data, so that the other branches are not held."""
+        self.closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        """Return the reader."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the reader."""
+        self.close()
+
+
+class FanoutReader(object):
+    """Dispatch the chunks of an image to several readers.
+
+    The image is read once, and each chunk is queued to every branch. A
+    branch buffers at most ``buffer_chunks`` chunks: once the buffer of the
+    slowest branch is full, the image is not read further until it catches
+    up. The chunks being shared by the branches, the memory used is bounded
+    to about ``buffer_chunks + 2`` chunks whatever the number of branches.
+    """
+
+    def __init__(self, reader, branches, buffer_chunks=None):
+        """Initialize the class.
+
+        :param reader: the reader of the image file
+        :type reader: stream.ChecksumReader
+        :param branches: the number of branches
+        :type branches: int
+        :param buffer_chunks: the number of chunks buffered per branch
+        :type buffer_chunks: int
+        """
+        self.reader = reader
+        self.error = None
+        buffer_chunks = buffer_chunks or CONF.fanout_buffer_chunks
+        self.branches = [BranchReader(self, buffer_chunks)
+                         for _ in range(branches)]
+        self._thread = threading.Thread(target=self._dispatch)
+        self._thread.daemon = True
+
+    def _dispatch(self):
+        """Read the image and queue the chunks to the branches."""
+        try:
+            for chunk in self.reader:
+                active = [b for b in self.branches if not b.closed]
+                if not active:
+                    LOG.debug("No branch left, stop reading '%s'" %
+                              self.reader.filename)
+                    return
+                for branch in active:
+                    branch._put(chunk)
+        except Exception as err:
+            LOG.exception(err)
+            self.error = err
+        finally:
+            for branch in self.branches:
+                branch._put(_EOF)
+
+    def start(self):
+        """Start reading the image."""
+        self._thread.start()
+
+    def join(self):
+        """Wait for the image to be read and close the file."""
+        self._thread.join()
+        self.reader.close()
+
+
+def upload(appliance, backends, buffer_chunks=None):
+    """Add an appliance to several backends, reading the image once.
+
+    :param appliance: the appliance to add
+    :type appliance: dict
+    :param backends: the backends, indexed by name
+    :type backends: dict
+    :param buffer_chunks: the number of chunks buffered per backend
+    :type buffer_chunks: int
+    :return: whether the appliance has been added, indexed by backend name
+    :rtype: dict
+    """
+    results = dict((name, False) for name in backends)
+    try:
+        reader = stream.open_image(appliance)
+    except (IOError, OSError) as err:
+        LOG.error("Cannot open image file: '%s'" % appliance['location'])
+        LOG.exception(err)
+        return results
+
+    fanout = FanoutReader(reader, len(backends), buffer_chunks)
+
+    def add_appliance(name, branch):
+        with branch:
+            try:
+                results[name] = backends[name].add_appliance(
+                    appliance, image_data=branch
+                )
+            except Exception as err:
+                LOG.error("Could not add the appliance '%s' to the backend "
+                          "'%s'" % (appliance['identifier'], name))
+                LOG.exception(err)
+
+    threads = [
+        threading.Thread(target=add_appliance, args=(name, branch))
+        for name, branch in zip(sorted(backends), fanout.branches)
+    ]
+    fanout.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    fanout.join()
+    return results
@@ -24,17 +24,27 @@ CONF = cfg.CONF
 class BaseFormat(object):
     """Base class for all format classes."""
 
+    feature = None
+
     def __init__(self, feature=None):
         """Initialize the class."""
-        self.feature = feature
+        if feature is not None:
+            self.feature = feature
 
     def parse_file(self, filename):
-        """Parse an image file."""
+        """Parse an image file.
+
+        :param filename: the path of the image list
+        :type filename: str
+        :return: the appliances of the image list
+        :rtype: iterator of appliance.Appliance
+        """
         raise NotImplementedError
 
-    def get_feature(self):
+    @classmethod
+    def get_feature(cls):
         """Return the name of the format."""
-        return self.feature
+        return cls.feature
 
 
 class ImageListFormatHandler(pluginloader.PluginLoader):
@@ -45,11 +55,3 @@ class ImageListFormatHandler(pluginloader.PluginLoader):
         super(ImageListFormatHandler, self).__init__(
             'imagekeeper.image.formats', BaseFormat
         )
-
-    def load_handler(self, class_type):
-        """Load the format handler for the image list."""
-        format_handler = None
-        format_classes = self._get_all_classes()
-        if class_type in format_classes.keys():
-            format_handler = format_classes[class_type]
-        return format_handler
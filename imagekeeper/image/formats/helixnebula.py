@@ -12,18 +12,186 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""Plugin for Helix Nebula based image list format."""
+"""Plugin for Helix Nebula based image list format.
 
+The image list is a JSON document of the following form::
+
+  {
+    "hv:imagelist": {
+      "dc:identifier": "...",
+      "hv:images": [
+        {
+          "hv:image": {
+            "dc:identifier": "...",
+            "dc:title": "...",
+            "hv:version": "...",
+            "hv:format": "QCOW2",
+            "hv:uri": "https://...",
+            "hv:ram_minimum": 1073741824,
+            "sl:checksum:sha512": "..."
+          }
+        }
+      ]
+    }
+  }
+"""
+
+import io
+import json
+
+from imagekeeper.common import exception
+from imagekeeper.common import utils
+from imagekeeper.image import appliance
 from imagekeeper.image import formats
 
+IMAGES_KEY = '"hv:images"'
+WHITESPACE = ' \t\n\r'
+# Number of characters from the end of the buffer within which a decoding
+# error can be caused by a truncated entry, such as a cut unicode escape
+TRUNCATION_MARGIN = 6
+
 
 class HelixNebula(formats.BaseFormat):
-    """HelixNebula Format class."""
+    """HelixNebula Format class.
+
+    The image list is parsed as a stream: the entries of the image array
+    are decoded one at a time and converted into compact appliance records,
+    so that the whole document is never loaded in memory.
+    """
+
+    feature = 'helixnebula'
+
+    # Number of characters read from the image list at once
+    read_size = 65536
+
+    # Maximum number of characters of an entry of the image list
+    max_entry_size = 1048576
 
     def __init__(self):
         """Initialize the class."""
         super(HelixNebula, self).__init__('helixnebula')
 
+    @staticmethod
+    def _to_appliance(entry):
+        """Convert an entry of the image list into an appliance.
+
+        :param entry: the decoded entry
+        :type entry: dict
+        :return: the appliance
+        :rtype: appliance.Appliance
+        """
+        image = entry.get('hv:image', entry)
+        checksum = None
+        for key, value in image.items():
+            if key.startswith('sl:checksum:'):
+                checksum = value
+                break
+        min_ram = 0
+        if image.get('hv:ram_minimum'):
+            min_ram = utils.convert_ram(int(image['hv:ram_minimum']))
+        return appliance.Appliance(
+            identifier=image['dc:identifier'],
+            version=image.get('hv:version'),
+            title=image.get('dc:title'),
+            format=image.get('hv:format'),
+            location=image.get('hv:uri'),
+            checksum=checksum,
+            min_ram=min_ram,
+        )
+
+    @staticmethod
+    def _truncated(err, buf):
+        """Return whether a decoding error is caused by the end of a buffer.
+
+        :param err: the decoding error
+        :type err: ValueError
+        :param buf: the decoded buffer
+        :type buf: str
+        :rtype: bool
+        """
+        if not isinstance(err, json.JSONDecodeError):
+            return True
+        # An unterminated string is reported at its beginning
+        return (err.pos >= len(buf) - TRUNCATION_MARGIN or
+                err.msg.startswith('Unterminated string'))
+
+    def _iter_entries(self, list_file):
+        """Decode the entries of the image array one at a time.
+
+        A malformed entry is reported at once, an incomplete one being
+        completed by the next reads up to ``max_entry_size`` characters.
+
+        :param list_file: the image list
+        :type list_file: file
+        :return: the decoded entries
+        :rtype: iterator of dict
+        """
+        decoder = json.JSONDecoder()
+        buf = ''
+        # Look for the beginning of the image array
+        while True:
+            chunk = list_file.read(self.read_size)
+            if not chunk:
+                raise ValueError("no %s array found" % IMAGES_KEY)
+            buf += chunk
+            index = buf.find(IMAGES_KEY)
+            if index < 0:
+                buf = buf[-len(IMAGES_KEY):]
+                continue
+            index = buf.find('[', index)
+            if index >= 0:
+                buf = buf[index + 1:]
+                break
+
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos >= len(buf):
+                chunk = list_file.read(self.read_size)
+                if not chunk:
+                    raise ValueError("unterminated %s array" % IMAGES_KEY)
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',':
+                pos += 1
+                continue
+            try:
+                entry, pos = decoder.raw_decode(buf, pos)
+            except ValueError as err:
+                if not self._truncated(err, buf):
+                    raise
+                if len(buf) - pos > self.max_entry_size:
+                    raise ValueError("entry longer than %d characters" %
+                                     self.max_entry_size)
+                # The entry is not complete yet
+                chunk = list_file.read(self.read_size)
+                if not chunk:
+                    raise
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield entry
+            if pos >= self.read_size:
+                buf = buf[pos:]
+                pos = 0
+
     def parse_file(self, filename):
-        """Parse an image file."""
-        pass
+        """Parse an image file.
+
+        :param filename: the path of the image list
+        :type filename: str
+        :return: the appliances of the image list
+        :rtype: iterator of appliance.Appliance
+        """
+        with io.open(filename, 'r', encoding='utf-8') as list_file:
+            try:
+                for entry in self._iter_entries(list_file):
+                    yield self._to_appliance(entry)
+            except (ValueError, KeyError, TypeError, AttributeError) as err:
+                raise exception.InvalidImageListFile(
+                    image_list_file=filename, exception=err
+                )
@@ -14,6 +14,7 @@
 
 """Class for managing an image list."""
 
+import collections
 import os
 
 from oslo_config import cfg
@@ -24,6 +25,11 @@ from imagekeeper.image import formats
 CONF = cfg.CONF
 
 
+ImageListDiff = collections.namedtuple(
+    'ImageListDiff', ['added', 'changed', 'removed']
+)
+
+
 class ImageListManager(object):
     """A class for managing an image list."""
 
@@ -36,14 +42,60 @@ class ImageListManager(object):
         self.images = {}
         self.format_cls_map = {}
         self.format_handler = formats.ImageListFormatHandler()
+        self._stat = None
+        self.refresh()
 
     def _parse_image_list(self):
-        """Parse the image list."""
+        """Parse the image list.
+
+        :return: the appliances, indexed by identifier
+        :rtype: dict
+        """
         image_list_handler = self.format_handler.load_handler(
             CONF.image_list_format
         )
-        return image_list_handler
+        if image_list_handler is None:
+            raise exception.ImageListFormatNotFound(
+                image_list_format=CONF.image_list_format,
+                exception='unknown format'
+            )
+        images = {}
+        for appliance in image_list_handler().parse_file(
+                CONF.image_list_path):
+            images[appliance.identifier] = appliance
+        return images
+
+    def refresh(self):
+        """Parse the image list again if it has been modified.
+
+        :return: the appliances added, changed and removed since the
+                 previous parsing
+        :rtype: ImageListDiff
+        """
+        stat = os.stat(CONF.image_list_path)
+        stat = (stat.st_mtime, stat.st_size)
+        if stat == self._stat:
+            return ImageListDiff([], [], [])
+
+        previous = self.images
+        self.images = self._parse_image_list()
+        self._stat = stat
+
+        added = []
+        changed = []
+        for identifier, appliance in self.images.items():
+            if identifier not in previous:
+                added.append(appliance)
+            elif previous[identifier] != appliance:
+                changed.append(appliance)
+        removed = [appliance for identifier, appliance in previous.items()
+                   if identifier not in self.images]
+        return ImageListDiff(added, changed, removed)
 
     def get_images(self):
-        """Return the backend list."""
+        """Return the appliances, indexed by identifier."""
         return self.images
+
+    def __len__(self):
+        """Return the number of appliances."""
+        return len(self.images)
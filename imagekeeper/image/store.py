@@ -0,0 +1,423 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Content-addressed store of the VM images.
+
+Each image is stored once, as a read-only blob named after its sha256
+digest. The appliances reference the blobs, so that identical images of
+different appliances or versions share the same blob. The images converted
+to another disk format are blobs as well, indexed by the checksum of their
+source and their format::
+
+  <store_dir>/blobs/sha256/<2 first digits>/<digest>
+  <store_dir>/store.db
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    identifier TEXT NOT NULL,
+    version TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (identifier, version)
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+CREATE TABLE IF NOT EXISTS conversions (
+    source TEXT NOT NULL,
+    format TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (source, format, identifier, version)
+);
+"""
+
+# ioctl cloning a file on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
+READ_SIZE = 1048576
+
+
+def file_digest(path, algorithm='sha256'):
+    """Return the digest of a file.
+
+    :param path: the path of the file
+    :type path: str
+    :param algorithm: the hashlib algorithm, sha256 by default
+    :type algorithm: str
+    :return: the hexadecimal digest
+    :rtype: str
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(READ_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def clone_file(source, destination):
+    """Make a file available at another path without copying it if possible.
+
+    A hard link is created if possible. Otherwise, a reflink is tried,
+    which only works on a copy-on-write file system holding both paths.
+    The file is copied as a last resort.
+
+    :param source: the path of the file
+    :type source: str
+    :param destination: the new path of the file
+    :type destination: str
+    :return: the method used: 'link', 'reflink' or 'copy'
+    :rtype: str
+    """
+    try:
+        os.link(source, destination)
+        return 'link'
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except (IOError, OSError):
+            shutil.copyfileobj(src, dst, READ_SIZE)
+            return 'copy'
+
+
+class ImageStore(object):
+    """Content-addressed store of images with reference counting."""
+
+    def __init__(self, root=None, quota=None):
+        """Initialize the class.
+
+        :param root: the directory of the store, by default the store
+                     directory
+        :type root: str
+        :param quota: the maximum size in bytes of the blobs, 0 for no
+                      limit, by default the store_quota option
+        :type quota: int
+        """
+        if root is None:
+            root = CONF.store_dir
+        if quota is None:
+            quota = CONF.store_quota
+        self.root = root
+        self.quota = quota
+        self.blob_dir = os.path.join(root, 'blobs', 'sha256')
+        if not os.path.isdir(self.blob_dir):
+            os.makedirs(self.blob_dir)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, 'store.db'),
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def path(self, digest):
+        """Return the path of a blob.
+
+        :param digest: the sha256 digest of the image
+        :type digest: str
+        :return: the path of the blob
+        :rtype: str
+        """
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def __contains__(self, digest):
+        """Return whether a blob is in the store."""
+        return os.path.isfile(self.path(digest))
+
+    def add(self, path, digest=None):
+        """Add an image to the store.
+
+        The file is moved into the store, it is simply removed if an
+        identical image is already stored.
+
+        :param path: the path of the image
+        :type path: str
+        :param digest: the sha256 digest of the image, computed if not set
+        :type digest: str
+        :return: the digest of the image
+        :rtype: str
+        """
+        if digest is None:
+            digest = file_digest(path)
+        blob = self.path(digest)
+        with self._lock:
+            if os.path.isfile(blob):
+                LOG.debug("Image '%s' already stored as %s" % (path, digest))
+                os.remove(path)
+            else:
+                if not os.path.isdir(os.path.dirname(blob)):
+                    os.makedirs(os.path.dirname(blob))
+                os.chmod(path, 0o444)
+                try:
+                    os.rename(path, blob)
+                except OSError as err:
+                    if err.errno != errno.EXDEV:
+                        raise
+                    clone_file(path, blob)
+                    os.remove(path)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                (digest, os.path.getsize(blob), time.time())
+            )
+        return digest
+
+    def get(self, digest):
+        """Return the path of a blob and record its use.
+
+        :param digest: the sha256 digest of the image
+        :type digest: str
+        :return: the path of the blob, None if it is not stored
+        :rtype: str
+        """
+        if digest not in self:
+            return None
+        self.touch(digest)
+        return self.path(digest)
+
+    def touch(self, digest):
+        """Record the use of a blob, for the eviction of unused ones."""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE blobs SET last_used = ? WHERE digest = ?',
+                (time.time(), digest)
+            )
+
+    def export(self, digest, destination):
+        """Make a blob available at another path without copying it.
+
+        :param digest: the sha256 digest of the image
+        :type digest: str
+        :param destination: the path where the image is made available
+        :type destination: str
+        :return: the method used: 'link', 'reflink' or 'copy'
+        :rtype: str
+        """
+        return clone_file(self.get(digest), destination)
+
+    def reference(self, identifier, version, digest):
+        """Record that an appliance version uses a blob.
+
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :param version: the version of the appliance
+        :type version: str
+        :param digest: the sha256 digest of the image
+        :type digest: str
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                (identifier, version or '', digest)
+            )
+
+    def lookup(self, identifier, version):
+        """Return the digest of the image of an appliance version.
+
+        :return: the digest, None if the appliance is not referenced
+        :rtype: str
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest FROM refs WHERE identifier = ? AND '
+                'version = ?', (identifier, version or '')
+            ).fetchone()
+        return row[0] if row else None
+
+    def conversion(self, source, disk_format):
+        """Return the digest of an image converted to a disk format.
+
+        :param source: the checksum of the source image
+        :type source: str
+        :param disk_format: the disk format of the converted image
+        :type disk_format: str
+        :return: the digest, None if the image has not been converted
+        :rtype: str
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest FROM conversions WHERE source = ? AND '
+                'format = ? LIMIT 1', (source, disk_format)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_conversion(self, source, disk_format, digest, identifier,
+                       version):
+        """Record the conversion of an image to a disk format.
+
+        The converted image is kept as long as one of the appliance
+        versions using it is.
+
+        :param source: the checksum of the source image
+        :type source: str
+        :param disk_format: the disk format of the converted image
+        :type disk_format: str
+        :param digest: the sha256 digest of the converted image
+        :type digest: str
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :param version: the version of the appliance
+        :type version: str
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?)',
+                (source, disk_format, digest, identifier, version or '')
+            )
+
+    def release(self, identifier, version=None):
+        """Remove the references of an appliance.
+
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :param version: the version of the appliance, all if not set
+        :type version: str
+        """
+        with self._lock:
+            if version is None:
+                for query in ('DELETE FROM refs WHERE identifier = ?',
+                              'DELETE FROM conversions WHERE identifier = ?'):
+                    self._conn.execute(query, (identifier,))
+            else:
+                for query in ('DELETE FROM refs WHERE identifier = ? AND '
+                              'version = ?',
+                              'DELETE FROM conversions WHERE identifier = ? '
+                              'AND version = ?'):
+                    self._conn.execute(query, (identifier, version))
+
+    def retain(self, appliances):
+        """Only keep the references of the given appliances.
+
+        :param appliances: the appliances of the image list
+        :type appliances: iterable
+        """
+        keep = set((a['identifier'], a['version'] or '') for a in appliances)
+        with self._lock:
+            refs = self._conn.execute(
+                'SELECT identifier, version FROM refs UNION '
+                'SELECT identifier, version FROM conversions'
+            ).fetchall()
+        for identifier, version in refs:
+            if (identifier, version) not in keep:
+                self.release(identifier, version)
+
+    def refcount(self, digest):
+        """Return the number of appliance versions or conversions using a
+        blob.
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT (SELECT COUNT(*) FROM refs WHERE digest = ?) + '
+                '(SELECT COUNT(*) FROM conversions WHERE digest = ?)',
+                (digest, digest)
+            ).fetchone()[0]
+
+    def size(self):
+        """Return the total size of the blobs in bytes."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM blobs'
+            ).fetchone()[0]
+
+    def _remove(self, digest):
+        """Remove a blob and its references."""
+        try:
+            os.remove(self.path(digest))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        with self._lock:
+            self._conn.execute('DELETE FROM blobs WHERE digest = ?',
+                               (digest,))
+            self._conn.execute('DELETE FROM refs WHERE digest = ?',
+                               (digest,))
+            self._conn.execute('DELETE FROM conversions WHERE digest = ?',
+                               (digest,))
+
+    def gc(self):
+        """Remove the blobs that no appliance or conversion references.
+
+        :return: the digests of the removed blobs
+        :rtype: list
+        """
+        with self._lock:
+            digests = [row[0] for row in self._conn.execute(
+                'SELECT digest FROM blobs WHERE digest NOT IN '
+                '(SELECT digest FROM refs UNION '
+                'SELECT digest FROM conversions)'
+            ).fetchall()]
+        for digest in digests:
+            LOG.debug("Removing unreferenced image %s" % digest)
+            self._remove(digest)
+        return digests
+
+    def evict(self, quota=None):
+        """Remove the least recently used blobs to fit within a quota.
+
+        The unreferenced blobs are removed first. The referenced ones are
+        then removed, least recently used first, and will be retrieved
+        again when needed.
+
+        :param quota: the maximum size in bytes, 0 for no limit, by
+                      default the quota of the store
+        :type quota: int
+        :return: the digests of the removed blobs
+        :rtype: list
+        """
+        if quota is None:
+            quota = self.quota
+        removed = self.gc()
+        if not quota:
+            return removed
+        with self._lock:
+            blobs = self._conn.execute(
+                'SELECT digest, size FROM blobs ORDER BY last_used'
+            ).fetchall()
+        total = sum(size for _, size in blobs)
+        for digest, size in blobs:
+            if total <= quota:
+                break
+            LOG.info("Evicting image %s (%d bytes) from the store" %
+                     (digest, size))
+            self._remove(digest)
+            removed.append(digest)
+            total -= size
+        return removed
+
+    def close(self):
+        """Close the store index."""
+        with self._lock:
+            self._conn.close()
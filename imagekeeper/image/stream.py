@@ -0,0 +1,229 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Streaming access to the image files."""
+
+import errno
+import hashlib
+import os
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import utils
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+
+class ChecksumReader(object):
+    """Read-only file object computing checksums of the data read.
+
+    The file is read sequentially by blocks of ``chunk_size`` bytes and
+    every checksum is updated with the data as it goes, so that the image
+    is read only once to be both uploaded and verified.
+    """
+
+    def __init__(self, filename, chunk_size=65536, algorithms=('md5',)):
+        """Initialize the class.
+
+        :param filename: the path of the image file
+        :type filename: str
+        :param chunk_size: the size of the blocks read from the disk
+        :type chunk_size: int
+        :param algorithms: the hashlib algorithms to compute
+        :type algorithms: iterable
+        """
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(filename)
+        self.bytes_read = 0
+        self.algorithms = frozenset(algorithms)
+        self._hashes = dict(
+            (algorithm, hashlib.new(algorithm)) for algorithm in algorithms
+        )
+        self._file = open(filename, 'rb', buffering=chunk_size)
+
+    def read(self, size=-1):
+        """Read data from the file and update the checksums.
+
+        :param size: the maximum number of bytes to read
+        :type size: int
+        :return: the data, an empty string at the end of the file
+        :rtype: bytes
+        """
+        data = self._file.read(size)
+        if data:
+            self._update(data)
+        return data
+
+    def _update(self, data):
+        """Update the checksums with data following the data read."""
+        self.bytes_read += len(data)
+        for checksum in self._hashes.values():
+            checksum.update(data)
+
+    def __iter__(self):
+        """Iterate over the file by blocks of ``chunk_size`` bytes."""
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                return
+            yield data
+
+    def hexdigest(self, algorithm):
+        """Return the checksum of the data read so far.
+
+        :param algorithm: the hashlib algorithm
+        :type algorithm: str
+        :return: the hexadecimal checksum
+        :rtype: str
+        """
+        return self._hashes[algorithm].hexdigest()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        """Return the reader."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the file."""
+        self.close()
+
+
+class SparseReader(ChecksumReader):
+    """Checksum reader skipping the holes of a sparse file.
+
+    The extents of the file are found with ``SEEK_DATA`` and ``SEEK_HOLE``.
+    The holes are not read from the disk but returned as zeros, taken from
+    a shared buffer when a whole chunk is requested. The checksums still
+    cover every byte of the file.
+    """
+
+    def __init__(self, filename, chunk_size=65536, algorithms=('md5',)):
+        """Initialize the class.
+
+        :param filename: the path of the image file
+        :type filename: str
+        :param chunk_size: the size of the blocks read from the disk
+        :type chunk_size: int
+        :param algorithms: the hashlib algorithms to compute
+        :type algorithms: iterable
+        """
+        super(SparseReader, self).__init__(filename, chunk_size, algorithms)
+        self.data_read = 0
+        self._fd = self._file.fileno()
+        self._zeros = bytes(chunk_size)
+        # Current extent: start, end and whether it holds data
+        self._extent = (0, 0, True)
+
+    def _find_extent(self, offset):
+        """Return the extent of the file starting at an offset."""
+        try:
+            start = os.lseek(self._fd, offset, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno != errno.ENXIO:
+                raise
+            # No data up to the end of the file
+            return offset, self.size, False
+        if start > offset:
+            return offset, start, False
+        return offset, os.lseek(self._fd, offset, os.SEEK_HOLE), True
+
+    def read(self, size=-1):
+        """Read data from the file and update the checksums.
+
+        :param size: the maximum number of bytes to read
+        :type size: int
+        :return: the data, an empty string at the end of the file
+        :rtype: bytes
+        """
+        offset = self.bytes_read
+        if size is None or size < 0:
+            size = self.size - offset
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b''
+        start, end, has_data = self._extent
+        if not start <= offset < end:
+            start, end, has_data = self._extent = self._find_extent(offset)
+        size = min(size, end - offset)
+        if has_data:
+            data = os.pread(self._fd, size, offset)
+            if not data:
+                return data
+            self.data_read += len(data)
+        elif size == len(self._zeros):
+            data = self._zeros
+        else:
+            data = bytes(size)
+        self._update(data)
+        return data
+
+    @property
+    def data_ratio(self):
+        """Return the fraction of the bytes read actually read from disk."""
+        if not self.bytes_read:
+            return 1.0
+        return float(self.data_read) / self.bytes_read
+
+    def close(self):
+        """Close the file."""
+        if self.bytes_read:
+            LOG.debug("Read %d bytes of data out of %d from '%s' (%.1f%%)" %
+                      (self.data_read, self.bytes_read, self.filename,
+                       100 * self.data_ratio))
+        super(SparseReader, self).close()
+
+
+def is_sparse(filename):
+    """Return whether a file has holes that can be skipped while reading.
+
+    :param filename: the path of the file
+    :type filename: str
+    :rtype: bool
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return False
+    stat = os.stat(filename)
+    return stat.st_blocks * 512 < stat.st_size
+
+
+def open_image(appliance, chunk_size=None):
+    """Open the image of an appliance for a checksummed read.
+
+    The md5 checksum, the checksum configured with ``image_hash_algo`` and
+    the checksum matching the one of the appliance are computed.
+
+    :param appliance: the appliance
+    :type appliance: dict
+    :param chunk_size: the size of the blocks read from the disk
+    :type chunk_size: int
+    :return: a reader for the image file, skipping its holes if it is
+             sparse
+    :rtype: ChecksumReader
+    """
+    algorithms = set(['md5', CONF.image_hash_algo])
+    checksum_algo = utils.checksum_algorithm(appliance['checksum'])
+    if checksum_algo:
+        algorithms.add(checksum_algo)
+    reader_class = ChecksumReader
+    if is_sparse(appliance['location']):
+        reader_class = SparseReader
+    return reader_class(appliance['location'],
+                        chunk_size or CONF.upload_chunk_size,
+                        algorithms)
@@ -20,11 +20,58 @@ is used for detecting and loading image formats and Cloud backends by
 loading modules from those directories and find certain types of
 classes within those modules. It is based on the OpenStack Nova
 plugin module.
+
+The plugins are discovered lazily: a module is only imported when the
+feature it provides is requested, so that the dependencies of the
+backends and formats not in use are never imported. The feature of a
+plugin is found, in order:
+
+- in the entry points of the group named after the namespace, for
+  example ``helixnebula = imagekeeper.image.formats.helixnebula:HelixNebula``
+  in the ``imagekeeper.image.formats`` group;
+- in the module of the namespace named after the feature;
+- in all the modules of the namespace, as a last resort when there is
+  no such module.
+
+The classes found are cached for the lifetime of the process.
 """
 
 import importlib
 import inspect
 import pkgutil
+import threading
+
+try:
+    from importlib import metadata
+except ImportError:
+    # importlib.metadata only exists from Python 3.8
+    metadata = None
+
+# Classes found for each (namespace, feature), None if there is none
+_CACHE = {}
+_LOCK = threading.RLock()
+
+
+def _entry_points(group):
+    """Return the entry points of a group, indexed by name."""
+    if metadata is None:
+        # pkg_resources is slow to import, it is only used when needed
+        import pkg_resources
+        entry_points = pkg_resources.iter_entry_points(group)
+    else:
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            entry_points = entry_points.select(group=group)
+        else:
+            entry_points = entry_points.get(group, [])
+    return dict((entry_point.name, entry_point)
+                for entry_point in entry_points)
+
+
+def clear_cache():
+    """Forget the plugins found so far."""
+    with _LOCK:
+        _CACHE.clear()
 
 
 class PluginLoader(object):
@@ -34,7 +81,14 @@ class PluginLoader(object):
         """Initialize the class."""
         self.namespace = namespace
         self.loadable_cls_type = loadable_cls_type
-        self.available_classes = self._get_all_classes()
+
+    @property
+    def available_classes(self):
+        """Return all the plugin classes, indexed by feature.
+
+        All the plugin modules are imported.
+        """
+        return self._get_all_classes()
 
     def _is_correct_class(self, obj):
         """Check if the class is correct.
@@ -59,26 +113,84 @@ class PluginLoader(object):
                 classes.append(itm)
         return classes
 
+    def _module_names(self):
+        """Return the names of the modules of the namespace.
+
+        The modules are listed without being imported.
+        """
+        module = importlib.import_module(self.namespace)
+        return [name for _, name, _ in pkgutil.iter_modules(module.__path__)]
+
     def _get_all_classes(self):
         """Return the list of classes from modules in a directory.
 
         Get the classes of the type we want from all modules found
         in the directory that defines this class.
         """
-        classes = {}
-        module = importlib.import_module(self.namespace)
-        for submodule in pkgutil.iter_modules(
-                module.__path__, module.__name__ + "."
-        ):
-            submodule_classes = self._get_classes_from_module(submodule.name)
-            for correct_class in submodule_classes:
-                classes[correct_class.get_feature()] = correct_class
-        return classes
+        with _LOCK:
+            if (self.namespace, None) not in _CACHE:
+                classes = {}
+                for name in self._module_names():
+                    for correct_class in self._get_classes_from_module(
+                            self.namespace + '.' + name):
+                        classes[correct_class.get_feature()] = correct_class
+                for feature, entry_point in _entry_points(
+                        self.namespace).items():
+                    classes[feature] = self._load_entry_point(entry_point)
+                for feature, correct_class in classes.items():
+                    _CACHE[(self.namespace, feature)] = correct_class
+                _CACHE[(self.namespace, None)] = classes
+            return dict((feature, correct_class) for (namespace, feature),
+                        correct_class in _CACHE.items()
+                        if namespace == self.namespace and
+                        feature is not None and correct_class is not None)
+
+    def _load_entry_point(self, entry_point):
+        """Load the class of an entry point, None if it is not a plugin."""
+        correct_class = entry_point.load()
+        if not self._is_correct_class(correct_class):
+            return None
+        return correct_class
+
+    def _find_class(self, feature):
+        """Find the class of a feature, importing as few modules as can be.
+
+        :param feature: the name of the feature
+        :type feature: str
+        :return: the class, None if there is none
+        :rtype: type
+        """
+        entry_point = _entry_points(self.namespace).get(feature)
+        if entry_point is not None:
+            return self._load_entry_point(entry_point)
+        if feature in self._module_names():
+            for correct_class in self._get_classes_from_module(
+                    self.namespace + '.' + feature):
+                if correct_class.get_feature() == feature:
+                    return correct_class
+            return None
+        return self._get_all_classes().get(feature)
 
     def load_handler(self, class_type):
-        """Load the handler."""
-        raise NotImplementedError
+        """Load the handler.
+
+        :param class_type: the feature provided by the handler
+        :type class_type: str
+        :return: the class of the handler, None if there is none
+        :rtype: type
+        """
+        with _LOCK:
+            if (self.namespace, class_type) not in _CACHE:
+                _CACHE[(self.namespace, class_type)] = self._find_class(
+                    class_type
+                )
+            return _CACHE[(self.namespace, class_type)]
 
     def get_supported_handler(self):
         """Return a list of plugin classes found in this directory."""
-        return self.available_classes.keys()
+        features = set(_entry_points(self.namespace))
+        if not features:
+            # Without entry points, the modules are named after their
+            # feature
+            features.update(self._module_names())
+        return sorted(features)
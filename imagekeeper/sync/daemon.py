@@ -0,0 +1,191 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Daemon synchronizing the backends periodically.
+
+The backends, their sessions and their image catalogues are kept between
+the synchronizations, as well as the image list, the state database and
+the image store. Each backend is synchronized on its own schedule, every
+``sync_interval`` seconds plus a random delay up to ``sync_jitter``
+seconds. The image list and the backend file are checked every
+``poll_interval`` seconds: a change of the image list makes all the
+backends due, a new or modified backend is synchronized at once.
+"""
+
+import collections
+import random
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import metrics
+from imagekeeper.sync import engine
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+
+class SyncDaemon(object):
+    """Synchronize the backends periodically, keeping them connected."""
+
+    def __init__(self, images, backends, state=None, store=None,
+                 journal=None, downloader=None, converter=None):
+        """Initialize the class.
+
+        :param images: the image list
+        :type images: image.manager.ImageListManager
+        :param backends: the backends
+        :type backends: backend.manager.BackendManager
+        :param state: the local state database, if any
+        :type state: sync.state.SyncState
+        :param store: the image store, if any
+        :type store: image.store.ImageStore
+        :param journal: the journal of the operations, if any
+        :type journal: sync.journal.Journal
+        :param downloader: the downloader of the remote images, if any
+        :type downloader: image.download.Downloader
+        :param converter: the converter of the images, if any
+        :type converter: image.convert.Converter
+        """
+        self.images = images
+        self.backends = backends
+        self.state = state
+        self.store = store
+        self.journal = journal
+        self.downloader = downloader
+        self.converter = converter
+        self.stopping = threading.Event()
+        self.cycles = 0
+        # Time at which each backend is due, and at which its catalogue
+        # has been retrieved
+        self._due = {}
+        self._loaded = {}
+
+    def stop(self, *args):
+        """Stop the daemon once the uploads in progress are completed.
+
+        It can be used as a signal handler.
+        """
+        if not self.stopping.is_set():
+            LOG.info("Stopping, waiting for the uploads in progress")
+        self.stopping.set()
+
+    def _reschedule(self, name):
+        """Set the next synchronization of a backend."""
+        # The jitter only spreads the runs, it needs no secure source
+        self._due[name] = (time.monotonic() + CONF.sync_interval +
+                           random.uniform(0, CONF.sync_jitter))  # nosec B311
+
+    def _refresh(self, now):
+        """Take the changes of the image list and backend file into account.
+
+        :return: whether the image list has changed
+        :rtype: bool
+        """
+        changes = self.images.refresh()
+        if any(changes):
+            LOG.info("Image list changed: %d added, %d changed, %d removed" %
+                     tuple(len(change) for change in changes))
+        backend_changes = self.backends.refresh()
+        for name in backend_changes.removed + backend_changes.changed:
+            self._due.pop(name, None)
+            self._loaded.pop(name, None)
+        for name in self.backends.names():
+            self._due.setdefault(name, now)
+        return any(changes)
+
+    def _warm(self, backend):
+        """Retrieve the catalogue of a backend if needed.
+
+        The catalogue is kept up to date by the operations of the backend,
+        but the changes made by others are only seen when it is retrieved
+        again, after ``state_max_age`` seconds.
+        """
+        if not hasattr(backend, 'catalogue'):
+            return
+        now = time.monotonic()
+        loaded = self._loaded.get(backend.cloud_id)
+        if (loaded is not None and CONF.state_max_age and
+                now - loaded > CONF.state_max_age):
+            backend.reset_catalogue()
+            loaded = None
+        if loaded is None:
+            LOG.debug("%d image(s) in the catalogue of the backend '%s'" %
+                      (len(backend.catalogue), backend.cloud_id))
+            self._loaded[backend.cloud_id] = now
+
+    def run_once(self):
+        """Synchronize the backends that are due.
+
+        :return: the report of each backend synchronized, None if no
+                 backend is due
+        :rtype: collections.OrderedDict
+        """
+        now = time.monotonic()
+        changed = self._refresh(now)
+        due = sorted(name for name, when in self._due.items()
+                     if changed or when <= now)
+        if not due:
+            return None
+        self.cycles += 1
+        LOG.info("Synchronizing the backend(s) %s" % ', '.join(due))
+        backends = collections.OrderedDict()
+        for name in due:
+            try:
+                backends[name] = self.backends.get_backend(name)
+                self._warm(backends[name])
+            except Exception as err:
+                LOG.error("Backend '%s' is not available" % name)
+                LOG.exception(err)
+                backends.pop(name, None)
+                self._reschedule(name)
+        sync_engine = engine.SyncEngine(backends, self.images, self.state,
+                                        self.journal, self.downloader,
+                                        self.converter)
+        sync_engine.stopping = self.stopping
+        try:
+            reports = sync_engine.run()
+        finally:
+            for name in backends:
+                self._reschedule(name)
+        if self.store is not None and not self.stopping.is_set():
+            self.store.retain(self.images.get_images().values())
+            self.store.evict()
+        if self.journal is not None:
+            self.journal.compact()
+        for report in reports.values():
+            LOG.info(str(report))
+        metrics.export()
+        return reports
+
+    def _wait_time(self):
+        """Return the time to wait before the next cycle."""
+        wait = CONF.poll_interval
+        if self._due:
+            wait = min(wait, min(self._due.values()) - time.monotonic())
+        return max(0.0, wait)
+
+    def run(self):
+        """Synchronize the backends until the daemon is stopped."""
+        LOG.info("Starting the imagekeeper daemon")
+        while not self.stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as err:
+                LOG.error("Synchronization cycle failed")
+                LOG.exception(err)
+            self.stopping.wait(self._wait_time())
+        LOG.info("Imagekeeper daemon stopped")
@@ -0,0 +1,394 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Synchronization of an image list over several backends."""
+
+import collections
+from concurrent import futures
+import os
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.backend import resilience
+from imagekeeper.common import metrics
+from imagekeeper.image import download
+from imagekeeper.image import fanout
+from imagekeeper.sync import pipeline
+from imagekeeper.sync import planner
+from imagekeeper.sync import scheduler
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+
+def deprecate_appliances(backend, item):
+    """Mark the images of appliances as deprecated on a backend.
+
+    :param backend: the backend to synchronize
+    :type backend: connectors.BaseConnector
+    :param item: an UPDATE action, or the list of the DEPRECATE actions of
+                 the backend, run as a single batch
+    :type item: planner.Action or list
+    :return: the result of the deprecation, None if the new version of an
+             updated appliance has to be uploaded
+    :rtype: bool
+    """
+    if isinstance(item, list):
+        results = backend.deprecate_many([action.identifier
+                                          for action in item])
+        return all(result.succeeded for result in results)
+    if not backend.deprecate_appliance(item.identifier):
+        return False
+    return None
+
+
+def delete_appliances(backend, actions):
+    """Delete the images deprecated on a backend.
+
+    :param backend: the backend to synchronize
+    :type backend: connectors.BaseConnector
+    :param actions: the DELETE actions of the backend
+    :type actions: list
+    :return: True if the images have been deleted
+    :rtype: bool
+    """
+    results = backend.delete_appliances_bulk([action.image_id
+                                              for action in actions])
+    return all(result.succeeded for result in results)
+
+
+class _Job(object):
+    """An appliance going through the synchronization pipeline."""
+
+    def __init__(self, appliance):
+        """Initialize the class."""
+        self.appliance = appliance
+        self.names = []
+        self.download = None
+        # Images to upload and names of their backends, once converted
+        self.uploads = None
+        self.failed = []
+
+    def size(self):
+        """Return the size of the local image of the appliance, if any."""
+        location = self.appliance['location']
+        if self.download is not None:
+            location = self.download[0]
+        if location and os.path.isfile(location):
+            return os.path.getsize(location)
+        return None
+
+    def __str__(self):
+        """Return the appliance of the job."""
+        return str(self.appliance)
+
+
+class SyncEngine(object):
+    """Synchronize the appliances of an image list over the backends."""
+
+    def __init__(self, backends, images, state=None, journal=None,
+                 downloader=None, converter=None):
+        """Initialize the class.
+
+        :param backends: the backends, indexed by name
+        :type backends: dict
+        :param images: the image list
+        :type images: image.manager.ImageListManager
+        :param state: the local state database, if any
+        :type state: sync.state.SyncState
+        :param journal: the journal of the operations, if any
+        :type journal: sync.journal.Journal
+        :param downloader: the downloader of the remote images, if any
+        :type downloader: image.download.Downloader
+        :param converter: the converter of the images to the disk formats
+                          preferred by the backends, if any
+        :type converter: image.convert.Converter
+        """
+        self.backends = backends
+        self.images = images
+        self.state = state
+        self.journal = journal
+        self.downloader = downloader
+        self.converter = converter
+        self.stages = collections.OrderedDict()
+        # Event set to stop starting new uploads, the ones started being
+        # completed
+        self.stopping = None
+        # The time budget of the run is shared by all the backends
+        self.budget = resilience.RunBudget()
+        for backend in backends.values():
+            if backend.resilience is not None:
+                backend.resilience.budget = self.budget
+
+    def _record(self, reports):
+        """Record the results of an operation in the state database."""
+        for name, report in reports.items():
+            for item, result in report.results:
+                if self.state is None or result is False:
+                    continue
+                if isinstance(item, planner.Action):
+                    # Deprecation of an updated appliance
+                    self.state.set_status(name, item.identifier, 'DISABLED')
+                elif isinstance(item, list):
+                    if not result:
+                        continue
+                    for action in item:
+                        if action.kind == planner.DEPRECATE:
+                            self.state.set_status(name, action.identifier,
+                                                  'DISABLED')
+                    if item[0].kind == planner.DELETE:
+                        self.state.forget(name, status='DISABLED')
+                elif result:
+                    image_id = None
+                    if isinstance(result, str):
+                        image_id = result
+                    self.state.record(name, item, image_id)
+            del report.results[:]
+
+    def _replay(self, plans):
+        """Complete the operations interrupted by a previous run.
+
+        :param plans: the plan of each backend, indexed by backend name
+        :type plans: dict
+        """
+        if self.journal is None:
+            return
+        for backend in self.backends.values():
+            backend.journal = self.journal
+        if not self.journal.pending():
+            return
+        with futures.ThreadPoolExecutor(CONF.sync_workers) as executor:
+            jobs = {}
+            for name, plan in plans.items():
+                keep = [action.identifier for action in
+                        plan.get_actions(planner.UPDATE, planner.ADD)]
+                jobs[name] = executor.submit(
+                    self.backends[name].replay_journal, keep
+                )
+            for name, job in sorted(jobs.items()):
+                try:
+                    if not job.result():
+                        LOG.warning("Some interrupted operations could not "
+                                    "be completed on the backend '%s'" %
+                                    name)
+                except Exception as err:
+                    LOG.error("Could not replay the journal of the "
+                              "backend '%s'" % name)
+                    LOG.exception(err)
+
+    def _fetch(self, job):
+        """Download the remote image of an appliance into the store."""
+        appliance = job.appliance
+        if (self.downloader is None or
+                not download.is_remote(appliance['location'])):
+            return job
+        digest = self.downloader.cached(appliance)
+        if digest is not None:
+            job.appliance = appliance.replace(
+                location=self.downloader.store.path(digest)
+            )
+        else:
+            job.download = self.downloader.retrieve(appliance)
+        return job
+
+    def _verify(self, job):
+        """Verify a downloaded image and move it into the store.
+
+        The images available locally are verified while being uploaded.
+        """
+        if job.download is not None:
+            digest = self.downloader.promote(job.appliance, *job.download)
+            job.appliance = job.appliance.replace(
+                location=self.downloader.store.path(digest)
+            )
+            job.download = None
+        return job
+
+    def _convert(self, job):
+        """Convert the image of an appliance to the formats of its backends.
+
+        The backends are grouped by disk format, each group being uploaded
+        its own image. A backend whose format cannot be produced is marked
+        as failed.
+        """
+        groups = collections.OrderedDict()
+        for name in job.names:
+            groups.setdefault(self.backends[name].disk_format, []).append(name)
+        job.uploads = []
+        for disk_format, names in groups.items():
+            if disk_format is None:
+                job.uploads.append((job.appliance, names))
+                continue
+            try:
+                job.uploads.append(
+                    (self.converter.convert(job.appliance, disk_format), names)
+                )
+            except Exception as err:
+                LOG.error("Could not convert the image of '%s' for the "
+                          "backend(s) %s" % (job.appliance, ', '.join(names)))
+                LOG.exception(err)
+                job.failed.extend(names)
+        return job
+
+    def _pipeline(self, sync_scheduler, jobs):
+        """Run the jobs through the stages of the synchronization pipeline.
+
+        :param sync_scheduler: the scheduler running the uploads
+        :type sync_scheduler: scheduler.SyncScheduler
+        :param jobs: the appliances to upload and their backends
+        :type jobs: list
+        :return: the report of each stage, indexed by stage name
+        :rtype: collections.OrderedDict
+        """
+        def stage(func):
+            # A failed job is reported as failed on all its backends
+            def run(job):
+                try:
+                    return func(job)
+                except Exception as err:
+                    LOG.error("Could not prepare the image of '%s'" %
+                              job.appliance)
+                    LOG.exception(err)
+                    sync_scheduler.fail_group(job.appliance, job.names)
+                    return None
+            return run
+
+        def upload(job):
+            # The results are reported for the appliance of the image list,
+            # whatever the format of the image uploaded
+            if job.failed:
+                sync_scheduler.fail_group(job.appliance, job.failed)
+            uploads = job.uploads
+            if uploads is None:
+                uploads = [(job.appliance, job.names)]
+            succeeded = False
+            for appliance, names in uploads:
+                results = sync_scheduler.run_group(
+                    job.appliance, names,
+                    lambda _, backends: fanout.upload(appliance, backends)
+                )
+                succeeded = succeeded or any(results.values())
+            return job if succeeded else None
+
+        stages = [pipeline.Stage('fetch', stage(self._fetch),
+                                 CONF.fetch_workers, _Job.size),
+                  pipeline.Stage('verify', stage(self._verify),
+                                 CONF.verify_workers, _Job.size)]
+        if self.converter is not None:
+            stages.append(pipeline.Stage('convert', stage(self._convert),
+                                         self.converter.max_workers,
+                                         _Job.size))
+        stages.append(pipeline.Stage('upload', upload, CONF.upload_workers,
+                                     _Job.size))
+
+        def feed():
+            for job in jobs:
+                if self.stopping is not None and self.stopping.is_set():
+                    # Left to the next run
+                    for name in job.names:
+                        sync_scheduler.reports[name].skipped += 1
+                    continue
+                yield job
+
+        sync_pipeline = pipeline.Pipeline(stages)
+        sync_pipeline.run(feed())
+        return sync_pipeline.reports
+
+    def plan(self):
+        """Plan the operations needed to synchronize the backends.
+
+        :return: the plan of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        with metrics.span('plan'):
+            appliances = list(self.images.get_images().values())
+            return planner.SyncPlanner(self.backends, self.state).plan(
+                appliances
+            )
+
+    def execute(self, plans):
+        """Run the operations of a plan.
+
+        The operations are run in order: the appliances are deprecated
+        first, the ones removed from the image list in a single batch,
+        then the images of the new and updated appliances go through the
+        pipeline downloading, verifying, converting and uploading them to
+        all the backends missing them at once, so that each image is only
+        read once, and the images deprecated by a previous run are deleted.
+        The report of each stage of the pipeline is kept in ``stages``.
+        The operations interrupted by a previous run are completed
+        beforehand. Once ``stopping`` is set, no new image enters the
+        pipeline, the ones already in it being uploaded. Each step is
+        timed as a span of the metrics.
+
+        :param plans: the plan of each backend, indexed by backend name
+        :type plans: dict
+        :return: the report of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        with metrics.span('replay'):
+            self._replay(plans)
+        sync_scheduler = scheduler.SyncScheduler(self.backends)
+        for name, report in sync_scheduler.reports.items():
+            if name not in plans:
+                report.failed += 1
+                continue
+            report.up_to_date += plans[name].up_to_date
+            if self.state is not None:
+                for appliance, image_id in plans[name].synced:
+                    self.state.record(name, appliance, image_id)
+
+        deprecations = {}
+        for name, plan in plans.items():
+            deprecations[name] = plan.get_actions(planner.UPDATE)
+            if plan.get_actions(planner.DEPRECATE):
+                deprecations[name].insert(
+                    0, plan.get_actions(planner.DEPRECATE)
+                )
+        with metrics.span('deprecate'):
+            reports = sync_scheduler.run_plan(deprecations,
+                                              deprecate_appliances)
+            self._record(reports)
+
+        jobs = collections.OrderedDict()
+        for name, plan in sorted(plans.items()):
+            for action in plan.get_actions(planner.UPDATE, planner.ADD):
+                if (action.kind == planner.UPDATE and
+                        action not in reports[name].deferred):
+                    continue
+                if action.identifier not in jobs:
+                    jobs[action.identifier] = _Job(action.appliance)
+                jobs[action.identifier].names.append(name)
+        with metrics.span('pipeline'):
+            self.stages = self._pipeline(sync_scheduler,
+                                         list(jobs.values()))
+            self._record(reports)
+
+        with metrics.span('delete'):
+            reports = sync_scheduler.run_plan(dict(
+                (name, [plan.get_actions(planner.DELETE)])
+                for name, plan in plans.items()
+                if plan.get_actions(planner.DELETE)
+            ), delete_appliances)
+            self._record(reports)
+        return reports
+
+    def run(self):
+        """Synchronize the appliances.
+
+        :return: the report of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        return self.execute(self.plan())
@@ -0,0 +1,211 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Journal of the operations run on the backends.
+
+Each step of an operation is appended to the journal file as a JSON line
+and written to disk before the next step starts, so that the operations
+interrupted by a crash can be found and completed by the next run. A bulk
+operation records the images it is about to change in a single record,
+written to disk once for the whole batch. The end of an operation is not
+forced to disk: an operation whose end is lost is completed again by the
+next run, which is harmless as the completion of an operation is
+idempotent.
+"""
+
+import collections
+import io
+import json
+import os
+import threading
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+ADD = 'add'
+DEPRECATE = 'deprecate'
+DELETE = 'delete'
+
+# Step closing an operation
+DONE = 'done'
+
+JournalEntry = collections.namedtuple(
+    'JournalEntry',
+    ['id', 'backend', 'operation', 'identifier', 'step', 'data']
+)
+
+
+class Journal(object):
+    """Append-only journal of the operations run on the backends."""
+
+    def __init__(self, path=None):
+        """Initialize the class.
+
+        The operations completed by the previous runs are removed from the
+        journal file.
+
+        :param path: the path of the journal, by default ``journal.log`` in
+                     the work directory
+        :type path: str
+        """
+        if path is None:
+            path = os.path.join(CONF.work_dir, 'journal.log')
+        self.path = path
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._load()
+        self._compact()
+        self._file = io.open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        """Read the pending operations from the journal file."""
+        if not os.path.isfile(self.path):
+            return
+        with io.open(self.path, 'r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a journal interrupted while written
+                    LOG.warning("Ignoring a truncated record of the "
+                                "journal '%s'" % self.path)
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        """Apply a record to the pending operations."""
+        entry_id = record['id']
+        if record['step'] == DONE:
+            self._entries.pop(entry_id, None)
+            return
+        entry = self._entries.get(entry_id)
+        if entry is None:
+            entry = JournalEntry(entry_id, record.get('backend'),
+                                 record.get('operation'),
+                                 record.get('identifier'), None, {})
+        data = dict(entry.data)
+        data.update(record.get('data') or {})
+        self._entries[entry_id] = entry._replace(step=record['step'],
+                                                 data=data)
+
+    def _compact(self):
+        """Rewrite the journal file with the pending operations only."""
+        tmp_path = self.path + '.tmp'
+        with io.open(tmp_path, 'w', encoding='utf-8') as journal_file:
+            for entry in self._entries.values():
+                journal_file.write(json.dumps({
+                    'id': entry.id,
+                    'backend': entry.backend,
+                    'operation': entry.operation,
+                    'identifier': entry.identifier,
+                    'step': entry.step,
+                    'data': entry.data,
+                }) + u'\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.rename(tmp_path, self.path)
+
+    def _write(self, record, sync=True):
+        """Append a record to the journal.
+
+        :param record: the record
+        :type record: dict
+        :param sync: whether the record is written to disk before
+                     returning
+        :type sync: bool
+        """
+        with self._lock:
+            self._apply(record)
+            self._file.write(json.dumps(record) + u'\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def begin(self, backend, operation, identifier=None, **data):
+        """Record the beginning of an operation.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param operation: the operation, ADD, DEPRECATE or DELETE
+        :type operation: str
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :return: the id of the operation
+        :rtype: str
+        """
+        entry_id = uuid.uuid4().hex
+        self._write({'id': entry_id, 'backend': backend,
+                     'operation': operation, 'identifier': identifier,
+                     'step': 'started', 'data': data})
+        return entry_id
+
+    def step(self, entry_id, step, **data):
+        """Record a step of an operation.
+
+        :param entry_id: the id of the operation
+        :type entry_id: str
+        :param step: the name of the step
+        :type step: str
+        """
+        self._write({'id': entry_id, 'step': step, 'data': data})
+
+    def finish(self, entry_id):
+        """Record the end of an operation.
+
+        The record is written to disk with the next record, or when the
+        journal is closed.
+
+        :param entry_id: the id of the operation
+        :type entry_id: str
+        """
+        self._write({'id': entry_id, 'step': DONE}, sync=False)
+
+    def pending(self, backend=None, operation=None):
+        """Return the operations that have not been completed.
+
+        :param backend: the name of the backend, all if not set
+        :type backend: str
+        :param operation: the operation, all if not set
+        :type operation: str
+        :return: the pending operations, in order
+        :rtype: list of JournalEntry
+        """
+        with self._lock:
+            return [entry for entry in self._entries.values()
+                    if (backend is None or entry.backend == backend) and
+                    (operation is None or entry.operation == operation)]
+
+    def compact(self):
+        """Remove the completed operations from the journal file.
+
+        It is called between the runs of the daemon, whose journal would
+        otherwise grow with every operation.
+        """
+        with self._lock:
+            self._file.close()
+            self._compact()
+            self._file = io.open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        """Close the journal."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
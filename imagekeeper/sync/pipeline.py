@@ -0,0 +1,217 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Pipeline of stages processing items concurrently.
+
+Each stage has its own worker threads and takes its items from a bounded
+queue fed by the previous stage, so that an item can be processed by a
+stage while the next one is processed by the previous stage. A full queue
+blocks the previous stage, which bounds the work in progress.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import metrics
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+# Marker of the end of the items
+_EOF = object()
+
+
+class Stage(object):
+    """A step of a pipeline."""
+
+    def __init__(self, name, func, workers=1, size=None):
+        """Initialize the class.
+
+        :param name: the name of the stage
+        :type name: str
+        :param func: callable processing an item, returning the item for
+                     the next stage, or None to drop it
+        :type func: callable
+        :param workers: the number of threads of the stage
+        :type workers: int
+        :param size: callable returning the size in bytes of an item, to
+                     report the throughput in bytes
+        :type size: callable
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.size = size
+
+
+class StageReport(object):
+    """Activity of a stage of a pipeline."""
+
+    def __init__(self, name, workers):
+        """Initialize the class.
+
+        :param name: the name of the stage
+        :type name: str
+        :param workers: the number of threads of the stage
+        :type workers: int
+        """
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._depths = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def sample(self, depth):
+        """Record the depth of the input queue when an item is taken."""
+        self.max_depth = max(self.max_depth, depth)
+        self._depths += depth
+
+    @property
+    def mean_depth(self):
+        """Return the mean depth of the input queue."""
+        taken = self.processed + self.failed
+        return float(self._depths) / taken if taken else 0.0
+
+    @property
+    def elapsed(self):
+        """Return the time in seconds between the first and last item."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Return the number of items processed per second."""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        """Return a summary of the activity of the stage."""
+        summary = ("%s: %d processed, %d failed, %.2f item(s)/s" %
+                   (self.name, self.processed, self.failed, self.throughput))
+        if self.bytes and self.elapsed:
+            summary += ", %.1f MB/s" % (self.bytes / self.elapsed / 1048576)
+        return summary + (", %d worker(s), queue depth max %d mean %.1f" %
+                          (self.workers, self.max_depth, self.mean_depth))
+
+
+class Pipeline(object):
+    """Run items through stages connected by bounded queues."""
+
+    def __init__(self, stages, queue_size=None):
+        """Initialize the class.
+
+        :param stages: the stages, in order
+        :type stages: list of Stage
+        :param queue_size: the maximum number of items waiting for a stage,
+                           by default the pipeline_queue_size option
+        :type queue_size: int
+        """
+        self.stages = list(stages)
+        self.queue_size = queue_size or CONF.pipeline_queue_size
+        self.reports = collections.OrderedDict(
+            (stage.name, StageReport(stage.name, stage.workers))
+            for stage in self.stages
+        )
+        self._lock = threading.Lock()
+
+    def _work(self, stage, inbox, outbox, remaining):
+        """Process the items of a stage until the end of its input."""
+        report = self.reports[stage.name]
+        while True:
+            depth = inbox.qsize()
+            item = inbox.get()
+            if item is _EOF:
+                # Let the other workers of the stage stop as well, the
+                # last one tells the next stage
+                inbox.put(_EOF)
+                with self._lock:
+                    remaining[stage.name] -= 1
+                    last = not remaining[stage.name]
+                    if last:
+                        report.finished_at = time.monotonic()
+                if last:
+                    outbox.put(_EOF)
+                return
+            start = time.monotonic()
+            with self._lock:
+                report.sample(depth)
+                if report.started_at is None:
+                    report.started_at = start
+            try:
+                with metrics.span('pipeline.' + stage.name):
+                    result = stage.func(item)
+            except Exception as err:
+                LOG.error("Stage '%s' failed on %s" % (stage.name, item))
+                LOG.exception(err)
+                result = None
+            with self._lock:
+                report.busy += time.monotonic() - start
+                if result is None:
+                    report.failed += 1
+                else:
+                    report.processed += 1
+                    if stage.size is not None:
+                        report.bytes += stage.size(result) or 0
+            if result is not None:
+                outbox.put(result)
+
+    def run(self, items):
+        """Run items through all the stages.
+
+        :param items: the items to process
+        :type items: iterable
+        :return: the items that went through all the stages, in order of
+                 completion
+        :rtype: list
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        output = queue.Queue()
+        queues.append(output)
+        remaining = dict((stage.name, stage.workers) for stage in self.stages)
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], queues[index + 1], remaining),
+                    name='%s-%d' % (stage.name, worker)
+                )
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        # The first queue blocks the feeding when the pipeline is full
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_EOF)
+
+        results = []
+        while True:
+            item = output.get()
+            if item is _EOF:
+                break
+            results.append(item)
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,260 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Plan the operations needed to synchronize the backends."""
+
+import collections
+from concurrent import futures
+
+from oslo_config import cfg
+from oslo_log import log
+
+from imagekeeper.common import utils
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+ADD = 'ADD'
+UPDATE = 'UPDATE'
+DEPRECATE = 'DEPRECATE'
+DELETE = 'DELETE'
+
+# Order in which the actions are run on a backend
+ACTION_ORDER = (DEPRECATE, UPDATE, ADD, DELETE)
+
+
+def image_checksum(image, algorithm):
+    """Return the checksum of the data of an image for an algorithm.
+
+    :param image: the image, as listed by its backend
+    :type image: dict
+    :param algorithm: the hashlib algorithm
+    :type algorithm: str
+    :return: the checksum, None if the backend did not record it
+    :rtype: str
+    """
+    if image.get('IK_HASH_ALGO') == algorithm:
+        return image.get('IK_HASH_VALUE')
+    if image.get('os_hash_algo') == algorithm:
+        return image.get('os_hash_value')
+    if algorithm == 'md5':
+        return image.get('checksum')
+    return None
+
+
+def is_current(image, appliance):
+    """Return whether an image holds the current release of an appliance.
+
+    The version must match. The checksum of the image list must match too,
+    so that an image re-published with the same version is updated, unless
+    it cannot be compared: the image was converted to another disk format,
+    or its backend did not record a checksum of the same algorithm.
+
+    :param image: the image, as listed by its backend
+    :type image: dict
+    :param appliance: the appliance of the image list
+    :type appliance: appliance.Appliance
+    :rtype: bool
+    """
+    if image.get('IK_VERSION') != appliance['version']:
+        return False
+    checksum = appliance['checksum']
+    algorithm = utils.checksum_algorithm(checksum)
+    if algorithm is None:
+        return True
+    disk_format = image.get('disk_format')
+    if (disk_format and appliance['format'] and
+            disk_format.lower() != appliance['format'].lower()):
+        return True
+    actual = image_checksum(image, algorithm)
+    return actual is None or actual.lower() == checksum.lower()
+
+
+class Action(object):
+    """An operation to run on a backend."""
+
+    __slots__ = ('kind', 'appliance', 'identifier', 'image_id')
+
+    def __init__(self, kind, appliance=None, identifier=None, image_id=None):
+        """Initialize the class.
+
+        :param kind: the kind of operation, ADD, UPDATE, DEPRECATE or DELETE
+        :type kind: str
+        :param appliance: the appliance to add or update
+        :type appliance: appliance.Appliance
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :param image_id: the id of the image to delete
+        :type image_id: str
+        """
+        self.kind = kind
+        self.appliance = appliance
+        if identifier is None and appliance is not None:
+            identifier = appliance['identifier']
+        self.identifier = identifier
+        self.image_id = image_id
+
+    def __repr__(self):
+        """Return the representation of the action."""
+        return "<Action %s %s>" % (self.kind, self.identifier)
+
+    def __str__(self):
+        """Return a description of the action."""
+        if self.kind == DELETE:
+            return "%s image %s (%s)" % (self.kind, self.image_id,
+                                         self.identifier)
+        if self.appliance is not None:
+            return "%s %s version %s" % (self.kind, self.appliance,
+                                         self.appliance['version'])
+        return "%s %s" % (self.kind, self.identifier)
+
+
+class BackendPlan(object):
+    """The operations to run on a backend."""
+
+    def __init__(self, name):
+        """Initialize the class.
+
+        :param name: the name of the backend
+        :type name: str
+        """
+        self.name = name
+        self.actions = []
+        self.up_to_date = 0
+        # (appliance, image id) found on the backend but not in the state
+        self.synced = []
+
+    def add(self, action):
+        """Add an action to the plan."""
+        self.actions.append(action)
+        self.actions.sort(key=lambda a: ACTION_ORDER.index(a.kind))
+
+    def get_actions(self, *kinds):
+        """Return the actions of the given kinds, in order."""
+        return [action for action in self.actions if action.kind in kinds]
+
+    def __len__(self):
+        """Return the number of actions."""
+        return len(self.actions)
+
+    def __iter__(self):
+        """Iterate over the actions, in order."""
+        return iter(self.actions)
+
+
+class SyncPlanner(object):
+    """Compare an image list with the images of the backends."""
+
+    def __init__(self, backends, state=None):
+        """Initialize the class.
+
+        :param backends: the backends, indexed by name
+        :type backends: dict
+        :param state: the local state database, if any
+        :type state: sync.state.SyncState
+        """
+        self.backends = backends
+        self.state = state
+
+    def _plan_from_state(self, name, appliances):
+        """Plan a backend from the state database only.
+
+        :return: the plan, None if the backend must be looked at
+        :rtype: BackendPlan
+        """
+        if self.state is None:
+            return None
+        if not all(self.state.is_synced(name, appliance)
+                   for appliance in appliances):
+            return None
+        identifiers = set(a['identifier'] for a in appliances)
+        for record in self.state.records(name):
+            if record.status != 'ENABLED':
+                return None
+            if record.identifier not in identifiers:
+                return None
+        plan = BackendPlan(name)
+        plan.up_to_date = len(appliances)
+        return plan
+
+    def plan_backend(self, name, appliances):
+        """Plan the operations needed to synchronize a backend.
+
+        :param name: the name of the backend
+        :type name: str
+        :param appliances: the appliances of the image list
+        :type appliances: list
+        :return: the plan of the backend
+        :rtype: BackendPlan
+        """
+        plan = self._plan_from_state(name, appliances)
+        if plan is not None:
+            LOG.debug("Backend '%s' is up to date" % name)
+            return plan
+
+        plan = BackendPlan(name)
+        backend = self.backends[name]
+        enabled = collections.defaultdict(list)
+        for image in backend.get_image_list({'IK_STATUS': 'ENABLED'}):
+            if image.get('IK_ID'):
+                enabled[image['IK_ID']].append(image)
+
+        for appliance in appliances:
+            images = enabled.pop(appliance['identifier'], [])
+            current = [image for image in images
+                       if is_current(image, appliance)]
+            if current:
+                plan.up_to_date += 1
+                plan.synced.append((appliance, current[0]['id']))
+            elif images:
+                plan.add(Action(UPDATE, appliance))
+            else:
+                plan.add(Action(ADD, appliance))
+
+        # Appliances removed from the image list
+        for identifier in sorted(enabled):
+            plan.add(Action(DEPRECATE, identifier=identifier))
+
+        # Appliances deprecated by a previous run
+        for image in backend.get_image_list({'IK_STATUS': 'DISABLED'}):
+            plan.add(Action(DELETE, identifier=image.get('IK_ID'),
+                            image_id=image['id']))
+        return plan
+
+    def plan(self, appliances):
+        """Plan the operations needed to synchronize all the backends.
+
+        The backends are looked at concurrently. A backend that cannot be
+        looked at gets no plan.
+
+        :param appliances: the appliances of the image list
+        :type appliances: list
+        :return: the plan of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        appliances = list(appliances)
+        plans = collections.OrderedDict()
+        with futures.ThreadPoolExecutor(CONF.sync_workers) as executor:
+            jobs = dict(
+                (name, executor.submit(self.plan_backend, name, appliances))
+                for name in sorted(self.backends)
+            )
+            for name, job in sorted(jobs.items()):
+                try:
+                    plans[name] = job.result()
+                except Exception as err:
+                    LOG.error("Could not plan the synchronization of the "
+                              "backend '%s'" % name)
+                    LOG.exception(err)
+        return plans
@@ -0,0 +1,417 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Scheduler running the synchronization of several backends in parallel."""
+
+import collections
+from concurrent import futures
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+
+class BackendReport(object):
+    """Result of the synchronization of a single backend."""
+
+    def __init__(self, name, total=0):
+        """Initialize the class.
+
+        :param name: the name of the backend
+        :type name: str
+        :param total: the number of operations to run
+        :type total: int
+        """
+        self.name = name
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.up_to_date = 0
+        self.deferred = []
+        self.results = []
+        self.timed_out = False
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def status(self):
+        """Return the overall status of the backend synchronization."""
+        if self.timed_out:
+            return 'TIMEOUT'
+        if self.failed:
+            return 'FAILED'
+        return 'OK'
+
+    @property
+    def elapsed(self):
+        """Return the time spent synchronizing the backend in seconds."""
+        if self.started_at is None:
+            return 0.0
+        finished_at = self.finished_at
+        if finished_at is None:
+            finished_at = time.monotonic()
+        return finished_at - self.started_at
+
+    def __str__(self):
+        """Return a one line summary of the report."""
+        return ("%s: %s (%d succeeded, %d up to date, %d failed, "
+                "%d skipped) in %.1fs" %
+                (self.name, self.status, self.succeeded, self.up_to_date,
+                 self.failed, self.skipped, self.elapsed))
+
+
+class _Task(object):
+    """An operation on an appliance run on one or several backends."""
+
+    def __init__(self, appliance, names):
+        """Initialize the class."""
+        self.appliance = appliance
+        self.names = list(names)
+
+
+class SyncScheduler(object):
+    """Synchronize appliances over several backends concurrently.
+
+    Operations are run on a shared pool of ``max_workers`` threads. At most
+    ``backend_workers`` operations are run at the same time on a given
+    backend, so that a slow backend cannot hold all the workers while the
+    other backends are waiting. The reports are kept between two runs, so
+    that several stages of a synchronization can share the same summary.
+    """
+
+    def __init__(self, backends, sync_func=None, max_workers=None,
+                 backend_workers=None, backend_timeout=None):
+        """Initialize the class.
+
+        :param backends: the backends to synchronize, indexed by name
+        :type backends: dict
+        :param sync_func: callable synchronizing an appliance on a backend,
+                          called as ``sync_func(backend, appliance)``. It
+                          returns True on success, False on failure and
+                          None to defer the appliance to a later stage.
+        :type sync_func: callable
+        :param max_workers: maximum number of concurrent operations
+        :type max_workers: int
+        :param backend_workers: maximum number of concurrent operations
+                                per backend
+        :type backend_workers: int
+        :param backend_timeout: maximum time in seconds allowed for each
+                                backend over all the stages run by the
+                                scheduler, 0 for no limit
+        :type backend_timeout: int
+        """
+        self.backends = backends
+        self.sync_func = sync_func
+        self.max_workers = max_workers or CONF.sync_workers
+        self.backend_workers = backend_workers or CONF.backend_workers
+        if backend_timeout is None:
+            backend_timeout = CONF.backend_timeout
+        self.backend_timeout = backend_timeout
+        self.reports = collections.OrderedDict(
+            (name, BackendReport(name)) for name in sorted(backends)
+        )
+        self._deadlines = {}
+        self._slots = threading.Condition()
+        self._in_flight = collections.Counter()
+
+    def _run_task(self, func, task):
+        """Run a task and return the result of each backend."""
+        try:
+            return func(task.appliance, task.names)
+        except Exception as err:
+            LOG.error("Could not synchronize appliance '%s' on the "
+                      "backend(s) %s" % (task.appliance,
+                                         ', '.join(task.names)))
+            LOG.exception(err)
+            return dict((name, False) for name in task.names)
+
+    def _start(self, name):
+        """Record the start of an operation on a backend.
+
+        The deadline of the backend is set by its first operation and
+        applies to all the following stages run by the scheduler.
+        """
+        report = self.reports[name]
+        if report.started_at is None:
+            LOG.info("Managing images at %s" % name)
+            report.started_at = time.monotonic()
+            if self.backend_timeout:
+                self._deadlines[name] = (report.started_at +
+                                         self.backend_timeout)
+        report.finished_at = None
+
+    def _time_out(self, name):
+        """Mark a backend as timed out."""
+        report = self.reports[name]
+        if not report.timed_out:
+            report.timed_out = True
+            LOG.warning("Synchronization of the backend '%s' timed out "
+                        "after %.1fs" % (name, self.backend_timeout))
+
+    def _available(self, name):
+        """Return whether operations can still be started on a backend."""
+        report = self.reports[name]
+        if (not report.timed_out and name in self._deadlines and
+                time.monotonic() >= self._deadlines[name]):
+            self._time_out(name)
+        return not report.timed_out
+
+    def _active(self):
+        """Return the deadlines of the backends running operations."""
+        return [deadline for name, deadline in self._deadlines.items()
+                if self.reports[name].finished_at is None and
+                not self.reports[name].timed_out]
+
+    def _wait_time(self):
+        """Return the time until the next deadline, None if there is none."""
+        deadlines = self._active()
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def _expire(self, in_flight):
+        """Mark the backends out of time as timed out.
+
+        Only the backends running operations are considered, a backend
+        done with the current stage is only timed out if it is given new
+        operations after its deadline.
+        """
+        now = time.monotonic()
+        for name, deadline in self._deadlines.items():
+            report = self.reports[name]
+            if (report.timed_out or report.finished_at is not None or
+                    now < deadline):
+                continue
+            self._time_out(name)
+            if not in_flight[name]:
+                report.finished_at = now
+
+    def _account(self, name, appliance, result):
+        """Record the result of an operation in the report of a backend."""
+        report = self.reports[name]
+        report.results.append((appliance, result))
+        if result is None:
+            report.deferred.append(appliance)
+        elif result:
+            report.succeeded += 1
+        else:
+            report.failed += 1
+
+    def _execute(self, tasks, func):
+        """Run tasks honouring the concurrency limits and the timeouts.
+
+        :param tasks: the tasks to run, in order of priority
+        :type tasks: list
+        :param func: callable running a task, called as
+                     ``func(appliance, names)`` and returning the result
+                     of each backend, indexed by name
+        :type func: callable
+        """
+        pending = list(tasks)
+        for task in pending:
+            for name in task.names:
+                self.reports[name].total += 1
+        in_flight = collections.Counter()
+        running = {}
+
+        executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def submit():
+            # Dispatch the pending tasks in order, skipping the ones whose
+            # backends have reached their limit so that they do not block
+            # the tasks of the other backends.
+            remaining = []
+            for task in pending:
+                names = []
+                for name in task.names:
+                    if self._available(name):
+                        names.append(name)
+                    else:
+                        self.reports[name].skipped += 1
+                task.names = names
+                if not task.names:
+                    continue
+                used = sum(in_flight.values())
+                if (len(running) >= self.max_workers or
+                        (used and used + len(names) > self.max_workers) or
+                        any(in_flight[name] >= self.backend_workers
+                            for name in names)):
+                    remaining.append(task)
+                    continue
+                for name in names:
+                    self._start(name)
+                    in_flight[name] += 1
+                future = executor.submit(self._run_task, func, task)
+                running[future] = task
+            pending[:] = remaining
+
+        def waiting():
+            # Futures worth waiting for: the ones of backends not timed out,
+            # or any of them while pending tasks wait for a free worker.
+            if pending:
+                return list(running)
+            return [future for future, task in running.items()
+                    if not all(self.reports[name].timed_out
+                               for name in task.names)]
+
+        try:
+            submit()
+            while waiting():
+                done, _ = futures.wait(
+                    running, timeout=self._wait_time(),
+                    return_when=futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    task = running.pop(future)
+                    results = future.result()
+                    for name in task.names:
+                        in_flight[name] -= 1
+                        self._account(name, task.appliance,
+                                      results.get(name, False))
+                        if not in_flight[name] and not any(
+                                name in t.names for t in pending):
+                            self.reports[name].finished_at = time.monotonic()
+                self._expire(in_flight)
+                submit()
+        finally:
+            # Operations of timed out backends cannot be interrupted, they
+            # are left running in the background.
+            executor.shutdown(wait=not running)
+
+        for name, count in in_flight.items():
+            if count:
+                self.reports[name].finished_at = time.monotonic()
+                LOG.warning("%d operation(s) still running on the backend "
+                            "'%s'" % (count, name))
+
+    def run(self, appliances):
+        """Synchronize the appliances over all the backends.
+
+        :param appliances: the appliances to synchronize
+        :type appliances: list
+        :return: the report of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        appliances = list(appliances)
+        return self.run_plan(dict(
+            (name, appliances) for name in self.reports
+        ))
+
+    def run_plan(self, plan, sync_func=None):
+        """Run a list of operations specific to each backend.
+
+        :param plan: the items to process, indexed by backend name
+        :type plan: dict
+        :param sync_func: callable processing an item on a backend, called
+                          as ``sync_func(backend, item)``, by default the
+                          function of the scheduler
+        :type sync_func: callable
+        :return: the report of each backend, indexed by backend name
+        :rtype: collections.OrderedDict
+        """
+        sync_func = sync_func or self.sync_func
+
+        def sync(item, names):
+            name = names[0]
+            return {name: sync_func(self.backends[name], item)}
+
+        # Interleave the items of the backends so that they all start
+        # being processed at once.
+        tasks = []
+        lists = [(name, list(plan.get(name, ()))) for name in self.reports]
+        for index in range(max([len(items) for _, items in lists] or [0])):
+            for name, items in lists:
+                if index < len(items):
+                    tasks.append(_Task(items[index], [name]))
+        self._execute(tasks, sync)
+        return self.reports
+
+    def run_group(self, appliance, names, group_func):
+        """Run an operation involving several backends in the calling thread.
+
+        The operation is only started when all its backends can take it,
+        so that the backends of a group progress together. Several threads
+        can run operations at once, for example the workers of a pipeline
+        stage, and share the concurrency limits and the timeouts of the
+        backends.
+
+        :param appliance: the appliance
+        :type appliance: image.appliance.Appliance
+        :param names: the names of the backends
+        :type names: list
+        :param group_func: callable called as ``group_func(appliance,
+                           backends)`` with the backends indexed by name,
+                           and returning the result of each backend,
+                           indexed by name
+        :type group_func: callable
+        :return: the result of each backend, indexed by name
+        :rtype: dict
+        """
+        task = _Task(appliance, names)
+        with self._slots:
+            for name in task.names:
+                self.reports[name].total += 1
+            while True:
+                self._expire(self._in_flight)
+                names = []
+                for name in task.names:
+                    if self._available(name):
+                        names.append(name)
+                    else:
+                        self.reports[name].skipped += 1
+                task.names = names
+                if not task.names:
+                    return {}
+                used = sum(self._in_flight.values())
+                if not ((used and used + len(names) > self.max_workers) or
+                        any(self._in_flight[name] >= self.backend_workers
+                            for name in names)):
+                    break
+                self._slots.wait(self._wait_time())
+            for name in task.names:
+                self._start(name)
+                self._in_flight[name] += 1
+
+        results = self._run_task(
+            lambda appliance, names: group_func(appliance, dict(
+                (name, self.backends[name]) for name in names
+            )), task
+        )
+
+        with self._slots:
+            for name in task.names:
+                self._in_flight[name] -= 1
+                self._account(name, appliance, results.get(name, False))
+                if not self._in_flight[name]:
+                    self.reports[name].finished_at = time.monotonic()
+            self._slots.notify_all()
+        return results
+
+    def fail_group(self, appliance, names):
+        """Record that an operation failed before reaching the backends.
+
+        :param appliance: the appliance
+        :type appliance: image.appliance.Appliance
+        :param names: the names of the backends
+        :type names: list
+        """
+        with self._slots:
+            for name in names:
+                self.reports[name].total += 1
+                self._account(name, appliance, False)
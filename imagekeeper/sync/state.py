@@ -0,0 +1,200 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Local database recording the appliances synchronized on each backend."""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+CONF = cfg.CONF
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appliances (
+    backend TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    version TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    image_id TEXT,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (backend, identifier, version, checksum)
+)
+"""
+
+ApplianceState = collections.namedtuple(
+    'ApplianceState',
+    ['backend', 'identifier', 'version', 'checksum', 'image_id', 'status',
+     'updated_at']
+)
+
+
+class SyncState(object):
+    """SQLite database of the appliances synchronized on each backend.
+
+    The database is opened in WAL mode so that it can be read while a
+    synchronization is recording its results. A single connection is
+    shared by the threads of the synchronization.
+    """
+
+    def __init__(self, path=None):
+        """Initialize the class.
+
+        :param path: the path of the database, by default ``state.db`` in
+                     the store directory
+        :type path: str
+        """
+        if path is None:
+            path = os.path.join(CONF.store_dir, 'state.db')
+        self.path = path
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(SCHEMA)
+
+    @staticmethod
+    def _key(backend, appliance):
+        """Return the primary key of an appliance on a backend."""
+        return (backend, appliance['identifier'], appliance['version'] or '',
+                appliance['checksum'] or '')
+
+    def get(self, backend, appliance):
+        """Return the state of an appliance on a backend.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :return: the state of the appliance, None if it is not known
+        :rtype: ApplianceState
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM appliances WHERE backend = ? AND '
+                'identifier = ? AND version = ? AND checksum = ?',
+                self._key(backend, appliance)
+            ).fetchone()
+        if row is None:
+            return None
+        return ApplianceState(*row)
+
+    def is_synced(self, backend, appliance, max_age=None):
+        """Return whether an appliance is known to be on a backend.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :param max_age: the time in seconds after which the state must be
+                        verified again on the backend, 0 for never
+        :type max_age: int
+        :return: True if this version of the appliance is enabled
+        :rtype: bool
+        """
+        if max_age is None:
+            max_age = CONF.state_max_age
+        state = self.get(backend, appliance)
+        if state is None or state.status != 'ENABLED':
+            return False
+        return not max_age or time.time() - state.updated_at < max_age
+
+    def record(self, backend, appliance, image_id, status='ENABLED'):
+        """Record the state of an appliance on a backend.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param appliance: the appliance
+        :type appliance: appliance.Appliance
+        :param image_id: the id of the image on the backend
+        :type image_id: str
+        :param status: the status of the image
+        :type status: str
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO appliances VALUES (?, ?, ?, ?, ?, ?, '
+                '?)', self._key(backend, appliance) + (image_id, status,
+                                                       time.time())
+            )
+
+    def set_status(self, backend, identifier, status):
+        """Set the status of all the versions of an appliance.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param identifier: the identifier of the appliance
+        :type identifier: str
+        :param status: the status of the images
+        :type status: str
+        """
+        with self._lock:
+            self._conn.execute(
+                'UPDATE appliances SET status = ?, updated_at = ? '
+                'WHERE backend = ? AND identifier = ?',
+                (status, time.time(), backend, identifier)
+            )
+
+    def forget(self, backend, identifier=None, status=None):
+        """Remove the records of an appliance or of a whole backend.
+
+        :param backend: the name of the backend
+        :type backend: str
+        :param identifier: the identifier of the appliance, all the
+                           appliances of the backend if not set
+        :type identifier: str
+        :param status: only remove the records with this status
+        :type status: str
+        """
+        query = 'DELETE FROM appliances WHERE backend = ?'
+        args = (backend,)
+        if identifier is not None:
+            query += ' AND identifier = ?'
+            args += (identifier,)
+        if status is not None:
+            query += ' AND status = ?'
+            args += (status,)
+        with self._lock:
+            self._conn.execute(query, args)
+
+    def records(self, backend=None):
+        """Return the recorded states.
+
+        :param backend: the name of the backend, all if not set
+        :type backend: str
+        :return: the states
+        :rtype: list of ApplianceState
+        """
+        with self._lock:
+            if backend is None:
+                rows = self._conn.execute('SELECT * FROM appliances')
+            else:
+                rows = self._conn.execute(
+                    'SELECT * FROM appliances WHERE backend = ?', (backend,)
+                )
+            return [ApplianceState(*row) for row in rows.fetchall()]
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,77 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Default backend test class."""
+
+from imagekeeper.backend import base as backend_base
+from imagekeeper.tests import base
+
+
+class MinimalBackend(backend_base.Backend):
+    """A backend implementing the original abstract methods only."""
+
+    def __init__(self):
+        """Initialize the class."""
+        self.deprecated = []
+        self.deleted = 0
+
+    def connect(self):
+        """Connect to the backend."""
+
+    def get_appliance_list(self, **kwargs):
+        """Retrieve the appliance list from the backend."""
+        return []
+
+    def add_appliance(self, **kwargs):
+        """Add an appliance."""
+        return False
+
+    def deprecate_appliance(self, appliance_id):
+        """Set an appliance as deprecated, failing on 'b'."""
+        if appliance_id == 'b':
+            raise IOError(appliance_id)
+        self.deprecated.append(appliance_id)
+        return True
+
+    def delete_appliance(self, **kwargs):
+        """Delete the deprecated appliances."""
+        self.deleted += 1
+        return True
+
+    def update_appliance(self, **kwargs):
+        """Update an appliance."""
+        return False
+
+
+class TestBackend(base.TestCase):
+    """Test the default backend."""
+
+    def test_deprecate_many(self):
+        """Test that the appliances are deprecated one by one."""
+        backend = MinimalBackend()
+        results = backend.deprecate_many(['a', 'b', 'c'])
+        self.assertEqual(['a', 'c'], backend.deprecated)
+        self.assertEqual([('a', True), ('b', False), ('c', True)],
+                         [(result.identifier, result.succeeded)
+                          for result in results])
+        self.assertIsInstance(results[1].error, IOError)
+
+    def test_delete_appliances_bulk(self):
+        """Test that the deprecated images are deleted at once."""
+        backend = MinimalBackend()
+        results = backend.delete_appliances_bulk(['x', 'y'])
+        self.assertEqual(1, backend.deleted)
+        self.assertEqual([('x', True), ('y', True)],
+                         [(result.image_id, result.succeeded)
+                          for result in results])
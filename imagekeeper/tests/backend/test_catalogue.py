@@ -0,0 +1,73 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image catalogue test class."""
+
+from imagekeeper.backend import catalogue
+from imagekeeper.tests import base
+
+
+def fake_image(image_id, name, status='ENABLED', **properties):
+    """Return a fake Glance image."""
+    image = {'id': image_id, 'name': name, 'IK_STATUS': status,
+             'tags': []}
+    image.update(properties)
+    return image
+
+
+class TestImageCatalogue(base.TestCase):
+    """Test the image catalogue."""
+
+    def setUp(self):
+        """Create a catalogue with a few images."""
+        super(TestImageCatalogue, self).setUp()
+        self.catalogue = catalogue.ImageCatalogue([
+            fake_image('1', 'centos', IK_ID='a'),
+            fake_image('2', 'centos', 'DISABLED', IK_ID='a'),
+            fake_image('3', 'ubuntu', IK_ID='b', tags=['gpu']),
+        ])
+
+    def test_get(self):
+        """Test the lookup by id."""
+        self.assertEqual('ubuntu', self.catalogue.get('3')['name'])
+        self.assertIsNone(self.catalogue.get('4'))
+        self.assertEqual(3, len(self.catalogue))
+
+    def test_find(self):
+        """Test the lookup by name, property and tag."""
+        self.assertEqual(2, len(self.catalogue.find(name='centos')))
+        self.assertEqual(
+            ['1'], [i['id'] for i in self.catalogue.find(IK_ID='a',
+                                                         IK_STATUS='ENABLED')]
+        )
+        self.assertEqual(
+            ['3'], [i['id'] for i in self.catalogue.find(tags='gpu')]
+        )
+        self.assertEqual([], self.catalogue.find(IK_ID='c'))
+        self.assertEqual(3, len(self.catalogue.find()))
+
+    def test_update(self):
+        """Test that replacing an image updates the indexes."""
+        self.catalogue.add(fake_image('1', 'centos', 'DISABLED', IK_ID='a'))
+        self.assertEqual([], self.catalogue.find(IK_ID='a',
+                                                 IK_STATUS='ENABLED'))
+        self.assertEqual(2, len(self.catalogue.find(IK_STATUS='DISABLED')))
+
+    def test_remove(self):
+        """Test that a removed image cannot be found anymore."""
+        self.assertEqual('3', self.catalogue.remove('3')['id'])
+        self.assertIsNone(self.catalogue.remove('3'))
+        self.assertEqual([], self.catalogue.find(name='ubuntu'))
+        self.assertEqual([], self.catalogue.find(tags='gpu'))
+        self.assertNotIn('3', self.catalogue)
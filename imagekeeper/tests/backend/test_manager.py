@@ -14,10 +14,24 @@
 
 """Backend Manager test class."""
 
+import json
+import os
+
+import fixtures
+
+from imagekeeper.backend.connectors import openstack
 from imagekeeper.backend import manager
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
 from imagekeeper.tests import base
 
 
+def fake_backend(name, **parameters):
+    """Return the entry of an OpenStack backend in the backend file."""
+    parameters.setdefault('auth_url', 'http://%s:5000/v3' % name)
+    return {'name': name, 'type': 'openstack', 'parameters': parameters}
+
+
 class TestBackendManager(base.TestCase):
     """Test OpenStack backend."""
 
@@ -30,3 +44,81 @@ class TestBackendManager(base.TestCase):
         """Test the conver_ram function."""
         backend_manager = manager.BackendManager()
         self.assertEqual(1, len(backend_manager.get_backends()))
+
+
+class TestBackendFile(base.TestCase):
+    """Test the compiled backend file and the lazy connectors."""
+
+    def setUp(self):
+        """Create a backend file."""
+        super(TestBackendFile, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tempdir, 'backends.json')
+        self.revision = 0
+        self.write([fake_backend('a'), fake_backend('b')])
+
+    def write(self, backends):
+        """Write the backend file."""
+        with open(self.path, 'w') as backend_file:
+            json.dump(backends, backend_file)
+        # Make sure that the modification is detected
+        self.revision += 1
+        os.utime(self.path, (self.revision, self.revision))
+
+    def test_compile_cache(self):
+        """Test that an unchanged file is not compiled again."""
+        compiled = manager.compile_backend_file(self.path)
+        self.assertEqual(['a', 'b'], list(compiled.backends))
+        self.assertIs(compiled, manager.compile_backend_file(self.path))
+        # Touched but not modified
+        os.utime(self.path, (100, 100))
+        self.assertIs(compiled, manager.compile_backend_file(self.path))
+        self.write([fake_backend('a')])
+        self.assertEqual(1, len(manager.compile_backend_file(self.path)))
+
+    def test_validation(self):
+        """Test that an invalid backend file is rejected."""
+        for backends in ([fake_backend('a'), fake_backend('a')],
+                         [{'name': 'a', 'type': 'openstack'}],
+                         {'name': 'a'}):
+            self.write(backends)
+            self.assertRaises(exception.InvalidBackendFile,
+                              manager.compile_backend_file, self.path)
+        self.assertRaises(exception.BackendFileNotFound,
+                          manager.compile_backend_file, self.path + '.x')
+
+    def test_lazy_connectors(self):
+        """Test that the connectors are created when first used."""
+        backends = manager.BackendManager(self.path)
+        self.assertEqual(2, len(backends))
+        self.assertEqual({}, backends.backends)
+        backend = backends.get_backend('a')
+        self.assertIsInstance(backend, openstack.OpenStackBackend)
+        self.assertEqual('a', backend.cloud_id)
+        self.assertEqual(['a'], list(backends.backends))
+        self.assertIs(backend, backends.get_backends()['a'])
+        self.assertRaises(exception.BackendNotFound,
+                          backends.get_backend, 'c')
+
+    def test_unknown_type(self):
+        """Test that a backend of an unknown type cannot be created."""
+        self.write([{'name': 'a', 'type': 'unknown', 'parameters': {}}])
+        backends = manager.BackendManager(self.path)
+        self.assertRaises(exception.BackendNotFound,
+                          backends.get_backend, 'a')
+
+    def test_refresh(self):
+        """Test that only the modified backends are created again."""
+        self.write([fake_backend('a'), fake_backend('b'), fake_backend('c')])
+        backends = manager.BackendManager(self.path)
+        previous = backends.get_backends()
+        self.assertEqual(([], [], []), backends.refresh())
+
+        self.write([fake_backend('a'), fake_backend('b', rate_limit=5),
+                    fake_backend('d')])
+        self.assertEqual((['d'], ['b'], ['c']), backends.refresh())
+        current = backends.get_backends()
+        self.assertEqual(['a', 'b', 'd'], list(current))
+        self.assertIs(previous['a'], current['a'])
+        self.assertIsNot(previous['b'], current['b'])
+        self.assertEqual(5, current['b'].limiter.bucket.rate)
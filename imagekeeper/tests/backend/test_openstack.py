@@ -0,0 +1,355 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""OpenStack backend test class."""
+
+import hashlib
+import os
+
+import fixtures
+import mock
+from oslo_config import fixture as config_fixture
+import requests
+
+from imagekeeper.backend.connectors import openstack
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
+from imagekeeper.sync import journal
+from imagekeeper.tests import base
+
+
+class TestOpenStackBackend(base.TestCase):
+    """Test OpenStack backend."""
+
+    def setUp(self):
+        """Create a backend with a fake authentication plugin."""
+        super(TestOpenStackBackend, self).setUp()
+        self.conf = self.useFixture(config_fixture.Config())
+        self.backend = openstack.OpenStackBackend('cloud', {
+            'auth_type': 'v3password',
+        })
+        self.backend._auth_options = mock.Mock(return_value={})
+        patcher = mock.patch.object(openstack.loading, 'get_plugin_loader')
+        self.get_plugin_loader = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_session_is_shared(self, glance_client):
+        """Test that a single session and client are created."""
+        self.assertIs(self.backend.glance, self.backend.glance)
+        self.assertIs(self.backend.connect(), self.backend.connect())
+        self.assertEqual(1, self.get_plugin_loader.call_count)
+        glance_client.assert_called_once_with(session=self.backend.connect())
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_disconnect(self, glance_client):
+        """Test that a new session is created after a disconnection."""
+        first_session = self.backend.connect()
+        self.backend.disconnect()
+        self.assertIsNot(first_session, self.backend.connect())
+        self.assertEqual(2, self.get_plugin_loader.call_count)
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_catalogue_listed_once(self, glance_client):
+        """Test that the images are listed once for several lookups."""
+        glance = glance_client.return_value
+        glance.images.list.return_value = [
+            {'id': '1', 'name': 'a', 'IK_ID': 'a', 'IK_STATUS': 'ENABLED'},
+            {'id': '2', 'name': 'b', 'IK_ID': 'b', 'IK_STATUS': 'DISABLED'},
+        ]
+        self.assertEqual(2, len(self.backend.catalogue))
+        self.assertEqual(['1'], self.backend.list_appliance('IK_ID', 'a'))
+        self.assertEqual([], self.backend.list_appliance('IK_ID', 'b'))
+        self.assertTrue(self.backend.delete_appliances())
+        glance.images.delete.assert_called_once_with('2')
+        self.assertNotIn('2', self.backend.catalogue)
+        glance.images.list.assert_called_once_with(filters={},
+                                                   page_size=100, limit=100)
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_filters_sent_to_glance(self, glance_client):
+        """Test that the filters are sent to Glance without catalogue."""
+        glance = glance_client.return_value
+        glance.images.list.return_value = iter([
+            {'id': '1', 'name': 'a', 'IK_ID': 'a', 'IK_STATUS': 'ENABLED'},
+        ])
+        self.assertEqual(['1'], self.backend.list_appliance('IK_ID', 'a'))
+        glance.images.list.assert_called_once_with(
+            filters={'IK_ID': 'a'}, page_size=100, limit=100
+        )
+        glance.images.list.reset_mock()
+        list(self.backend.get_image_list({'tags': 'gpu',
+                                          'visibility': 'public'}))
+        glance.images.list.assert_called_once_with(
+            filters={'tag': ['gpu'], 'visibility': 'public'},
+            page_size=100, limit=100
+        )
+        glance.images.list.reset_mock()
+        self.backend.delete_appliances()
+        glance.images.list.assert_called_once_with(
+            filters={'IK_STATUS': 'DISABLED'}, page_size=100, limit=100
+        )
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_list_without_tag(self, glance_client):
+        """Test that all the images are listed without tag."""
+        glance = glance_client.return_value
+        glance.images.list.return_value = iter([
+            {'id': '1', 'name': 'a', 'IK_ID': 'a', 'IK_STATUS': 'ENABLED'},
+            {'id': '2', 'name': 'b'},
+        ])
+        self.assertEqual(['1', '2'], self.backend.list_appliance())
+        glance.images.list.assert_called_once_with(filters={},
+                                                   page_size=100, limit=100)
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_listing_error(self, glance_client):
+        """Test that an error raised while paging is wrapped."""
+        def pages():
+            yield {'id': '1', 'name': 'a'}
+            raise ValueError("truncated page")
+
+        glance_client.return_value.images.list.return_value = pages()
+        self.assertRaises(exception.UnknownError,
+                          self.backend.get_image_list)
+
+    @mock.patch.object(openstack.glanceclient, 'Client')
+    def test_list_pages(self, glance_client):
+        """Test that the pages are listed lazily, each one being retried."""
+        self.conf.config(image_page_size=2)
+        self.backend.resilience.delay = 0
+        glance = glance_client.return_value
+        glance.images.list.side_effect = [
+            [{'id': '1'}, {'id': '2'}],
+            requests.exceptions.ConnectionError("reset"),
+            [{'id': '3'}],
+        ]
+        images = self.backend._list_images(IK_STATUS='ENABLED')
+        self.assertEqual({'id': '1'}, next(images))
+        self.assertEqual(1, glance.images.list.call_count)
+        self.assertEqual([{'id': '2'}, {'id': '3'}], list(images))
+        glance.images.list.assert_called_with(
+            filters={'IK_STATUS': 'ENABLED', 'marker': '2'},
+            page_size=2, limit=2
+        )
+        self.assertEqual(3, glance.images.list.call_count)
+
+
+class TestOpenStackBackendUpload(base.TestCase):
+    """Test the upload of appliances to an OpenStack backend."""
+
+    def setUp(self):
+        """Create a backend with a fake Glance client."""
+        super(TestOpenStackBackendUpload, self).setUp()
+        self.data = os.urandom(100000)
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.appliance = {
+            'identifier': 'a',
+            'title': 'Appliance A',
+            'format': 'QCOW2',
+            'location': os.path.join(tempdir, 'image.qcow2'),
+            'checksum': hashlib.sha256(self.data).hexdigest(),
+            'min_ram': 0,
+        }
+        with open(self.appliance['location'], 'wb') as image_file:
+            image_file.write(self.data)
+
+        self.backend = openstack.OpenStackBackend('cloud', {})
+        self.journal = journal.Journal(os.path.join(tempdir, 'journal.log'))
+        self.addCleanup(self.journal.close)
+        self.backend.journal = self.journal
+        self.glance = mock.Mock()
+        self.backend._glance = self.glance
+        self.glance.images.create.return_value = {'id': 'x'}
+        self.uploaded = []
+
+        def upload(image_id, image_data, image_size=None):
+            chunk = image_data.read(65536)
+            while chunk:
+                self.uploaded.append(chunk)
+                chunk = image_data.read(65536)
+
+        def update(image_id, **properties):
+            image = {'id': image_id,
+                     'checksum': hashlib.md5(self.data).hexdigest()}
+            image.update(properties)
+            return image
+
+        self.glance.images.upload.side_effect = upload
+        self.glance.images.update.side_effect = update
+
+    def test_add_appliance(self):
+        """Test that a verified image is enabled."""
+        self.assertEqual('x', self.backend.add_appliance(self.appliance))
+        self.assertEqual(self.data, b''.join(self.uploaded))
+        self.glance.images.update.assert_called_with('x',
+                                                     IK_STATUS='ENABLED')
+        properties = self.glance.images.update.call_args_list[0][1]
+        self.assertEqual(hashlib.sha512(self.data).hexdigest(),
+                         properties['IK_HASH_VALUE'])
+        self.glance.images.delete.assert_not_called()
+        self.assertEqual([], self.journal.pending())
+
+    def test_add_appliance_wrong_checksum(self):
+        """Test that an image not matching the appliance is deleted."""
+        self.appliance['checksum'] = hashlib.sha256(b'other').hexdigest()
+        self.assertFalse(self.backend.add_appliance(self.appliance))
+        self.glance.images.delete.assert_called_once_with('x')
+
+    def test_add_appliance_upload_error(self):
+        """Test that an image is deleted if the upload fails."""
+        self.glance.images.upload.side_effect = IOError
+        self.assertFalse(self.backend.add_appliance(self.appliance))
+        self.glance.images.delete.assert_called_once_with('x')
+        self.glance.images.update.assert_not_called()
+
+    def test_add_appliance_interrupted(self):
+        """Test that an interrupted upload is left in the journal."""
+        self.glance.images.upload.side_effect = KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, self.backend.add_appliance,
+                          self.appliance)
+        entries = self.journal.pending('cloud', journal.ADD)
+        self.assertEqual(1, len(entries))
+        self.assertEqual('x', entries[0].data['image_id'])
+
+    def _interrupted_upload(self, status, ik_status='UPLOADING'):
+        """Record an interrupted upload of an image with a given status."""
+        entry_id = self.journal.begin('cloud', journal.ADD, 'a',
+                                      checksum=self.appliance['checksum'])
+        self.journal.step(entry_id, 'created', image_id='old')
+        self.glance.images.get.return_value = {
+            'id': 'old', 'status': status, 'IK_STATUS': ik_status
+        }
+
+    def test_resume_uploaded_image(self):
+        """Test that an image entirely received is not sent again."""
+        self._interrupted_upload('active')
+        self.assertEqual('old', self.backend.add_appliance(self.appliance))
+        self.glance.images.create.assert_not_called()
+        self.glance.images.upload.assert_not_called()
+        self.assertEqual([], self.journal.pending())
+
+    def test_resume_queued_image(self):
+        """Test that an image without data is reused."""
+        self._interrupted_upload('queued')
+        self.assertEqual('old', self.backend.add_appliance(self.appliance))
+        self.glance.images.create.assert_not_called()
+        self.assertEqual(self.data, b''.join(self.uploaded))
+
+    def test_resume_broken_image(self):
+        """Test that an image partially received is replaced."""
+        self._interrupted_upload('saving')
+        self.assertEqual('x', self.backend.add_appliance(self.appliance))
+        self.glance.images.delete.assert_called_once_with('old')
+        self.assertEqual([], self.journal.pending())
+
+    def test_resume_enabled_image(self):
+        """Test that an image whose end was not recorded is kept."""
+        self._interrupted_upload('active', 'ENABLED')
+        self.assertEqual('old', self.backend.add_appliance(self.appliance))
+        self.glance.images.create.assert_not_called()
+        self.glance.images.update.assert_not_called()
+        self.glance.images.delete.assert_not_called()
+        self.assertEqual([], self.journal.pending())
+
+    def test_replay_journal(self):
+        """Test that the image of an appliance not added is deleted."""
+        self._interrupted_upload('queued')
+        self.assertTrue(self.backend.replay_journal(keep=['b']))
+        self.glance.images.delete.assert_called_once_with('old')
+        self.assertEqual([], self.journal.pending())
+
+    def test_replay_journal_keep(self):
+        """Test that the upload of an appliance about to be added is kept."""
+        self._interrupted_upload('queued')
+        self.assertTrue(self.backend.replay_journal(keep=['a']))
+        self.glance.images.delete.assert_not_called()
+        self.assertEqual(1, len(self.journal.pending()))
+
+    def test_replay_journal_deprecate(self):
+        """Test that an interrupted deprecation is completed."""
+        entry_id = self.journal.begin('cloud', journal.DEPRECATE, 'a',
+                                      image_ids=['y', 'z'])
+        self.journal.step(entry_id, 'disabled', image_id='y')
+        self.glance.images.get.side_effect = lambda image_id: {
+            'id': image_id,
+            'IK_STATUS': 'DISABLED' if image_id == 'y' else 'ENABLED'
+        }
+        self.assertTrue(self.backend.replay_journal())
+        self.glance.images.update.assert_called_once_with(
+            'z', visibility='private', IK_STATUS='DISABLED'
+        )
+        self.assertEqual([], self.journal.pending())
+
+
+class TestOpenStackBackendBulk(base.TestCase):
+    """Test the bulk operations of an OpenStack backend."""
+
+    def setUp(self):
+        """Create a backend with a fake Glance client."""
+        super(TestOpenStackBackendBulk, self).setUp()
+        self.backend = openstack.OpenStackBackend('cloud', {})
+        self.glance = mock.Mock()
+        self.backend._glance = self.glance
+        self.glance.images.list.return_value = [
+            {'id': 'x', 'IK_ID': 'a', 'IK_STATUS': 'ENABLED'},
+            {'id': 'y', 'IK_ID': 'b', 'IK_STATUS': 'ENABLED'},
+            {'id': 'z', 'IK_ID': 'c', 'IK_STATUS': 'ENABLED'},
+        ]
+
+        def fail_on_y(image_id, **properties):
+            if image_id == 'y':
+                raise IOError('unavailable')
+            return dict(properties, id=image_id)
+
+        self.glance.images.update.side_effect = fail_on_y
+        self.glance.images.delete.side_effect = fail_on_y
+
+    def test_deprecate_many(self):
+        """Test that the images of several appliances are deprecated."""
+        results = self.backend.deprecate_many(['a', 'b'])
+        self.glance.images.list.assert_called_once()
+        self.assertEqual([('x', 'a', True), ('y', 'b', False)],
+                         [(r.image_id, r.identifier, r.succeeded)
+                          for r in results])
+        self.assertIsInstance(results[1].error, IOError)
+        self.assertEqual(2, self.glance.images.update.call_count)
+
+    def test_delete_appliances_bulk(self):
+        """Test that a failure does not stop the other deletions."""
+        results = self.backend.delete_appliances_bulk(['x', 'y', 'z'])
+        self.assertEqual([True, False, True],
+                         [result.succeeded for result in results])
+        self.assertTrue(all(result.elapsed >= 0 for result in results))
+        self.assertEqual(3, self.glance.images.delete.call_count)
+
+    def test_bulk_journal(self):
+        """Test that a batch is written to the journal disk once."""
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.backend.journal = journal.Journal(
+            os.path.join(tempdir, 'journal.log')
+        )
+        self.addCleanup(self.backend.journal.close)
+        with mock.patch.object(journal.os, 'fsync') as fsync:
+            self.backend.delete_appliances_bulk(['x', 'y', 'z'])
+            self.backend.deprecate_many(['a', 'b', 'c'])
+        self.assertEqual(2, fsync.call_count)
+        self.assertEqual([], self.backend.journal.pending())
+
+    def test_delete_appliances(self):
+        """Test that the disabled images are listed and deleted."""
+        self.assertFalse(self.backend.delete_appliances())
+        self.glance.images.list.assert_called_once_with(
+            filters={'IK_STATUS': 'DISABLED'}, page_size=100, limit=100
+        )
@@ -0,0 +1,164 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Asynchronous OpenStack backend test class."""
+
+import asyncio
+import hashlib
+import os
+import threading
+
+import fixtures
+from oslo_config import fixture as config_fixture
+import testtools
+
+from imagekeeper.backend import asyncbase
+from imagekeeper.backend.connectors import openstack_async
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.tests import base
+from imagekeeper.tests import fake_cloud
+
+
+@testtools.skipIf(asyncbase.aiohttp is None, 'aiohttp is not installed')
+class TestAsyncOpenStackBackend(base.TestCase):
+    """Test the asynchronous OpenStack backend against a fake cloud."""
+
+    def setUp(self):
+        """Start a fake cloud."""
+        super(TestAsyncOpenStackBackend, self).setUp()
+        self.conf = self.useFixture(config_fixture.Config())
+        self.conf.config(image_page_size=2)
+        self.cloud = fake_cloud.FakeCloud()
+        self.addCleanup(self.cloud.stop)
+
+    def run_backend(self, func):
+        """Run a coroutine function with a connected backend."""
+        async def run():
+            async with openstack_async.AsyncOpenStackBackend(
+                    'cloud', self.cloud.config) as backend:
+                return await func(backend)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return loop.run_until_complete(run())
+
+    def test_get_image_list(self):
+        """Test that the images are filtered and paginated."""
+        for index in range(5):
+            self.cloud.add_image(IK_ID=str(index), IK_STATUS='ENABLED')
+        self.cloud.add_image(IK_ID='x', IK_STATUS='DISABLED')
+        images = self.run_backend(
+            lambda backend: backend.get_image_list({'IK_STATUS': 'ENABLED'})
+        )
+        self.assertEqual(['0', '1', '2', '3', '4'],
+                         sorted(image['IK_ID'] for image in images))
+        self.assertEqual(3, self.cloud.pages)
+        self.assertEqual(1, self.cloud.tokens)
+
+    def test_expired_token(self):
+        """Test that a rejected token is renewed."""
+        async def run(backend):
+            await backend.get_image_list()
+            # Revoke the token of the backend
+            self.cloud.tokens += 1
+            return await backend.get_image_list()
+        self.assertEqual([], self.run_backend(run))
+        self.assertEqual(3, self.cloud.tokens)
+
+    def test_concurrent_token(self):
+        """Test that a token is renewed once, out of the event loop."""
+        threads = []
+
+        async def run(backend):
+            keystone = backend._keystone.connect()
+            get_token = keystone.get_token
+
+            def record_token():
+                threads.append(threading.current_thread())
+                return get_token()
+
+            keystone.get_token = record_token
+            keystone.invalidate()
+            await asyncio.gather(backend.get_image_list(),
+                                 backend.get_image_list())
+        self.run_backend(run)
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.current_thread(), threads[0])
+        self.assertEqual(2, self.cloud.tokens)
+
+    def test_add_appliance(self):
+        """Test that an appliance is uploaded and enabled."""
+        data = os.urandom(100000)
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        appliance = {
+            'identifier': 'a', 'version': '1', 'title': 'Appliance A',
+            'format': 'QCOW2', 'location': os.path.join(tempdir, 'a'),
+            'checksum': hashlib.sha256(data).hexdigest(), 'min_ram': 512,
+        }
+        with open(appliance['location'], 'wb') as image_file:
+            image_file.write(data)
+        image_id = self.run_backend(
+            lambda backend: backend.add_appliance(appliance)
+        )
+        image = self.cloud.images[image_id]
+        self.assertEqual(data, self.cloud.data[image_id])
+        self.assertEqual('ENABLED', image['IK_STATUS'])
+        self.assertEqual('1', image['IK_VERSION'])
+        self.assertEqual(512, image['min_ram'])
+        self.assertEqual(hashlib.sha512(data).hexdigest(),
+                         image['IK_HASH_VALUE'])
+
+    def test_add_appliance_wrong_checksum(self):
+        """Test that an image not matching the appliance is deleted."""
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        appliance = {
+            'identifier': 'a', 'title': 'Appliance A', 'format': 'QCOW2',
+            'location': os.path.join(tempdir, 'a'), 'min_ram': 0,
+            'checksum': hashlib.sha256(b'other').hexdigest(),
+        }
+        with open(appliance['location'], 'wb') as image_file:
+            image_file.write(b'data')
+        self.assertFalse(self.run_backend(
+            lambda backend: backend.add_appliance(appliance)
+        ))
+        self.assertEqual({}, self.cloud.images)
+
+    def test_deprecate_and_delete(self):
+        """Test the bulk deprecation and deletion of images."""
+        for index in range(6):
+            self.cloud.add_image(IK_ID=str(index % 3), IK_STATUS='ENABLED',
+                                 visibility='public')
+
+        results = self.run_backend(
+            lambda backend: backend.deprecate_many(['0', '1'])
+        )
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(result.succeeded for result in results))
+        disabled = [image for image in self.cloud.images.values()
+                    if image['IK_STATUS'] == 'DISABLED']
+        self.assertEqual(4, len(disabled))
+        self.assertTrue(all(image['visibility'] == 'private'
+                            for image in disabled))
+
+        results = self.run_backend(
+            lambda backend: backend.delete_appliances_bulk()
+        )
+        self.assertEqual(4, len(results))
+        self.assertEqual(['2', '2'], [image['IK_ID'] for image in
+                                      self.cloud.images.values()])
+
+    def test_deprecate_unknown_appliance(self):
+        """Test that an appliance without image cannot be deprecated."""
+        self.assertFalse(self.run_backend(
+            lambda backend: backend.deprecate_appliance('unknown')
+        ))
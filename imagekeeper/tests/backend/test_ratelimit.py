@@ -0,0 +1,156 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Rate limiter test class."""
+
+import threading
+import time
+
+from glanceclient import exc as glance_exc
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.backend.connectors import openstack
+from imagekeeper.backend import ratelimit
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
+from imagekeeper.tests import base
+from imagekeeper.tests import fake_cloud
+
+
+class TestTokenBucket(base.TestCase):
+    """Test the token bucket."""
+
+    def test_rate(self):
+        """Test that the tokens are handed out at the given rate."""
+        bucket = ratelimit.TokenBucket(100, burst=2)
+        start = time.monotonic()
+        for _ in range(7):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+    def test_no_limit(self):
+        """Test that a zero rate does not limit."""
+        bucket = ratelimit.TokenBucket(0)
+        for _ in range(1000):
+            self.assertEqual(0.0, bucket.acquire())
+
+    def test_hold(self):
+        """Test that no token is handed out during a hold."""
+        bucket = ratelimit.TokenBucket(1000, burst=10)
+        bucket.hold(0.05)
+        self.assertGreaterEqual(bucket.acquire(), 0.04)
+
+    def test_hold_without_rate(self):
+        """Test that a hold applies to a bucket without rate."""
+        bucket = ratelimit.TokenBucket(0)
+        bucket.hold(0.05)
+        self.assertGreaterEqual(bucket.acquire(), 0.04)
+        self.assertEqual(0.0, bucket.acquire())
+
+
+class TestAdaptiveLimit(base.TestCase):
+    """Test the AIMD concurrency limit."""
+
+    def test_decrease(self):
+        """Test that the limit is halved once per round trip."""
+        limit = ratelimit.AdaptiveLimit(1, 8)
+        for _ in range(3):
+            limit.acquire()
+        limit.release(0.5, overloaded=True)
+        limit.release(0.5, overloaded=True)
+        self.assertEqual(4, limit.limit)
+        limit.release(0.5)
+        self.assertEqual(4.25, limit.limit)
+
+    def test_latency(self):
+        """Test that slow requests decrease the limit."""
+        limit = ratelimit.AdaptiveLimit(2, 8, latency_target=1.0)
+        limit.acquire()
+        limit.release(1.5)
+        self.assertEqual(4, limit.limit)
+        limit._cooldown_until = 0
+        limit.acquire()
+        limit.release(20)
+        limit._cooldown_until = 0
+        limit.acquire()
+        limit.release(20)
+        self.assertEqual(2, limit.limit)
+
+    def test_increase(self):
+        """Test that the limit grows by about one per round trip."""
+        limit = ratelimit.AdaptiveLimit(1, 8, initial=2)
+        for _ in range(2):
+            limit.acquire()
+        for _ in range(2):
+            limit.release(0.1)
+        self.assertGreaterEqual(limit.limit, 2.9)
+        self.assertLess(limit.limit, 3.1)
+
+    def test_concurrency(self):
+        """Test that the number of concurrent requests is bounded."""
+        limit = ratelimit.AdaptiveLimit(1, 2)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def request():
+            limit.acquire()
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+            limit.release(0.01)
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, max(peak))
+
+
+class TestRateLimiter(base.TestCase):
+    """Test the rate limiter of the backends."""
+
+    def test_from_config(self):
+        """Test that the limiter is configured from the parameters."""
+        limiter = ratelimit.RateLimiter.from_config('a', {
+            'rate_limit': 5, 'max_concurrency': '16', 'latency_target': 2
+        })
+        self.assertEqual(5, limiter.bucket.rate)
+        self.assertEqual(16, limiter.limit)
+        self.assertEqual(2, limiter.concurrency.latency_target)
+        self.assertRaises(exception.InvalidBackendOption,
+                          ratelimit.RateLimiter.from_config, 'a',
+                          {'rate_limit': 'fast'})
+        self.assertRaises(exception.InvalidBackendOption,
+                          ratelimit.RateLimiter.from_config, 'a',
+                          {'min_concurrency': 4, 'max_concurrency': 2})
+
+    def test_overloaded_backend(self):
+        """Test that a backend answering 429 gets fewer requests."""
+        self.useFixture(config_fixture.Config())
+        cloud = fake_cloud.FakeCloud()
+        self.addCleanup(cloud.stop)
+        backend = openstack.OpenStackBackend(
+            'fake', dict(cloud.config, max_concurrency=8, rate_limit=100)
+        )
+        cloud.overloaded = 1
+        self.assertRaises(glance_exc.HTTPException,
+                          lambda: list(backend.glance.images.list()))
+        self.assertEqual(4, backend.limiter.limit)
+        self.assertEqual(0, backend.limiter.concurrency.in_flight)
+        self.assertEqual([], list(backend.glance.images.list()))
@@ -0,0 +1,161 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Resilience layer test class."""
+
+import time
+
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.backend.connectors import openstack
+from imagekeeper.backend import resilience
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
+from imagekeeper.tests import base
+from imagekeeper.tests import fake_cloud
+
+
+class TransientError(Exception):
+    """An error worth retrying."""
+
+
+class FakeConnector(object):
+    """A connector failing a given number of times."""
+
+    def __init__(self, failures, error=TransientError, **options):
+        """Initialize the class."""
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self.resilience = resilience.Resilience(
+            'fake', lambda err: isinstance(err, TransientError),
+            delay=0, **options
+        )
+
+    def _call(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error()
+        return self.calls
+
+    @resilience.idempotent
+    def read(self):
+        """Read from the backend."""
+        return self._call()
+
+    @resilience.guarded
+    def write(self):
+        """Write to the backend."""
+        return self._call()
+
+
+class TestResilience(base.TestCase):
+    """Test the retries, circuit breaker and time budget."""
+
+    def setUp(self):
+        """Set up the test."""
+        super(TestResilience, self).setUp()
+        self.useFixture(config_fixture.Config())
+
+    def test_retry(self):
+        """Test that the idempotent calls are retried."""
+        connector = FakeConnector(2)
+        self.assertEqual(3, connector.read())
+        connector = FakeConnector(3)
+        self.assertRaises(TransientError, connector.read)
+        self.assertEqual(3, connector.calls)
+
+    def test_no_retry(self):
+        """Test that guarded calls and other errors are not retried."""
+        connector = FakeConnector(1)
+        self.assertRaises(TransientError, connector.write)
+        self.assertEqual(1, connector.calls)
+        connector = FakeConnector(1, ValueError)
+        self.assertRaises(ValueError, connector.read)
+        self.assertEqual(1, connector.calls)
+        self.assertEqual(0, connector.resilience.breaker.failures)
+
+    def test_direct_call(self):
+        """Test that the methods are called directly without the layer."""
+        connector = FakeConnector(1)
+        connector.resilience = None
+        self.assertRaises(TransientError, connector.read)
+
+    def test_backoff(self):
+        """Test that the delays grow exponentially up to a maximum."""
+        layer = resilience.Resilience('fake', delay=1, max_delay=5)
+        for attempt, bound in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+            for _ in range(20):
+                self.assertLessEqual(layer.backoff(attempt), bound)
+
+    def test_circuit_breaker(self):
+        """Test that the circuit opens, then lets a probe through."""
+        connector = FakeConnector(3, threshold=2, reset_timeout=0.05,
+                                  attempts=2)
+        self.assertRaises(TransientError, connector.read)
+        breaker = connector.resilience.breaker
+        self.assertEqual(breaker.OPEN, breaker.state)
+        self.assertRaises(exception.BackendUnavailable, connector.read)
+        self.assertEqual(2, connector.calls)
+        time.sleep(0.06)
+        # The probe fails, the circuit opens again
+        self.assertRaises(TransientError, connector.write)
+        self.assertEqual(breaker.OPEN, breaker.state)
+        time.sleep(0.06)
+        self.assertEqual(4, connector.read())
+        self.assertEqual(breaker.CLOSED, breaker.state)
+
+    def test_budget(self):
+        """Test that no call is made once the budget is spent."""
+        connector = FakeConnector(0)
+        connector.resilience.budget = resilience.RunBudget(0.01)
+        self.assertEqual(1, connector.read())
+        time.sleep(0.02)
+        self.assertRaises(exception.RunBudgetExhausted, connector.read)
+        self.assertIsNone(resilience.RunBudget().remaining())
+
+    def test_from_config(self):
+        """Test that the layer is configured from the parameters."""
+        layer = resilience.Resilience.from_config('a', {
+            'retry_attempts': 5, 'breaker_reset_timeout': '10'
+        })
+        self.assertEqual(5, layer.attempts)
+        self.assertEqual(10, layer.breaker.reset_timeout)
+        self.assertEqual(5, layer.breaker.threshold)
+        self.assertRaises(exception.InvalidBackendOption,
+                          resilience.Resilience.from_config, 'a',
+                          {'retry_delay': 'soon'})
+        self.assertRaises(exception.InvalidBackendOption,
+                          resilience.Resilience.from_config, 'a',
+                          {'breaker_threshold': 0})
+
+    def test_explicit_values(self):
+        """Test that the explicit values are not replaced by the options."""
+        layer = resilience.Resilience('a', attempts=0, threshold=0, delay=0)
+        self.assertEqual(0, layer.attempts)
+        self.assertEqual(0, layer.breaker.threshold)
+        self.assertEqual(0, layer.delay)
+
+    def test_overloaded_backend(self):
+        """Test that the image list is retrieved from a flaky backend."""
+        cloud = fake_cloud.FakeCloud()
+        self.addCleanup(cloud.stop)
+        backend = openstack.OpenStackBackend(
+            'fake', dict(cloud.config, retry_delay=0.01)
+        )
+        cloud.overloaded = 2
+        self.assertEqual([], backend.get_image_list())
+        self.assertEqual(0, cloud.overloaded)
+        cloud.overloaded = 5
+        self.assertRaises(exception.UnknownError, backend.list_appliance)
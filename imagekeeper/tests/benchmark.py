@@ -0,0 +1,304 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of the synchronization against local fake clouds.
+
+Each backend is a fake Keystone and Glance server (see ``fake_cloud``)
+with a configurable latency, upload bandwidth, error rate and number of
+unrelated images in its catalogue. The scenarios run the synchronization
+as ``imagekeeper-sync`` does, from the image list file to the state
+database, and the results are written as JSON, for example::
+
+  python -m imagekeeper.tests.benchmark --output results.json
+  python -m imagekeeper.tests.benchmark --scenario cold_sync \\
+      --appliances 100 --catalogue 20000 --latency 0.02
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from oslo_config import cfg
+
+from imagekeeper.backend import manager as backend_manager
+from imagekeeper.cmd import sync as sync_cmd
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import manager as image_manager
+from imagekeeper.sync import engine
+from imagekeeper.sync import state
+from imagekeeper.tests import fake_cloud
+from imagekeeper import version
+
+CONF = cfg.CONF
+
+# Default parameters of the scenarios
+PARAMETERS = collections.OrderedDict([
+    ('appliances', 20),
+    ('image_size', 65536),
+    ('backends', 2),
+    ('catalogue', 10000),
+    ('latency', 0.005),
+    ('bandwidth', 0),
+    ('error_rate', 0.0),
+])
+
+
+class Environment(object):
+    """Image list, fake clouds and local files of a benchmark."""
+
+    def __init__(self, appliances, image_size, backends, catalogue,
+                 latency, bandwidth, error_rate):
+        """Create the image list and start the fake clouds.
+
+        :param appliances: the number of appliances of the image list
+        :type appliances: int
+        :param image_size: the size of each image in bytes
+        :type image_size: int
+        :param backends: the number of backends
+        :type backends: int
+        :param catalogue: the number of unrelated images of each backend
+        :type catalogue: int
+        :param latency: the time in seconds taken by each image request
+        :type latency: float
+        :param bandwidth: the bandwidth of each upload in bytes per second,
+                          0 for no limit
+        :type bandwidth: int
+        :param error_rate: the probability of an image request failing
+        :type error_rate: float
+        """
+        self.root = tempfile.mkdtemp(prefix='imagekeeper-benchmark-')
+        self.image_list_path = os.path.join(self.root, 'image.list')
+        backend_path = os.path.join(self.root, 'backends.json')
+        for name, value in (('store_dir', os.path.join(self.root, 'store')),
+                            ('work_dir', os.path.join(self.root, 'work')),
+                            ('image_list_path', self.image_list_path),
+                            ('image_list_format', 'helixnebula'),
+                            ('cloud_backend_path', backend_path)):
+            CONF.set_override(name, value)
+        self.clouds = collections.OrderedDict()
+        for index in range(backends):
+            cloud = fake_cloud.FakeCloud()
+            cloud.latency = latency
+            cloud.bandwidth = bandwidth
+            cloud.error_rate = error_rate
+            cloud.add_images(catalogue, visibility='public')
+            self.clouds['cloud%d' % index] = cloud
+        with open(backend_path, 'w') as backend_file:
+            json.dump([{'name': name, 'type': 'openstack',
+                        'parameters': cloud.config}
+                       for name, cloud in self.clouds.items()], backend_file)
+        self.entries = []
+        for index in range(appliances):
+            self.entries.append(self._image(index, image_size))
+        self.write_image_list(self.entries)
+
+    def _image(self, index, image_size):
+        """Create the image of an appliance and return its entry."""
+        location = os.path.join(self.root, 'image-%d.qcow2' % index)
+        data = os.urandom(image_size)
+        with open(location, 'wb') as image_file:
+            image_file.write(data)
+        return {
+            'hv:image': {
+                'dc:identifier': 'appliance-%d' % index,
+                'dc:title': 'Appliance %d' % index,
+                'hv:version': '1',
+                'hv:format': 'QCOW2',
+                'hv:uri': location,
+                'sl:checksum:sha512': hashlib.sha512(data).hexdigest(),
+            }
+        }
+
+    def write_image_list(self, entries):
+        """Write the image list file."""
+        with open(self.image_list_path, 'w') as list_file:
+            json.dump({'hv:imagelist': {'dc:identifier': 'benchmark',
+                                        'hv:images': entries}}, list_file)
+
+    def _counters(self):
+        """Return the number of requests and bytes received so far."""
+        requests = 0
+        received = 0
+        for cloud in self.clouds.values():
+            with cloud.lock:
+                requests += len(cloud.requests)
+                received += sum(len(data) for data in cloud.data.values())
+        return requests, received
+
+    def sync(self):
+        """Run a synchronization as imagekeeper-sync does.
+
+        The backends are created for each run, as by a new process.
+
+        :return: the measurements of the run
+        :rtype: collections.OrderedDict
+        """
+        requests, received = self._counters()
+        start = time.monotonic()
+        images = image_manager.ImageListManager()
+        backends = backend_manager.BackendManager().get_backends()
+        sync_state = state.SyncState()
+        try:
+            sync_engine = engine.SyncEngine(backends, images, sync_state)
+            plans = sync_engine.plan()
+            planned = time.monotonic()
+            reports = sync_cmd.execute(sync_engine, plans)
+        finally:
+            sync_state.close()
+        end = time.monotonic()
+        total_requests, total_received = self._counters()
+
+        result = collections.OrderedDict()
+        result['elapsed'] = end - start
+        result['plan_elapsed'] = planned - start
+        result['operations'] = sum(len(plan) for plan in plans.values())
+        result['requests'] = total_requests - requests
+        result['uploaded_bytes'] = max(0, total_received - received)
+        for key in ('succeeded', 'failed', 'up_to_date', 'skipped'):
+            result[key] = sum(getattr(report, key)
+                              for report in reports.values())
+        result['stages'] = collections.OrderedDict(
+            (name, collections.OrderedDict([
+                ('processed', report.processed),
+                ('failed', report.failed),
+                ('bytes', report.bytes),
+                ('busy', report.busy),
+                ('max_depth', report.max_depth),
+            ]))
+            for name, report in sync_engine.stages.items()
+        )
+        return result
+
+    def close(self):
+        """Stop the fake clouds and remove the files."""
+        for cloud in self.clouds.values():
+            cloud.stop()
+        for name in ('store_dir', 'work_dir', 'image_list_path',
+                     'image_list_format', 'cloud_backend_path'):
+            CONF.clear_override(name)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def cold_sync(env):
+    """Upload all the appliances to empty backends."""
+    return [('sync', env.sync())]
+
+
+def noop_resync(env):
+    """Synchronize backends already up to date."""
+    env.sync()
+    return [('resync', env.sync())]
+
+
+def mass_deprecation(env):
+    """Remove all the appliances from the image list."""
+    env.sync()
+    env.write_image_list([])
+    return [('deprecate', env.sync()), ('delete', env.sync())]
+
+
+def many_backends(env):
+    """Upload all the appliances to many backends at once."""
+    return [('sync', env.sync())]
+
+
+# Scenarios and the parameters they override
+SCENARIOS = collections.OrderedDict([
+    ('cold_sync', (cold_sync, {})),
+    ('noop_resync', (noop_resync, {})),
+    ('mass_deprecation', (mass_deprecation, {})),
+    ('many_backends', (many_backends, {'backends': 10, 'catalogue': 1000})),
+])
+
+
+def run_scenario(name, **parameters):
+    """Run a scenario.
+
+    :param name: the name of the scenario
+    :type name: str
+    :param parameters: the parameters overriding the defaults, and the
+                       overrides of the scenario
+    :return: the parameters and the measurements of each run
+    :rtype: collections.OrderedDict
+    """
+    func, overrides = SCENARIOS[name]
+    values = collections.OrderedDict(PARAMETERS)
+    values.update(overrides)
+    values.update((key, value) for key, value in parameters.items()
+                  if value is not None)
+    env = Environment(**values)
+    try:
+        runs = func(env)
+    finally:
+        env.close()
+    return collections.OrderedDict([
+        ('parameters', values),
+        ('runs', collections.OrderedDict(runs)),
+    ])
+
+
+def run(scenarios=None, **parameters):
+    """Run the benchmark.
+
+    :param scenarios: the names of the scenarios to run, by default all
+    :type scenarios: list
+    :return: the results, ready to be written as JSON
+    :rtype: collections.OrderedDict
+    """
+    results = collections.OrderedDict([
+        ('version', version.version_string()),
+        ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('scenarios', collections.OrderedDict()),
+    ])
+    for name in scenarios or SCENARIOS:
+        results['scenarios'][name] = run_scenario(name, **parameters)
+    return results
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append',
+                        choices=list(SCENARIOS),
+                        help="scenario to run, all by default")
+    parser.add_argument('--output', help="file where the results are "
+                        "written, the standard output by default")
+    for key, value in PARAMETERS.items():
+        parser.add_argument('--' + key.replace('_', '-'), dest=key,
+                            type=type(value),
+                            help="default: %s" % value)
+    args = vars(parser.parse_args(argv))
+    scenarios = args.pop('scenario')
+    output = args.pop('output')
+    CONF([], project='imagekeeper')
+    results = run(scenarios, **args)
+    data = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w') as output_file:
+            output_file.write(data + '\n')
+    else:
+        sys.stdout.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
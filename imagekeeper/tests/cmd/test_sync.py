@@ -0,0 +1,109 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Command line test class."""
+
+import json
+import os
+import subprocess
+import sys
+
+import fixtures
+
+from imagekeeper.tests import base
+from imagekeeper.tests.image import test_helixnebula
+
+# Time allowed to import the command line module, in microseconds
+IMPORT_BUDGET = 50000
+
+# Modules that only the synchronization itself may import
+NETWORK_MODULES = ('glanceclient', 'keystoneauth1', 'requests', 'aiohttp')
+
+
+def run(*args):
+    """Run a Python interpreter reporting the time taken by the imports.
+
+    :return: the exit status, the output and the imported modules with
+             their cumulative import time in microseconds
+    :rtype: tuple
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return process.returncode, process.stdout, modules
+
+
+class TestSyncCommand(base.TestCase):
+    """Test that the command line only imports what it needs."""
+
+    def assertNoNetworkModule(self, modules):
+        """Check that no client of the backends has been imported."""
+        self.assertEqual([], [name for name in modules
+                              if name.split('.')[0] in NETWORK_MODULES])
+
+    def test_import_time(self):
+        """Test that importing the command line module is fast."""
+        status, _, modules = run('-c', 'import imagekeeper.cmd.sync')
+        self.assertEqual(0, status)
+        self.assertLess(modules['imagekeeper.cmd.sync'], IMPORT_BUDGET)
+        self.assertNotIn('oslo_config', modules)
+        self.assertNoNetworkModule(modules)
+
+    def test_version(self):
+        """Test that the version is printed without the clients."""
+        status, output, modules = run('-m', 'imagekeeper.cmd.sync',
+                                      '--version')
+        self.assertEqual(0, status)
+        self.assertTrue(output.strip())
+        self.assertNotIn('oslo_log', modules)
+        self.assertNoNetworkModule(modules)
+
+    def test_check_config(self):
+        """Test that the configuration is checked without the clients."""
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        image_list = os.path.join(tempdir, 'image.list')
+        test_helixnebula.write_image_list(
+            image_list, [test_helixnebula.fake_image('a')]
+        )
+        backend_file = os.path.join(tempdir, 'backends.json')
+        with open(backend_file, 'w') as backend:
+            json.dump([{'name': 'cloud', 'type': 'openstack',
+                        'parameters': {}}], backend)
+        config_file = os.path.join(tempdir, 'imagekeeper.conf')
+        with open(config_file, 'w') as config:
+            config.write('[DEFAULT]\nimage_list_path = %s\n'
+                         'cloud_backend_path = %s\n' %
+                         (image_list, backend_file))
+        status, output, modules = run('-m', 'imagekeeper.cmd.sync',
+                                      '--config-file', config_file,
+                                      '--check_config')
+        self.assertEqual(0, status)
+        self.assertIn('1 appliance(s), 1 backend(s)', output)
+        self.assertNoNetworkModule(modules)
+
+        with open(backend_file, 'w') as backend:
+            json.dump([{'name': 'cloud', 'type': 'unknown',
+                        'parameters': {}}], backend)
+        status, _, _ = run('-m', 'imagekeeper.cmd.sync',
+                           '--config-file', config_file, '--check_config')
+        self.assertEqual(1, status)
@@ -0,0 +1,178 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Metrics test class."""
+
+import json
+import os
+from urllib import request
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.backend.connectors import openstack
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import metrics
+from imagekeeper.tests import base
+from imagekeeper.tests import fake_cloud
+
+
+class FakeData(object):
+    """Image data of a given size."""
+
+    def __init__(self, size):
+        """Initialize the class."""
+        self.size = size
+
+
+class FakeConnector(object):
+    """A connector whose operations are recorded."""
+
+    cloud_id = 'fake'
+
+    @metrics.timed('list')
+    def list(self, fail=False):
+        """List the images."""
+        if fail:
+            raise IOError("connection reset")
+        return []
+
+    @metrics.timed('upload', size=lambda image_data: image_data.size)
+    def upload(self, image_data):
+        """Upload an image."""
+
+
+def _value(metric, **labels):
+    """Return the value of a sample of a metric."""
+    for sample_labels, value in metric.samples():
+        if sample_labels == labels:
+            return value
+    return None
+
+
+class TestMetrics(base.TestCase):
+    """Test the metrics."""
+
+    def setUp(self):
+        """Set up the test."""
+        super(TestMetrics, self).setUp()
+        self.config = self.useFixture(config_fixture.Config())
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.addCleanup(metrics.REGISTRY.clear)
+        self.addCleanup(metrics._spans.clear)
+        self.addCleanup(metrics.shutdown)
+
+    def test_disabled(self):
+        """Test that nothing is recorded when the metrics are disabled."""
+        self.assertFalse(metrics.setup())
+        FakeConnector().list()
+        self.assertEqual([], metrics.OPERATIONS.samples())
+        with metrics.span('plan') as span:
+            self.assertNotIsInstance(span, metrics.Span)
+        self.assertEqual([], metrics.SPANS.samples())
+
+    def test_operations(self):
+        """Test that the operations are counted, timed and classified."""
+        metrics.enable()
+        connector = FakeConnector()
+        connector.list()
+        self.assertRaises(IOError, connector.list, fail=True)
+        connector.upload(FakeData(1000))
+        labels = {'backend': 'fake', 'operation': 'list'}
+        self.assertEqual(2, _value(metrics.OPERATIONS, **labels))
+        self.assertEqual(2, _value(metrics.DURATIONS, **labels)['count'])
+        self.assertEqual(0, _value(metrics.IN_PROGRESS, **labels))
+        self.assertEqual(1, _value(metrics.ERRORS, error='OSError',
+                                   **labels))
+        self.assertEqual(1000, _value(metrics.UPLOADED, backend='fake'))
+        self.assertEqual(
+            1, _value(metrics.UPLOAD_RATES, backend='fake')['count']
+        )
+
+    def test_spans(self):
+        """Test that the spans are nested and timed."""
+        metrics.enable()
+        with metrics.span('sync'):
+            with metrics.span('plan'):
+                pass
+            try:
+                with metrics.span('delete'):
+                    raise ValueError()
+            except ValueError:
+                pass
+        spans = dict((span['name'], span) for span in metrics._spans)
+        self.assertIsNone(spans['sync']['parent'])
+        self.assertEqual('sync', spans['plan']['parent'])
+        self.assertEqual('ValueError', spans['delete']['error'])
+        self.assertEqual(1, _value(metrics.SPANS, span='plan')['count'])
+
+    def test_prometheus(self):
+        """Test the Prometheus text format."""
+        metrics.enable()
+        metrics.record('a"b', 'list', 0.02)
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE imagekeeper_backend_operations_total counter\n',
+                      text)
+        self.assertIn('imagekeeper_backend_operations_total'
+                      '{backend="a\\"b",operation="list"} 1\n', text)
+        self.assertIn('imagekeeper_backend_operation_seconds_bucket'
+                      '{backend="a\\"b",operation="list",le="0.01"} 0\n',
+                      text)
+        self.assertIn('imagekeeper_backend_operation_seconds_bucket'
+                      '{backend="a\\"b",operation="list",le="0.025"} 1\n',
+                      text)
+        self.assertIn('imagekeeper_backend_operation_seconds_count'
+                      '{backend="a\\"b",operation="list"} 1\n', text)
+
+    def test_export(self):
+        """Test that the metrics are written to a file in JSON."""
+        path = os.path.join(self.tempdir, 'metrics.json')
+        self.config.config(metrics_file=path, metrics_format='json')
+        self.assertTrue(metrics.setup())
+        with metrics.span('plan'):
+            metrics.record('a', 'create', 0.5)
+        metrics.export()
+        with open(path) as metrics_file:
+            data = json.load(metrics_file)
+        samples = data['metrics']['imagekeeper_backend_operation_seconds'][
+            'samples']
+        self.assertEqual({'backend': 'a', 'operation': 'create'},
+                         samples[0]['labels'])
+        self.assertEqual(1, samples[0]['value']['buckets']['0.5'])
+        self.assertEqual('plan', data['spans'][0]['name'])
+
+    def test_serve(self):
+        """Test that the metrics are served over HTTP."""
+        self.config.config(metrics_port=0)
+        self.assertTrue(metrics.setup())
+        metrics.record('a', 'update', 0.1)
+        address = 'http://%s:%d' % metrics._server.server_address[:2]
+        with request.urlopen(address + '/metrics') as response:
+            self.assertIn(b'operation="update"', response.read())
+        with request.urlopen(address + '/metrics.json') as response:
+            self.assertIn('metrics', json.loads(response.read().decode()))
+
+    def test_backend(self):
+        """Test that the operations of a backend are recorded."""
+        cloud = fake_cloud.FakeCloud()
+        self.addCleanup(cloud.stop)
+        metrics.enable()
+        backend = openstack.OpenStackBackend('cloud', cloud.config)
+        self.assertEqual([], backend.get_image_list())
+        self.assertEqual(1, _value(metrics.OPERATIONS, backend='cloud',
+                                   operation='auth'))
+        self.assertEqual(1, _value(metrics.OPERATIONS, backend='cloud',
+                                   operation='list'))
+        self.assertEqual(1, _value(metrics.REQUESTS, backend='cloud',
+                                   method='GET', status='200'))
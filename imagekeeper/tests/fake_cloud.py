@@ -0,0 +1,289 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A local HTTP server mimicking the Keystone v3 and Glance v2 APIs."""
+
+import hashlib
+from http import server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+from imagekeeper.common import httpserver
+
+TOKEN_BODY = {
+    'token': {
+        'methods': ['password'],
+        'expires_at': '2099-01-01T00:00:00.000000Z',
+        'issued_at': '2020-01-01T00:00:00.000000Z',
+        'user': {'id': 'demo', 'name': 'demo',
+                 'domain': {'id': 'default', 'name': 'Default'}},
+        'project': {'id': 'demo', 'name': 'demo',
+                    'domain': {'id': 'default', 'name': 'Default'}},
+        'catalog': [],
+    }
+}
+
+# Schema of the images, used by the Glance client to create and update them
+IMAGE_SCHEMA = {
+    'name': 'image',
+    'properties': dict(
+        [(key, {'type': ['null', 'string']})
+         for key in ('id', 'name', 'status', 'visibility', 'disk_format',
+                     'container_format', 'checksum', 'os_hash_algo',
+                     'os_hash_value')] +
+        [(key, {'type': ['null', 'integer']})
+         for key in ('size', 'min_ram', 'min_disk')] +
+        [('tags', {'type': 'array', 'items': {'type': 'string'}})]
+    ),
+    'additionalProperties': {'type': 'string'},
+}
+
+
+class _Handler(server.BaseHTTPRequestHandler):
+    """Request handler of the fake cloud."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Do not log the requests."""
+
+    def _send(self, status, body=None, headers=None):
+        """Send a response with a JSON body."""
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        """Read the body of the request, chunked or not."""
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(data)
+                data.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _dispatch(self, method):
+        """Authenticate or check the token, then handle a request."""
+        cloud = self.server.cloud
+        url = urllib.parse.urlsplit(self.path)
+        body = self._read_body()
+        cloud.requests.append((method, url.path))
+        if url.path == '/v3/auth/tokens' and method == 'POST':
+            token = dict(TOKEN_BODY['token'], catalog=[{
+                'type': 'image', 'name': 'glance', 'id': 'glance',
+                'endpoints': [{'id': 'glance', 'interface': 'public',
+                               'region': 'RegionOne',
+                               'region_id': 'RegionOne',
+                               'url': cloud.url}],
+            }])
+            cloud.tokens += 1
+            return self._send(201, {'token': token},
+                              {'X-Subject-Token': 'token-%d' % cloud.tokens})
+        if self.headers.get('X-Auth-Token') != 'token-%d' % cloud.tokens:
+            return self._send(401, {'error': 'invalid token'})
+        with cloud.lock:
+            overloaded = cloud.overloaded > 0
+            cloud.overloaded -= overloaded
+            failed = random.random() < cloud.error_rate
+            cloud.active += 1
+            cloud.max_active = max(cloud.max_active, cloud.active)
+        try:
+            if overloaded:
+                return self._send(
+                    429, {'overLimit': {'message': 'too many requests'}},
+                    {'Retry-After': '0'}
+                )
+            if failed:
+                return self._send(
+                    503, {'error': {'message': 'service unavailable'}}
+                )
+            delay = cloud.latency
+            if method == 'PUT' and cloud.bandwidth:
+                delay += len(body) / float(cloud.bandwidth)
+            time.sleep(delay)
+            with cloud.lock:
+                return self._glance(method, url, body)
+        finally:
+            with cloud.lock:
+                cloud.active -= 1
+
+    def _glance(self, method, url, body):
+        """Handle a request to the image API."""
+        cloud = self.server.cloud
+        if url.path == '/v2/schemas/image' and method == 'GET':
+            return self._send(200, IMAGE_SCHEMA)
+        match = re.match(r'^/v2/images(?:/([^/]+))?(/file)?$', url.path)
+        if match is None:
+            return self._send(404, {'error': 'not found'})
+        image_id, file_path = match.groups()
+        if image_id is None:
+            if method == 'POST':
+                image = json.loads(body.decode('utf-8'))
+                image.update(id=str(uuid.uuid4()), status='queued')
+                cloud.images[image['id']] = image
+                return self._send(201, image)
+            return self._list(url)
+        image = cloud.images.get(image_id)
+        if image is None:
+            return self._send(404, {'error': 'not found'})
+        if method == 'GET':
+            return self._send(200, image)
+        if method == 'DELETE':
+            del cloud.images[image_id]
+            return self._send(204)
+        if method == 'PATCH':
+            for change in json.loads(body.decode('utf-8')):
+                key = change['path'].lstrip('/')
+                if change['op'] == 'remove':
+                    image.pop(key, None)
+                    continue
+                if change['op'] == 'add' and key in image:
+                    return self._send(409, {'error': 'already present'})
+                image[key] = change['value']
+            return self._send(200, image)
+        if method == 'PUT' and file_path:
+            cloud.data[image_id] = body
+            image.update(status='active', size=len(body),
+                         checksum=hashlib.md5(body).hexdigest(),
+                         os_hash_algo='sha512',
+                         os_hash_value=hashlib.sha512(body).hexdigest())
+            return self._send(204)
+        return self._send(405, {'error': 'method not allowed'})
+
+    def _list(self, url):
+        """Return a page of the images matching the filters."""
+        cloud = self.server.cloud
+        query = urllib.parse.parse_qs(url.query)
+        limit = int(query.pop('limit', ['25'])[0])
+        marker = query.pop('marker', [None])[0]
+        tags = query.pop('tag', [])
+        images = [image for image in sorted(cloud.images.values(),
+                                            key=lambda i: i['id'])
+                  if all(image.get(k) == v[0] for k, v in query.items()) and
+                  all(tag in image.get('tags', []) for tag in tags)]
+        if marker is not None:
+            ids = [image['id'] for image in images]
+            images = images[ids.index(marker) + 1:]
+        body = {'images': images[:limit]}
+        cloud.pages += 1
+        if len(images) > limit:
+            params = dict((k, v[0]) for k, v in query.items())
+            params.update(limit=limit, marker=images[limit - 1]['id'])
+            body['next'] = '/v2/images?' + urllib.parse.urlencode(params)
+        return self._send(200, body)
+
+    def do_GET(self):
+        """Handle a GET request."""
+        self._dispatch('GET')
+
+    def do_POST(self):
+        """Handle a POST request."""
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        """Handle a PUT request."""
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        """Handle a PATCH request."""
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        """Handle a DELETE request."""
+        self._dispatch('DELETE')
+
+
+class FakeCloud(object):
+    """A Keystone and Glance server running in a thread."""
+
+    def __init__(self):
+        """Start the server on a free local port."""
+        self.lock = threading.Lock()
+        self.images = {}
+        self.data = {}
+        self.requests = []
+        self.tokens = 0
+        self.pages = 0
+        # Number of the next image requests rejected as too many
+        self.overloaded = 0
+        # Time in seconds taken by each image request
+        self.latency = 0.0
+        # Bandwidth of each image upload in bytes per second, 0 for no limit
+        self.bandwidth = 0
+        # Probability of an image request failing with a 503 error
+        self.error_rate = 0.0
+        self.active = 0
+        self.max_active = 0
+        self._server = httpserver.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _Handler)
+        self._server.cloud = self
+        self.url = 'http://127.0.0.1:%d' % self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.01})
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def config(self):
+        """Return the backend configuration to use the server."""
+        return {
+            'backend': 'fake',
+            'auth_type': 'v3password',
+            'auth_url': self.url + '/v3',
+            'username': 'demo',
+            'password': 'demo',
+            'user_domain_name': 'Default',
+            'project_name': 'demo',
+            'project_domain_name': 'Default',
+        }
+
+    def add_image(self, **properties):
+        """Register an image directly."""
+        image = dict(properties)
+        image.setdefault('id', str(uuid.uuid4()))
+        image.setdefault('status', 'active')
+        with self.lock:
+            self.images[image['id']] = image
+        return image
+
+    def add_images(self, count, **properties):
+        """Register a number of images sharing the same properties."""
+        with self.lock:
+            for index in range(count):
+                image = dict(properties, id=str(uuid.uuid4()),
+                             name='image-%d' % index)
+                image.setdefault('status', 'active')
+                self.images[image['id']] = image
+
+    def stop(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,142 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image converter test class."""
+
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import unittest
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
+from imagekeeper.image import appliance
+from imagekeeper.image import convert
+from imagekeeper.image import store
+from imagekeeper.tests import base
+
+# Stand-in for qemu-img prefixing the image with its target format
+FAKE_QEMU_IMG = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+[ "$5" = raw ] || { echo "unknown format $5" >&2; exit 1; }
+{ printf '%s:' "$5"; cat "$6"; } > "$7"
+"""
+
+
+class TestConverter(base.TestCase):
+    """Test the conversion of the images."""
+
+    def setUp(self):
+        """Create an image and an empty store."""
+        super(TestConverter, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(config_fixture.Config())
+        self.conf.config(work_dir=os.path.join(self.tempdir, 'work'))
+        self.store = store.ImageStore(os.path.join(self.tempdir, 'store'),
+                                      quota=0)
+        self.addCleanup(self.store.close)
+
+        self.qemu_img = os.path.join(self.tempdir, 'qemu-img')
+        with open(self.qemu_img, 'w') as script:
+            script.write(FAKE_QEMU_IMG)
+        os.chmod(self.qemu_img, stat.S_IRWXU)
+        self.conf.config(qemu_img_path=self.qemu_img)
+
+        location = os.path.join(self.tempdir, 'a.qcow2')
+        with open(location, 'wb') as image_file:
+            image_file.write(b'data')
+        self.appliance = appliance.Appliance(
+            'a', '1', title='Appliance A', format='QCOW2', location=location,
+            checksum=hashlib.sha512(b'data').hexdigest()
+        )
+
+    def converter(self):
+        """Return a converter with a single process."""
+        converter = convert.Converter(self.store, max_workers=1)
+        self.addCleanup(converter.close)
+        return converter
+
+    def calls(self):
+        """Return the number of runs of qemu-img."""
+        calls = os.path.join(self.tempdir, 'calls')
+        if not os.path.exists(calls):
+            return 0
+        with open(calls) as calls_file:
+            return len(calls_file.readlines())
+
+    def test_convert(self):
+        """Test that the converted image replaces the original one."""
+        converted = self.converter().convert(self.appliance, 'raw')
+        self.assertEqual('raw', converted.format)
+        self.assertEqual(hashlib.sha256(b'raw:data').hexdigest(),
+                         converted.checksum)
+        with open(converted.location, 'rb') as image_file:
+            self.assertEqual(b'raw:data', image_file.read())
+        self.assertEqual(1, self.store.refcount(converted.checksum))
+
+    def test_cached(self):
+        """Test that an image is converted once per format."""
+        converter = self.converter()
+        converter.convert(self.appliance, 'raw')
+        other = self.appliance.replace(identifier='b')
+        converted = converter.convert(other, 'RAW')
+        self.assertEqual(1, self.calls())
+        self.assertIn(converted.checksum, self.store)
+
+    def test_corrupt_source(self):
+        """Test that a local image not matching its checksum is rejected."""
+        with open(self.appliance.location, 'wb') as image_file:
+            image_file.write(b'corrupt')
+        converter = self.converter()
+        self.assertRaises(exception.ChecksumMismatch,
+                          converter.convert, self.appliance, 'raw')
+        self.assertEqual(0, self.calls())
+        self.assertIsNone(self.store.conversion(
+            self.appliance.checksum.lower(), 'raw'
+        ))
+
+    def test_same_format(self):
+        """Test that an image already in the format is not converted."""
+        converted = self.converter().convert(self.appliance, 'qcow2')
+        self.assertIs(self.appliance, converted)
+        self.assertEqual(0, self.calls())
+
+    def test_failure(self):
+        """Test that a failed conversion raises an exception."""
+        converter = self.converter()
+        self.assertRaises(exception.ImageConversionFailed,
+                          converter.convert, self.appliance, 'vmdk')
+        self.assertRaises(exception.ImageConversionFailed,
+                          converter.convert, self.appliance, 'iso')
+        ova = self.appliance.replace(format='ova')
+        self.assertRaises(exception.ImageConversionFailed,
+                          converter.convert, ova, 'raw')
+        self.assertEqual([], os.listdir(self.conf.conf.work_dir))
+
+    @unittest.skipUnless(shutil.which('qemu-img'), 'qemu-img not installed')
+    def test_qemu_img(self):
+        """Test a conversion with qemu-img."""
+        self.conf.config(qemu_img_path='qemu-img')
+        subprocess.check_call(['qemu-img', 'create', '-f', 'qcow2',
+                               self.appliance.location, '1M'],
+                              stdout=subprocess.DEVNULL)
+        converted = self.converter().convert(
+            self.appliance.replace(checksum=None), 'raw'
+        )
+        self.assertEqual(1048576, os.path.getsize(converted.location))
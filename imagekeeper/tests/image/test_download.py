@@ -0,0 +1,212 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image downloader test class."""
+
+import hashlib
+from http import server
+import json
+import os
+import re
+import threading
+import time
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.common import exception
+from imagekeeper.common import httpserver
+from imagekeeper.image import appliance
+from imagekeeper.image import download
+from imagekeeper.image import store
+from imagekeeper.tests import base
+
+
+class RangeHandler(server.BaseHTTPRequestHandler):
+    """Serve files with range support."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Do not log the requests."""
+
+    def do_HEAD(self):
+        """Return the size of a file."""
+        self._serve(head=True)
+
+    def do_GET(self):
+        """Return a file or a range of a file."""
+        self._serve()
+
+    def _serve(self, head=False):
+        """Send a file or a range of a file."""
+        files = self.server.files
+        if self.path not in files:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = files[self.path]
+        ranges = self.server.ranges
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active,
+                                         self.server.active)
+            if not head:
+                self.server.gets += 1
+                fail = self.server.gets in self.server.fail_requests
+        try:
+            if head:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                if ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', '"v1"')
+                self.end_headers()
+                return
+            if fail:
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(0.01)
+            if ranges and match:
+                start, end = int(match.group(1)), int(match.group(2))
+                self.server.served.append((start, end))
+                self.send_response(206)
+                body = data[start:end + 1]
+            else:
+                self.send_response(200)
+                body = data
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+
+class TestDownloader(base.TestCase):
+    """Test the image downloader against a local HTTP server."""
+
+    def setUp(self):
+        """Start a HTTP server and create an empty store."""
+        super(TestDownloader, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(config_fixture.Config())
+        self.conf.config(work_dir=os.path.join(tempdir, 'work'))
+        self.store = store.ImageStore(os.path.join(tempdir, 'store'),
+                                      quota=0)
+        self.addCleanup(self.store.close)
+
+        self.server = httpserver.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     RangeHandler)
+        self.server.lock = threading.Lock()
+        self.server.files = {}
+        self.server.ranges = True
+        self.server.served = []
+        self.server.fail_requests = set()
+        self.server.gets = 0
+        self.server.active = 0
+        self.server.max_active = 0
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.data = os.urandom(10 * 1048576 + 1000)
+        self.server.files['/image.qcow2'] = self.data
+        self.appliance = appliance.Appliance(
+            'a', '1', title='Appliance A',
+            location='http://127.0.0.1:%d/image.qcow2' %
+                     self.server.server_port,
+            checksum=hashlib.sha512(self.data).hexdigest(),
+        )
+
+    def downloader(self, **kwargs):
+        """Return a downloader with 1 MB segments."""
+        kwargs.setdefault('segment_size', 1048576)
+        downloader = download.Downloader(self.store, **kwargs)
+        self.addCleanup(downloader.close)
+        return downloader
+
+    def test_is_remote(self):
+        """Test the detection of the remote images."""
+        self.assertTrue(download.is_remote('https://example.org/a.img'))
+        self.assertFalse(download.is_remote('/var/lib/a.img'))
+        self.assertFalse(download.is_remote(None))
+
+    def test_fetch(self):
+        """Test that an image is downloaded in segments into the store."""
+        digest = self.downloader(max_workers=4, host_workers=2).fetch(
+            self.appliance
+        )
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(), digest)
+        with open(self.store.path(digest), 'rb') as blob:
+            self.assertEqual(self.data, blob.read())
+        self.assertEqual(11, len(self.server.served))
+        self.assertLessEqual(self.server.max_active, 2)
+        self.assertEqual(digest, self.store.lookup('a', '1'))
+        self.assertEqual([], os.listdir(self.conf.conf.work_dir))
+
+    def test_fetch_stored(self):
+        """Test that an image already in the store is not downloaded."""
+        downloader = self.downloader()
+        downloader.fetch(self.appliance)
+        gets = self.server.gets
+        downloader.fetch(self.appliance)
+        self.assertEqual(gets, self.server.gets)
+
+    def test_fetch_without_ranges(self):
+        """Test that an image is streamed if ranges are not supported."""
+        self.server.ranges = False
+        digest = self.downloader().fetch(self.appliance)
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(), digest)
+        self.assertEqual(1, self.server.gets)
+
+    def test_resume(self):
+        """Test that an interrupted download is resumed."""
+        self.server.fail_requests = set([5, 6, 7])
+        downloader = self.downloader(max_workers=1, host_workers=1)
+        self.assertRaises(IOError, downloader.fetch, self.appliance)
+        path, meta_path = downloader._paths(self.appliance.location)
+        with open(meta_path) as meta_file:
+            self.assertEqual(4, len(json.load(meta_file)['done']))
+
+        self.server.served = []
+        digest = downloader.fetch(self.appliance)
+        self.assertEqual(7, len(self.server.served))
+        with open(self.store.path(digest), 'rb') as blob:
+            self.assertEqual(self.data, blob.read())
+
+    def test_segment_retried(self):
+        """Test that a failed segment is fetched again."""
+        self.server.fail_requests = set([5])
+        downloader = self.downloader(max_workers=1, host_workers=1)
+        digest = downloader.fetch(self.appliance)
+        self.assertEqual(11, len(self.server.served))
+        with open(self.store.path(digest), 'rb') as blob:
+            self.assertEqual(self.data, blob.read())
+
+    def test_wrong_checksum(self):
+        """Test that an image not matching the appliance is discarded."""
+        self.appliance.checksum = hashlib.sha512(b'other').hexdigest()
+        self.assertRaises(exception.ChecksumMismatch,
+                          self.downloader().fetch, self.appliance)
+        self.assertEqual([], os.listdir(self.conf.conf.work_dir))
+        self.assertEqual(0, self.store.size())
@@ -0,0 +1,109 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Fan-out upload test class."""
+
+import hashlib
+import os
+import time
+
+import fixtures
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import fanout
+from imagekeeper.tests import base
+
+
+class FakeBackend(object):
+    """A fake backend reading the image it receives."""
+
+    def __init__(self, delay=0.0, fail_after=None):
+        """Initialize the class."""
+        self.delay = delay
+        self.fail_after = fail_after
+        self.data = b''
+        self.md5 = None
+
+    def add_appliance(self, appliance, image_data=None):
+        """Read the image, slowly or failing if requested."""
+        while True:
+            if (self.fail_after is not None and
+                    len(self.data) >= self.fail_after):
+                raise IOError('upload failed')
+            chunk = image_data.read(65536)
+            if not chunk:
+                break
+            self.data += chunk
+            time.sleep(self.delay)
+        self.md5 = image_data.hexdigest('md5')
+        return True
+
+
+class TestFanout(base.TestCase):
+    """Test the fan-out upload."""
+
+    def setUp(self):
+        """Create a fake image file."""
+        super(TestFanout, self).setUp()
+        self.data = os.urandom(1000000)
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.appliance = {
+            'identifier': 'a',
+            'location': os.path.join(tempdir, 'image.img'),
+            'checksum': None,
+        }
+        with open(self.appliance['location'], 'wb') as image_file:
+            image_file.write(self.data)
+
+    def test_upload(self):
+        """Test that every backend receives the whole image."""
+        backends = {'fast': FakeBackend(), 'slow': FakeBackend(0.001)}
+        results = fanout.upload(self.appliance, backends, buffer_chunks=2)
+        self.assertEqual({'fast': True, 'slow': True}, results)
+        for backend in backends.values():
+            self.assertEqual(self.data, backend.data)
+            self.assertEqual(hashlib.md5(self.data).hexdigest(),
+                             backend.md5)
+
+    def test_upload_failure(self):
+        """Test that a failing backend does not hold the other ones."""
+        backends = {'ok': FakeBackend(), 'ko': FakeBackend(fail_after=1)}
+        results = fanout.upload(self.appliance, backends, buffer_chunks=1)
+        self.assertEqual({'ok': True, 'ko': False}, results)
+        self.assertEqual(self.data, backends['ok'].data)
+
+    def test_upload_missing_file(self):
+        """Test that a missing image file fails every backend."""
+        self.appliance['location'] += '.missing'
+        results = fanout.upload(self.appliance, {'a': FakeBackend()})
+        self.assertEqual({'a': False}, results)
+
+    def test_fanout_reader(self):
+        """Test that the image is read once for all the branches."""
+        reader = fanout.stream.open_image(self.appliance, 65536)
+        reader_fanout = fanout.FanoutReader(reader, 3, buffer_chunks=1)
+        reader_fanout.start()
+        data = [[], [], []]
+        done = False
+        while not done:
+            done = True
+            for index, branch in enumerate(reader_fanout.branches):
+                chunk = branch.read(10000)
+                if chunk:
+                    data[index].append(chunk)
+                    done = False
+        reader_fanout.join()
+        self.assertEqual(len(self.data), reader.bytes_read)
+        for chunks in data:
+            self.assertEqual(self.data, b''.join(chunks))
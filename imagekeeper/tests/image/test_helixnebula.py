@@ -0,0 +1,135 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""HelixNebula image list format test class."""
+
+import json
+import os
+
+import fixtures
+import mock
+
+from imagekeeper.common import exception
+from imagekeeper.image.formats import helixnebula
+from imagekeeper.tests import base
+
+
+def fake_image(identifier, version='1.0'):
+    """Return a fake entry of an image list."""
+    return {
+        'hv:image': {
+            'dc:identifier': identifier,
+            'dc:title': 'Image %s' % identifier,
+            'dc:description': 'A description with a ] and a "hv:images"',
+            'hv:version': version,
+            'hv:format': 'QCOW2',
+            'hv:uri': 'https://example.org/%s.qcow2' % identifier,
+            'hv:ram_minimum': 1073741824,
+            'sl:checksum:sha512': 'f' * 128,
+        }
+    }
+
+
+def write_image_list(filename, images):
+    """Write an image list file."""
+    with open(filename, 'w') as list_file:
+        json.dump({'hv:imagelist': {'dc:identifier': 'list',
+                                    'hv:images': images}},
+                  list_file, indent=2)
+
+
+class TestHelixNebula(base.TestCase):
+    """Test the HelixNebula image list format."""
+
+    def setUp(self):
+        """Create an image list file."""
+        super(TestHelixNebula, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tempdir, 'image.list')
+        self.parser = helixnebula.HelixNebula()
+        # Force the entries to be split over several reads
+        self.parser.read_size = 64
+
+    def test_feature(self):
+        """Test the name of the format."""
+        self.assertEqual('helixnebula', helixnebula.HelixNebula.get_feature())
+
+    def test_parse_file(self):
+        """Test that every entry is converted into an appliance."""
+        write_image_list(self.filename,
+                         [fake_image(str(i)) for i in range(20)])
+        appliances = list(self.parser.parse_file(self.filename))
+        self.assertEqual([str(i) for i in range(20)],
+                         [a.identifier for a in appliances])
+        appliance = appliances[3]
+        self.assertEqual('Image 3', appliance['title'])
+        self.assertEqual('1.0', appliance.version)
+        self.assertEqual('QCOW2', appliance['format'])
+        self.assertEqual('https://example.org/3.qcow2', appliance.location)
+        self.assertEqual('f' * 128, appliance.checksum)
+        self.assertEqual(1024, appliance['min_ram'])
+
+    def test_parse_empty_list(self):
+        """Test an image list without image."""
+        write_image_list(self.filename, [])
+        self.assertEqual([], list(self.parser.parse_file(self.filename)))
+
+    def test_parse_invalid_file(self):
+        """Test that a truncated image list is rejected."""
+        write_image_list(self.filename, [fake_image('a'), fake_image('b')])
+        with open(self.filename) as list_file:
+            content = list_file.read()
+        with open(self.filename, 'w') as list_file:
+            list_file.write(content[:len(content) // 2])
+        self.assertRaises(exception.InvalidImageListFile, list,
+                          self.parser.parse_file(self.filename))
+
+    def test_parse_malformed_entry(self):
+        """Test that a malformed entry is rejected without reading on."""
+        write_image_list(self.filename,
+                         [fake_image(str(i)) for i in range(100)])
+        with open(self.filename) as list_file:
+            content = list_file.read()
+        index = content.index('"Image 1"')
+        with open(self.filename, 'w') as list_file:
+            list_file.write(content[:index] + '"Image 1" "' +
+                            content[index + 9:])
+        reads = []
+        original = helixnebula.io.open
+
+        def counting_open(*args, **kwargs):
+            list_file = original(*args, **kwargs)
+            read = list_file.read
+
+            def counting_read(size=-1):
+                reads.append(size)
+                return read(size)
+            list_file.read = counting_read
+            return list_file
+
+        with mock.patch.object(helixnebula.io, 'open', counting_open):
+            self.assertRaises(exception.InvalidImageListFile, list,
+                              self.parser.parse_file(self.filename))
+        self.assertLess(len(reads) * 64, len(content) // 10)
+
+    def test_parse_large_entry(self):
+        """Test that an entry larger than the limit is rejected."""
+        image = fake_image('a')
+        image['hv:image']['dc:description'] = 'x' * 1000
+        write_image_list(self.filename, [image])
+        self.parser.max_entry_size = 500
+        self.assertRaises(exception.InvalidImageListFile, list,
+                          self.parser.parse_file(self.filename))
+        self.parser.max_entry_size = 2000
+        self.assertEqual(1, len(list(self.parser.parse_file(self.filename))))
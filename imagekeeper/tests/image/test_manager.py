@@ -0,0 +1,69 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image list manager test class."""
+
+import os
+
+import fixtures
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import manager
+from imagekeeper.tests import base
+from imagekeeper.tests.image import test_helixnebula
+
+
+class TestImageListManager(base.TestCase):
+    """Test the image list manager."""
+
+    def setUp(self):
+        """Create an image list file."""
+        super(TestImageListManager, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tempdir, 'image.list')
+        self.revision = 0
+        self.write([('a', '1'), ('b', '1'), ('c', '1')])
+        conf = self.useFixture(config_fixture.Config(cfg.CONF))
+        conf.config(image_list_path=self.filename)
+
+    def write(self, images):
+        """Write the image list with the given (identifier, version)."""
+        test_helixnebula.write_image_list(
+            self.filename,
+            [test_helixnebula.fake_image(*image) for image in images]
+        )
+        # Make sure that the modification is detected
+        self.revision += 1
+        os.utime(self.filename, (self.revision, self.revision))
+
+    def test_get_images(self):
+        """Test that the image list is parsed."""
+        images = manager.ImageListManager()
+        self.assertEqual(3, len(images))
+        self.assertEqual(['a', 'b', 'c'], sorted(images.get_images()))
+
+    def test_refresh(self):
+        """Test that only the differences are returned on refresh."""
+        images = manager.ImageListManager()
+        diff = images.refresh()
+        self.assertEqual(([], [], []), diff)
+
+        self.write([('a', '1'), ('b', '2'), ('d', '1')])
+        diff = images.refresh()
+        self.assertEqual(['d'], [a.identifier for a in diff.added])
+        self.assertEqual(['b'], [a.identifier for a in diff.changed])
+        self.assertEqual('2', diff.changed[0].version)
+        self.assertEqual(['c'], [a.identifier for a in diff.removed])
@@ -0,0 +1,145 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image store test class."""
+
+import errno
+import hashlib
+import os
+
+import fixtures
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import appliance
+from imagekeeper.image import store
+from imagekeeper.tests import base
+
+
+class TestImageStore(base.TestCase):
+    """Test the content-addressed image store."""
+
+    def setUp(self):
+        """Create an empty store."""
+        super(TestImageStore, self).setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.store = store.ImageStore(os.path.join(self.tempdir, 'store'),
+                                      quota=0)
+        self.addCleanup(self.store.close)
+        self.files = 0
+
+    def write(self, data):
+        """Write an image in the work directory."""
+        self.files += 1
+        path = os.path.join(self.tempdir, 'image-%d' % self.files)
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        return path
+
+    def test_add(self):
+        """Test that an image is stored under its digest."""
+        path = self.write(b'data')
+        digest = self.store.add(path)
+        self.assertEqual(hashlib.sha256(b'data').hexdigest(), digest)
+        self.assertFalse(os.path.exists(path))
+        self.assertIn(digest, self.store)
+        with open(self.store.get(digest), 'rb') as blob:
+            self.assertEqual(b'data', blob.read())
+
+    def test_dedup(self):
+        """Test that identical images are stored once."""
+        first = self.store.add(self.write(b'data'))
+        second = self.store.add(self.write(b'data'))
+        self.assertEqual(first, second)
+        self.assertEqual(4, self.store.size())
+        self.assertEqual(1, len(os.listdir(os.path.dirname(
+            self.store.path(first)))))
+
+    def test_export(self):
+        """Test that a blob is exported without being copied."""
+        digest = self.store.add(self.write(b'data'))
+        destination = os.path.join(self.tempdir, 'exported')
+        self.assertEqual('link', self.store.export(digest, destination))
+        self.assertEqual(os.stat(self.store.path(digest)).st_ino,
+                         os.stat(destination).st_ino)
+
+    def test_clone_file_copy(self):
+        """Test that a file is copied when it cannot be linked."""
+        source = self.write(b'data')
+        destination = os.path.join(self.tempdir, 'copy')
+        self.useFixture(fixtures.MonkeyPatch(
+            'os.link', lambda *args: self.fail_link()
+        ))
+        self.assertIn(store.clone_file(source, destination),
+                      ('reflink', 'copy'))
+        with open(destination, 'rb') as copy:
+            self.assertEqual(b'data', copy.read())
+
+    @staticmethod
+    def fail_link():
+        """Fail as a link across file systems."""
+        raise OSError(errno.EXDEV, 'cross-device link')
+
+    def test_gc(self):
+        """Test that only the unreferenced blobs are removed."""
+        used = self.store.add(self.write(b'used'))
+        unused = self.store.add(self.write(b'unused'))
+        self.store.reference('a', '1', used)
+        self.store.reference('b', '1', used)
+        self.assertEqual(2, self.store.refcount(used))
+        self.assertEqual([unused], self.store.gc())
+        self.assertIn(used, self.store)
+        self.assertNotIn(unused, self.store)
+
+    def test_retain(self):
+        """Test that the appliances removed from the list are released."""
+        digest = self.store.add(self.write(b'data'))
+        self.store.reference('a', '1', digest)
+        self.store.reference('a', '2', digest)
+        self.store.retain([appliance.Appliance('a', '2')])
+        self.assertIsNone(self.store.lookup('a', '1'))
+        self.assertEqual(digest, self.store.lookup('a', '2'))
+
+    def test_evict(self):
+        """Test that the least recently used blobs are evicted."""
+        digests = []
+        for data in (b'a' * 10, b'b' * 10, b'c' * 10):
+            digest = self.store.add(self.write(data))
+            self.store.reference(data[:1].decode(), '1', digest)
+            digests.append(digest)
+        self.store.touch(digests[0])
+        self.assertEqual([digests[1]], self.store.evict(quota=20))
+        self.assertEqual(20, self.store.size())
+        self.assertIsNone(self.store.lookup('b', '1'))
+
+    def test_conversions(self):
+        """Test that the converted images follow their appliance."""
+        digest = self.store.add(self.write(b'converted'))
+        self.store.add_conversion('source', 'raw', digest, 'a', '1')
+        self.assertEqual(digest, self.store.conversion('source', 'raw'))
+        self.assertEqual([], self.store.gc())
+        self.store.retain([appliance.Appliance('b', '1')])
+        self.assertIsNone(self.store.conversion('source', 'raw'))
+        self.assertEqual([digest], self.store.gc())
+
+    def test_shared_conversion(self):
+        """Test that a conversion is kept while an appliance uses it."""
+        digest = self.store.add(self.write(b'converted'))
+        self.store.add_conversion('source', 'raw', digest, 'a', '1')
+        self.store.add_conversion('source', 'raw', digest, 'b', '1')
+        self.store.release('b')
+        self.assertEqual(digest, self.store.conversion('source', 'raw'))
+        self.assertEqual([], self.store.gc())
+        self.store.release('a', '1')
+        self.assertIsNone(self.store.conversion('source', 'raw'))
+        self.assertEqual([digest], self.store.gc())
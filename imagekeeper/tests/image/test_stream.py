@@ -0,0 +1,113 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Image stream test class."""
+
+import hashlib
+import os
+
+import fixtures
+
+from imagekeeper.image import stream
+from imagekeeper.tests import base
+
+
+class TestChecksumReader(base.TestCase):
+    """Test the checksum reader."""
+
+    def setUp(self):
+        """Create a fake image file."""
+        super(TestChecksumReader, self).setUp()
+        self.data = os.urandom(300000)
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tempdir, 'image.img')
+        with open(self.filename, 'wb') as image_file:
+            image_file.write(self.data)
+
+    def test_read(self):
+        """Test that the checksums match the data read."""
+        with stream.ChecksumReader(self.filename, 65536,
+                                   ('md5', 'sha256')) as reader:
+            self.assertEqual(len(self.data), reader.size)
+            data = b''
+            chunk = reader.read(1000)
+            while chunk:
+                data += chunk
+                chunk = reader.read(1000)
+        self.assertEqual(self.data, data)
+        self.assertEqual(len(self.data), reader.bytes_read)
+        self.assertEqual(hashlib.md5(self.data).hexdigest(),
+                         reader.hexdigest('md5'))
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(),
+                         reader.hexdigest('sha256'))
+
+    def test_iter(self):
+        """Test the iteration by chunks."""
+        with stream.ChecksumReader(self.filename, 65536) as reader:
+            chunks = list(reader)
+        self.assertEqual(5, len(chunks))
+        self.assertEqual(65536, len(chunks[0]))
+        self.assertEqual(self.data, b''.join(chunks))
+        self.assertEqual(hashlib.md5(self.data).hexdigest(),
+                         reader.hexdigest('md5'))
+
+
+class TestSparseReader(base.TestCase):
+    """Test the sparse file reader."""
+
+    def setUp(self):
+        """Create a sparse image file."""
+        super(TestSparseReader, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tempdir, 'image.raw')
+        self.data = os.urandom(8192)
+        with open(self.filename, 'wb') as image_file:
+            image_file.truncate(4 * 1048576)
+            image_file.seek(1048576)
+            image_file.write(self.data)
+        self.content = (bytes(1048576) + self.data +
+                        bytes(3 * 1048576 - len(self.data)))
+
+    def test_read(self):
+        """Test that the holes are read as zeros."""
+        with stream.SparseReader(self.filename, 65536,
+                                 ('md5', 'sha256')) as reader:
+            data = b''.join(reader)
+            self.assertEqual(self.content, data)
+            self.assertEqual(b'', reader.read())
+        self.assertEqual(hashlib.sha256(self.content).hexdigest(),
+                         reader.hexdigest('sha256'))
+        self.assertLessEqual(reader.data_read, reader.bytes_read)
+        if stream.is_sparse(self.filename):
+            self.assertLess(reader.data_ratio, 0.5)
+
+    def test_small_reads(self):
+        """Test reads crossing the extents of the file."""
+        with stream.SparseReader(self.filename, 65536) as reader:
+            chunks = []
+            chunk = reader.read(100000)
+            while chunk:
+                chunks.append(chunk)
+                chunk = reader.read(100000)
+        self.assertEqual(self.content, b''.join(chunks))
+        self.assertEqual(hashlib.md5(self.content).hexdigest(),
+                         reader.hexdigest('md5'))
+
+    def test_open_image(self):
+        """Test that sparse images are read with a sparse reader."""
+        reader = stream.open_image({'location': self.filename,
+                                    'checksum': None})
+        with reader:
+            self.assertEqual(stream.is_sparse(self.filename),
+                             isinstance(reader, stream.SparseReader))
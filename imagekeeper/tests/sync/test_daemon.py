@@ -0,0 +1,159 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sync daemon test class."""
+
+import os
+import threading
+import time
+
+import fixtures
+import mock
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.backend import manager as backend_manager
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import appliance
+from imagekeeper.image import manager as image_manager
+from imagekeeper.sync import daemon
+from imagekeeper.sync import journal
+from imagekeeper.sync import state
+from imagekeeper.tests import base
+from imagekeeper.tests.sync import test_engine
+
+
+class FakeImageList(test_engine.FakeImageList):
+    """A fake image list reporting its changes."""
+
+    def __init__(self, appliances):
+        """Initialize the class."""
+        super(FakeImageList, self).__init__(appliances)
+        self.changes = image_manager.ImageListDiff([], [], [])
+
+    def refresh(self):
+        """Return the changes made since the previous call."""
+        changes = self.changes
+        self.changes = image_manager.ImageListDiff([], [], [])
+        return changes
+
+
+class FakeBackendManager(object):
+    """A fake backend manager."""
+
+    def __init__(self, backends):
+        """Initialize the class."""
+        self.backends = backends
+        self.changes = backend_manager.BackendFileDiff([], [], [])
+
+    def refresh(self):
+        """Return the changes made since the previous call."""
+        changes = self.changes
+        self.changes = backend_manager.BackendFileDiff([], [], [])
+        return changes
+
+    def names(self):
+        """Return the names of the backends."""
+        return list(self.backends)
+
+    def get_backend(self, name):
+        """Return a backend."""
+        return self.backends[name]
+
+
+class TestSyncDaemon(base.TestCase):
+    """Test the sync daemon."""
+
+    def setUp(self):
+        """Create a few appliances and backends."""
+        super(TestSyncDaemon, self).setUp()
+        self.config = self.useFixture(config_fixture.Config())
+        self.config.config(sync_interval=3600, sync_jitter=10)
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.tempdir = tempdir
+        appliances = []
+        for identifier in ('a', 'b'):
+            location = os.path.join(tempdir, identifier)
+            with open(location, 'wb') as image_file:
+                image_file.write(os.urandom(1000))
+            appliances.append(appliance.Appliance(
+                identifier, '1', format='qcow2', location=location
+            ))
+        self.images = FakeImageList(appliances)
+        self.backends = FakeBackendManager({
+            'x': test_engine.FakeBackend(), 'y': test_engine.FakeBackend()
+        })
+        self.state = state.SyncState(os.path.join(tempdir, 'state.db'))
+        self.addCleanup(self.state.close)
+        self.daemon = daemon.SyncDaemon(self.images, self.backends,
+                                        self.state)
+
+    def test_schedule(self):
+        """Test that the backends are synchronized when due."""
+        start = time.monotonic()
+        reports = self.daemon.run_once()
+        self.assertEqual(['x', 'y'], sorted(reports))
+        self.assertEqual(2, reports['x'].succeeded)
+        self.assertIsNone(self.daemon.run_once())
+        self.assertEqual(1, self.daemon.cycles)
+        for due in self.daemon._due.values():
+            self.assertGreaterEqual(due, start + 3600)
+            self.assertLessEqual(due, time.monotonic() + 3610)
+        self.daemon._due['y'] = start
+        self.assertEqual(['y'], list(self.daemon.run_once()))
+
+    def test_changes(self):
+        """Test that the changes make the backends due."""
+        self.daemon.run_once()
+        self.images.changes = image_manager.ImageListDiff(
+            [], [self.images.appliances['a']], []
+        )
+        self.assertEqual(['x', 'y'], sorted(self.daemon.run_once()))
+        self.backends.backends['z'] = test_engine.FakeBackend()
+        self.backends.changes = backend_manager.BackendFileDiff(
+            ['z'], [], []
+        )
+        reports = self.daemon.run_once()
+        self.assertEqual(['z'], list(reports))
+        self.assertEqual(2, reports['z'].succeeded)
+
+    def test_journal_compacted(self):
+        """Test that the journal is compacted after each cycle."""
+        path = os.path.join(self.tempdir, 'journal.log')
+        sync_journal = journal.Journal(path)
+        self.addCleanup(sync_journal.close)
+        self.daemon.journal = sync_journal
+        with mock.patch.object(sync_journal, 'compact',
+                               wraps=sync_journal.compact) as compact:
+            self.daemon.run_once()
+        compact.assert_called_once_with()
+        self.assertEqual(0, os.path.getsize(path))
+
+    def test_stop(self):
+        """Test that no upload is started once the daemon is stopped."""
+        self.daemon.stop()
+        reports = self.daemon.run_once()
+        self.assertEqual(2, reports['x'].skipped)
+        self.assertEqual({}, self.backends.backends['x'].images)
+
+    def test_run(self):
+        """Test that the daemon runs until it is stopped."""
+        self.config.config(poll_interval=1)
+        thread = threading.Thread(target=self.daemon.run)
+        thread.start()
+        while not self.daemon.cycles:
+            time.sleep(0.01)
+        self.daemon.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, self.daemon.cycles)
@@ -0,0 +1,276 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sync engine test class."""
+
+import os
+import threading
+
+import fixtures
+
+from imagekeeper.backend import base as backend_base
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import appliance
+from imagekeeper.sync import engine
+from imagekeeper.sync import journal
+from imagekeeper.sync import state
+from imagekeeper.tests import base
+
+
+class FakeBackend(object):
+    """A fake backend keeping the images in memory."""
+
+    def __init__(self, disk_format=None):
+        """Initialize the class."""
+        self.disk_format = disk_format
+        self.resilience = None
+        self.formats = []
+        self.lock = threading.Lock()
+        self.images = {}
+        self.lookups = 0
+        self.replayed = None
+
+    def replay_journal(self, keep=()):
+        """Record the appliances whose interrupted uploads are kept."""
+        self.replayed = sorted(keep)
+        return True
+
+    def get_image_list(self, properties=None):
+        """Return the images matching the properties."""
+        with self.lock:
+            self.lookups += 1
+            return [dict(image, id=image_id)
+                    for image_id, image in sorted(self.images.items())
+                    if all(image.get(key) == value
+                           for key, value in (properties or {}).items())]
+
+    def add_appliance(self, appliance, image_data=None):
+        """Read the image and register it."""
+        while image_data.read(65536):
+            pass
+        with self.lock:
+            self.formats.append(appliance['format'])
+            image_id = 'image-%d' % len(self.images)
+            self.images[image_id] = {'IK_ID': appliance['identifier'],
+                                     'IK_VERSION': appliance['version'],
+                                     'IK_STATUS': 'ENABLED'}
+            return image_id
+
+    def deprecate_appliance(self, appliance_id):
+        """Disable the images of an appliance."""
+        with self.lock:
+            for image in self.images.values():
+                if image['IK_ID'] == appliance_id:
+                    image['IK_STATUS'] = 'DISABLED'
+            return True
+
+    def deprecate_many(self, appliance_ids):
+        """Disable the images of several appliances."""
+        with self.lock:
+            results = []
+            for image_id, image in self.images.items():
+                if image['IK_ID'] in appliance_ids:
+                    image['IK_STATUS'] = 'DISABLED'
+                    results.append(backend_base.ImageResult(
+                        image_id, image['IK_ID'], True, None, 0
+                    ))
+            return results
+
+    def delete_appliances_bulk(self, image_ids=None):
+        """Delete the given images."""
+        with self.lock:
+            for image_id in image_ids:
+                del self.images[image_id]
+            return [backend_base.ImageResult(image_id, None, True, None, 0)
+                    for image_id in image_ids]
+
+
+class FakeDownloader(object):
+    """A downloader failing to download the remote images."""
+
+    def __init__(self):
+        """Initialize the class."""
+        self.fetched = []
+
+    def cached(self, appliance):
+        """Return that the images are not in the store."""
+        return None
+
+    def retrieve(self, appliance):
+        """Fail to download the image."""
+        self.fetched.append(appliance.identifier)
+        raise IOError("no route to host")
+
+
+class FakeConverter(object):
+    """A converter renaming the format of the images."""
+
+    max_workers = 1
+
+    def __init__(self):
+        """Initialize the class."""
+        self.converted = []
+
+    def convert(self, appliance, disk_format):
+        """Only convert the images to raw."""
+        if disk_format != 'raw':
+            raise IOError(disk_format)
+        self.converted.append(appliance['identifier'])
+        return appliance.replace(format=disk_format, checksum='0' * 64)
+
+
+class FakeImageList(object):
+    """A fake image list."""
+
+    def __init__(self, appliances):
+        """Initialize the class."""
+        self.appliances = dict((a.identifier, a) for a in appliances)
+
+    def get_images(self):
+        """Return the appliances, indexed by identifier."""
+        return self.appliances
+
+
+class TestSyncEngine(base.TestCase):
+    """Test the sync engine."""
+
+    def setUp(self):
+        """Create a few appliances and backends."""
+        super(TestSyncEngine, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        appliances = []
+        for identifier in ('a', 'b', 'c'):
+            location = os.path.join(tempdir, identifier)
+            with open(location, 'wb') as image_file:
+                image_file.write(os.urandom(1000))
+            appliances.append(appliance.Appliance(
+                identifier, '1', format='qcow2', location=location
+            ))
+        self.images = FakeImageList(appliances)
+        self.backends = {'x': FakeBackend(), 'y': FakeBackend()}
+        self.backends['y'].images['existing'] = {
+            'IK_ID': 'b', 'IK_VERSION': '1', 'IK_STATUS': 'ENABLED'
+        }
+        self.state = state.SyncState(os.path.join(tempdir, 'state.db'))
+        self.addCleanup(self.state.close)
+        self.journal = journal.Journal(os.path.join(tempdir, 'journal.log'))
+        self.addCleanup(self.journal.close)
+
+    def test_run(self):
+        """Test that the missing appliances are added."""
+        reports = engine.SyncEngine(self.backends, self.images,
+                                    self.state).run()
+        self.assertEqual(3, len(self.backends['x'].images))
+        self.assertEqual(3, len(self.backends['y'].images))
+        self.assertEqual(3, reports['x'].succeeded)
+        self.assertEqual(2, reports['y'].succeeded)
+        self.assertEqual(1, reports['y'].up_to_date)
+        self.assertEqual(6, len(self.state.records()))
+
+    def test_noop_run(self):
+        """Test that a second run does not look for the appliances."""
+        engine.SyncEngine(self.backends, self.images, self.state).run()
+        for backend in self.backends.values():
+            backend.lookups = 0
+        reports = engine.SyncEngine(self.backends, self.images,
+                                    self.state).run()
+        self.assertEqual(0, self.backends['x'].lookups)
+        self.assertEqual(0, self.backends['y'].lookups)
+        self.assertEqual(3, reports['x'].up_to_date)
+        self.assertEqual(0, reports['x'].succeeded)
+
+    def test_update_and_removal(self):
+        """Test that updated and removed appliances are deprecated."""
+        engine.SyncEngine(self.backends, self.images, self.state).run()
+        appliances = self.images.appliances
+        appliances['a'] = appliance.Appliance(
+            'a', '2', location=appliances['a'].location
+        )
+        del appliances['c']
+        reports = engine.SyncEngine(self.backends, self.images,
+                                    self.state).run()
+        images = self.backends['x'].images.values()
+        self.assertEqual(2, len([i for i in images
+                                 if i['IK_STATUS'] == 'ENABLED']))
+        self.assertEqual(2, len([i for i in images
+                                 if i['IK_STATUS'] == 'DISABLED']))
+        self.assertEqual(0, reports['x'].failed)
+
+        # The deprecated images are deleted by the next run
+        engine.SyncEngine(self.backends, self.images, self.state).run()
+        self.assertEqual(2, len(self.backends['x'].images))
+        self.assertEqual([], [r for r in self.state.records('x')
+                              if r.status != 'ENABLED'])
+
+    def test_plan_has_no_side_effect(self):
+        """Test that planning does not change the backends."""
+        plans = engine.SyncEngine(self.backends, self.images,
+                                  self.state).plan()
+        self.assertEqual(3, len(plans['x']))
+        self.assertEqual(2, len(plans['y']))
+        self.assertEqual(0, len(self.backends['x'].images))
+        self.assertEqual([], self.state.records())
+
+    def test_replay(self):
+        """Test that the interrupted operations are replayed first."""
+        self.journal.begin('x', journal.ADD, 'a')
+        engine.SyncEngine(self.backends, self.images, self.state,
+                          self.journal).run()
+        self.assertEqual(['a', 'b', 'c'], self.backends['x'].replayed)
+        self.assertEqual(['a', 'c'], self.backends['y'].replayed)
+        self.assertIs(self.journal, self.backends['x'].journal)
+
+    def test_failed_download(self):
+        """Test that an appliance whose image is missing is not uploaded."""
+        appliances = self.images.appliances
+        appliances['c'] = appliances['c'].replace(
+            location='https://example.org/c.img'
+        )
+        downloader = FakeDownloader()
+        reports = engine.SyncEngine(self.backends, self.images, self.state,
+                                    downloader=downloader).run()
+        self.assertEqual(['c'], downloader.fetched)
+        self.assertEqual(2, reports['x'].succeeded)
+        self.assertEqual(1, reports['x'].failed)
+        self.assertEqual(1, reports['y'].succeeded)
+        self.assertEqual(1, reports['y'].failed)
+
+    def test_pipeline_stages(self):
+        """Test that the stages of the pipeline are reported."""
+        sync_engine = engine.SyncEngine(self.backends, self.images,
+                                        self.state)
+        sync_engine.run()
+        self.assertEqual(['fetch', 'verify', 'upload'],
+                         list(sync_engine.stages))
+        self.assertEqual(3, sync_engine.stages['upload'].processed)
+        self.assertEqual(3000, sync_engine.stages['upload'].bytes)
+
+    def test_conversion(self):
+        """Test that the images are converted for the backends."""
+        self.backends['x'].disk_format = 'raw'
+        self.backends['z'] = FakeBackend('vmdk')
+        converter = FakeConverter()
+        sync_engine = engine.SyncEngine(self.backends, self.images,
+                                        self.state, converter=converter)
+        reports = sync_engine.run()
+        self.assertEqual(['a', 'b', 'c'], sorted(converter.converted))
+        self.assertEqual(['raw'] * 3, self.backends['x'].formats)
+        self.assertEqual(['qcow2'] * 2, self.backends['y'].formats)
+        self.assertEqual(3, reports['z'].failed)
+        self.assertEqual(3, sync_engine.stages['convert'].processed)
+        # The state records the appliances of the image list
+        self.assertEqual(
+            set([(r.identifier, r.checksum) for r in self.state.records()]),
+            set([('a', ''), ('b', ''), ('c', '')])
+        )
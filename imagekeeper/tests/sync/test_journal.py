@@ -0,0 +1,96 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Operation journal test class."""
+
+import os
+
+import fixtures
+import mock
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.sync import journal
+from imagekeeper.tests import base
+
+
+class TestJournal(base.TestCase):
+    """Test the operation journal."""
+
+    def setUp(self):
+        """Create an empty journal."""
+        super(TestJournal, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tempdir, 'work', 'journal.log')
+        self.journal = journal.Journal(self.path)
+        self.addCleanup(lambda: self.journal.close())
+
+    def reopen(self):
+        """Reopen the journal as a new run would."""
+        self.journal.close()
+        self.journal = journal.Journal(self.path)
+
+    def test_steps(self):
+        """Test that the data of the steps is merged."""
+        entry_id = self.journal.begin('cloud', journal.ADD, 'a', version='1')
+        self.journal.step(entry_id, 'created', image_id='x')
+        entry = self.journal.pending()[0]
+        self.assertEqual('created', entry.step)
+        self.assertEqual({'version': '1', 'image_id': 'x'}, entry.data)
+        self.journal.finish(entry_id)
+        self.assertEqual([], self.journal.pending())
+
+    def test_pending_after_restart(self):
+        """Test that the pending operations are kept by a new run."""
+        done = self.journal.begin('cloud', journal.DELETE)
+        self.journal.finish(done)
+        entry_id = self.journal.begin('cloud', journal.ADD, 'a')
+        self.journal.step(entry_id, 'created', image_id='x')
+        self.reopen()
+        entries = self.journal.pending('cloud', journal.ADD)
+        self.assertEqual([entry_id], [entry.id for entry in entries])
+        self.assertEqual([], self.journal.pending('other'))
+        # The completed operations have been removed from the file
+        with open(self.path) as journal_file:
+            self.assertEqual(1, len(journal_file.readlines()))
+
+    def test_batch_synced_once(self):
+        """Test that a batch is written to disk once."""
+        with mock.patch.object(journal.os, 'fsync') as fsync:
+            entry_id = self.journal.begin('cloud', journal.DELETE,
+                                          image_ids=['x', 'y', 'z'])
+            self.journal.finish(entry_id)
+        self.assertEqual(1, fsync.call_count)
+        self.reopen()
+        self.assertEqual([], self.journal.pending())
+
+    def test_compact(self):
+        """Test that the completed operations are removed while open."""
+        done = self.journal.begin('cloud', journal.DELETE)
+        self.journal.finish(done)
+        entry_id = self.journal.begin('cloud', journal.ADD, 'a')
+        self.journal.compact()
+        with open(self.path) as journal_file:
+            self.assertEqual(1, len(journal_file.readlines()))
+        self.journal.finish(entry_id)
+        self.reopen()
+        self.assertEqual([], self.journal.pending())
+
+    def test_truncated_record(self):
+        """Test that a record interrupted while written is ignored."""
+        entry_id = self.journal.begin('cloud', journal.ADD, 'a')
+        self.journal.close()
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"id": "%s", "st' % entry_id)
+        self.journal = journal.Journal(self.path)
+        self.assertEqual('started', self.journal.pending()[0].step)
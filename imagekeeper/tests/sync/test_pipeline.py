@@ -0,0 +1,89 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Pipeline test class."""
+
+import threading
+import time
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.sync import pipeline
+from imagekeeper.tests import base
+
+
+class TestPipeline(base.TestCase):
+    """Test the pipeline of stages."""
+
+    def test_run(self):
+        """Test that the items go through all the stages."""
+        stages = [pipeline.Stage('double', lambda item: item * 2, 2),
+                  pipeline.Stage('increment', lambda item: item + 1, 3)]
+        sync_pipeline = pipeline.Pipeline(stages, queue_size=1)
+        results = sync_pipeline.run(range(10))
+        self.assertEqual([i * 2 + 1 for i in range(10)], sorted(results))
+        for report in sync_pipeline.reports.values():
+            self.assertEqual(10, report.processed)
+            self.assertLessEqual(report.max_depth, 1)
+
+    def test_dropped_items(self):
+        """Test that failed items do not reach the next stages."""
+        def check(item):
+            if item == 3:
+                raise ValueError(item)
+            return item if item % 2 else None
+
+        seen = []
+        stages = [pipeline.Stage('check', check),
+                  pipeline.Stage('collect', lambda i: seen.append(i) or i)]
+        sync_pipeline = pipeline.Pipeline(stages)
+        self.assertEqual([1, 5], sync_pipeline.run(range(6)))
+        self.assertEqual([1, 5], seen)
+        self.assertEqual(4, sync_pipeline.reports['check'].failed)
+        self.assertEqual(2, sync_pipeline.reports['collect'].processed)
+
+    def test_overlap(self):
+        """Test that the stages process different items at once."""
+        lock = threading.Lock()
+        active = set()
+        overlaps = []
+
+        def slow(name):
+            def run(item):
+                with lock:
+                    active.add(name)
+                    if len(active) > 1:
+                        overlaps.append(item)
+                time.sleep(0.02)
+                with lock:
+                    active.discard(name)
+                return item
+            return run
+
+        stages = [pipeline.Stage('first', slow('first')),
+                  pipeline.Stage('second', slow('second'))]
+        sync_pipeline = pipeline.Pipeline(stages, queue_size=1)
+        sync_pipeline.run(range(5))
+        self.assertNotEqual([], overlaps)
+        report = sync_pipeline.reports['first']
+        self.assertGreater(report.throughput, 0)
+        self.assertIn('first: 5 processed, 0 failed', str(report))
+
+    def test_bytes(self):
+        """Test that the size of the items is reported."""
+        stages = [pipeline.Stage('sleep', lambda i: time.sleep(0.01) or i,
+                                 size=len)]
+        sync_pipeline = pipeline.Pipeline(stages)
+        sync_pipeline.run([b'a' * 1048576, b'b' * 1048576])
+        self.assertEqual(2097152, sync_pipeline.reports['sleep'].bytes)
+        self.assertIn('MB/s', str(sync_pipeline.reports['sleep']))
@@ -0,0 +1,152 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sync planner test class."""
+
+import os
+
+import fixtures
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import appliance
+from imagekeeper.sync import planner
+from imagekeeper.sync import state
+from imagekeeper.tests import base
+from imagekeeper.tests.sync import test_engine
+
+
+class BrokenBackend(object):
+    """A backend that cannot be reached."""
+
+    def get_image_list(self, properties=None):
+        """Fail to list the images."""
+        raise IOError('unreachable')
+
+
+class TestSyncPlanner(base.TestCase):
+    """Test the sync planner."""
+
+    def setUp(self):
+        """Create a backend with a few images."""
+        super(TestSyncPlanner, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.state = state.SyncState(os.path.join(tempdir, 'state.db'))
+        self.addCleanup(self.state.close)
+        self.backend = test_engine.FakeBackend()
+        self.backend.images = {
+            'image-a': {'IK_ID': 'a', 'IK_VERSION': '1',
+                        'IK_STATUS': 'ENABLED'},
+            'image-b': {'IK_ID': 'b', 'IK_VERSION': '1',
+                        'IK_STATUS': 'ENABLED'},
+            'image-c': {'IK_ID': 'c', 'IK_VERSION': '1',
+                        'IK_STATUS': 'ENABLED'},
+            'image-d': {'IK_ID': 'd', 'IK_VERSION': '1',
+                        'IK_STATUS': 'DISABLED'},
+        }
+        self.appliances = [
+            appliance.Appliance('a', '1'),
+            appliance.Appliance('b', '2'),
+            appliance.Appliance('e', '1'),
+        ]
+
+    def test_plan_backend(self):
+        """Test that each kind of difference gets its action, in order."""
+        plan = planner.SyncPlanner({'x': self.backend}).plan_backend(
+            'x', self.appliances
+        )
+        self.assertEqual(
+            [(planner.DEPRECATE, 'c'), (planner.UPDATE, 'b'),
+             (planner.ADD, 'e'), (planner.DELETE, 'd')],
+            [(action.kind, action.identifier) for action in plan]
+        )
+        self.assertEqual('image-d', plan.get_actions(planner.DELETE)[0]
+                         .image_id)
+        self.assertEqual(1, plan.up_to_date)
+        self.assertEqual([(self.appliances[0], 'image-a')], plan.synced)
+
+    def test_plan_republished(self):
+        """Test that a new checksum for the same version is an update."""
+        sha512 = 'ab' * 64
+        self.backend.images['image-a'].update({
+            'IK_HASH_ALGO': 'sha512', 'IK_HASH_VALUE': sha512,
+            'disk_format': 'qcow2',
+        })
+        plan = planner.SyncPlanner({'x': self.backend}).plan_backend(
+            'x', [appliance.Appliance('a', '1', format='QCOW2',
+                                      checksum='CD' * 64)]
+        )
+        self.assertEqual([(planner.UPDATE, 'a')],
+                         [(action.kind, action.identifier) for action in plan
+                          if action.identifier == 'a'])
+        plan = planner.SyncPlanner({'x': self.backend}).plan_backend(
+            'x', [appliance.Appliance('a', '1', format='QCOW2',
+                                      checksum=sha512.upper())]
+        )
+        self.assertEqual(1, plan.up_to_date)
+
+    def test_is_current(self):
+        """Test the checksums that cannot be compared."""
+        image = {'IK_VERSION': '1', 'checksum': 'ab' * 16,
+                 'os_hash_algo': 'sha512', 'os_hash_value': 'ab' * 64,
+                 'disk_format': 'raw'}
+        self.assertTrue(planner.is_current(
+            image, appliance.Appliance('a', '1', format='raw',
+                                       checksum='ab' * 64)))
+        self.assertFalse(planner.is_current(
+            image, appliance.Appliance('a', '1', format='raw',
+                                       checksum='cd' * 16)))
+        self.assertFalse(planner.is_current(
+            image, appliance.Appliance('a', '2', format='raw',
+                                       checksum='ab' * 16)))
+        # Converted image
+        self.assertTrue(planner.is_current(
+            image, appliance.Appliance('a', '1', format='qcow2',
+                                       checksum='cd' * 64)))
+        # No checksum of the same algorithm
+        self.assertTrue(planner.is_current(
+            image, appliance.Appliance('a', '1', format='raw',
+                                       checksum='cd' * 32)))
+        # No checksum in the image list
+        self.assertTrue(planner.is_current(
+            image, appliance.Appliance('a', '1', format='raw')))
+
+    def test_plan_from_state(self):
+        """Test that the backend is not listed when the state is fresh."""
+        for appliance_ in self.appliances:
+            self.state.record('x', appliance_, 'image')
+        plan = planner.SyncPlanner({'x': self.backend},
+                                   self.state).plan_backend(
+            'x', self.appliances
+        )
+        self.assertEqual(0, self.backend.lookups)
+        self.assertEqual(0, len(plan))
+        self.assertEqual(3, plan.up_to_date)
+
+    def test_plan_removed_from_state(self):
+        """Test that an appliance removed from the list is looked at."""
+        for appliance_ in self.appliances:
+            self.state.record('x', appliance_, 'image')
+        plan = planner.SyncPlanner({'x': self.backend},
+                                   self.state).plan_backend(
+            'x', self.appliances[:2]
+        )
+        self.assertNotEqual(0, self.backend.lookups)
+        self.assertEqual(1, len(plan.get_actions(planner.DEPRECATE)))
+
+    def test_plan_broken_backend(self):
+        """Test that a backend that cannot be listed gets no plan."""
+        plans = planner.SyncPlanner({
+            'x': self.backend, 'y': BrokenBackend()
+        }).plan(self.appliances)
+        self.assertEqual(['x'], list(plans))
@@ -0,0 +1,177 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sync scheduler test class."""
+
+import collections
+import threading
+import time
+
+from imagekeeper.sync import scheduler
+from imagekeeper.tests import base
+
+
+class FakeBackend(object):
+    """A fake backend recording the concurrency of the operations."""
+
+    def __init__(self, delay=0.0, failing=()):
+        """Initialize the class."""
+        self.delay = delay
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.done = []
+
+    def sync(self, appliance):
+        """Synchronize a fake appliance."""
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            self.done.append(appliance)
+        if appliance in self.failing:
+            raise RuntimeError(appliance)
+        return True
+
+
+def sync_func(backend, appliance):
+    """Forward the operation to the fake backend."""
+    return backend.sync(appliance)
+
+
+class TestSyncScheduler(base.TestCase):
+    """Test the sync scheduler."""
+
+    def test_run_all_appliances(self):
+        """Test that every appliance is synchronized on every backend."""
+        backends = collections.OrderedDict(
+            (name, FakeBackend()) for name in ('a', 'b', 'c')
+        )
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=4, backend_workers=2,
+            backend_timeout=0
+        )
+        reports = sync_scheduler.run(range(5))
+        for name, backend in backends.items():
+            self.assertEqual(list(range(5)), sorted(backend.done))
+            self.assertEqual(5, reports[name].succeeded)
+            self.assertEqual('OK', reports[name].status)
+
+    def test_backend_workers_limit(self):
+        """Test that the per backend limit is enforced."""
+        backends = {'a': FakeBackend(0.01), 'b': FakeBackend(0.01)}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=8, backend_workers=2,
+            backend_timeout=0
+        )
+        sync_scheduler.run(range(6))
+        self.assertEqual(2, backends['a'].max_running)
+        self.assertEqual(2, backends['b'].max_running)
+
+    def test_failures_reported(self):
+        """Test that failing operations are reported per backend."""
+        backends = {'a': FakeBackend(failing=(1, 3)), 'b': FakeBackend()}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=2, backend_workers=1,
+            backend_timeout=0
+        )
+        reports = sync_scheduler.run(range(4))
+        self.assertEqual(2, reports['a'].succeeded)
+        self.assertEqual(2, reports['a'].failed)
+        self.assertEqual('FAILED', reports['a'].status)
+        self.assertEqual('OK', reports['b'].status)
+
+    def test_backend_timeout(self):
+        """Test that a slow backend does not delay the other ones."""
+        backends = {'slow': FakeBackend(0.2), 'fast': FakeBackend()}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=2, backend_workers=1,
+            backend_timeout=0.1
+        )
+        reports = sync_scheduler.run(range(5))
+        self.assertEqual('TIMEOUT', reports['slow'].status)
+        self.assertEqual(4, reports['slow'].skipped)
+        self.assertEqual(5, reports['fast'].succeeded)
+        self.assertIn('slow: TIMEOUT', str(reports['slow']))
+
+    def test_timeout_over_stages(self):
+        """Test that the timeout covers all the stages of a backend."""
+        backends = {'slow': FakeBackend(0.15), 'idle': FakeBackend()}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=2, backend_workers=1,
+            backend_timeout=0.2
+        )
+        sync_scheduler.run(range(1))
+        reports = sync_scheduler.run_plan({'slow': range(4)})
+        self.assertEqual('TIMEOUT', reports['slow'].status)
+        self.assertEqual(1, reports['slow'].succeeded)
+        self.assertEqual(3, reports['slow'].skipped)
+        # A backend without operations after its deadline is not timed out
+        self.assertEqual('OK', reports['idle'].status)
+        reports = sync_scheduler.run_plan({'idle': range(1)})
+        self.assertEqual('TIMEOUT', reports['idle'].status)
+        self.assertEqual(1, reports['idle'].skipped)
+
+    def test_timed_out_workers(self):
+        """Test that tasks waiting for workers busy on timed out backends run.
+
+        The pending tasks are run once the operations of the timed out
+        backend are over.
+        """
+        backends = {'a': FakeBackend(0.3), 'b': FakeBackend()}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, sync_func, max_workers=1, backend_workers=1,
+            backend_timeout=0.1
+        )
+        reports = sync_scheduler.run_plan({'a': range(2), 'b': range(2)})
+        self.assertEqual('TIMEOUT', reports['a'].status)
+        self.assertEqual(1, reports['a'].succeeded)
+        self.assertEqual(2, reports['b'].succeeded)
+        self.assertEqual([0, 1], backends['b'].done)
+
+    def test_deferred(self):
+        """Test that the appliances can be deferred to a later stage."""
+        backends = {'a': FakeBackend(), 'b': FakeBackend()}
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, lambda backend, appliance: None, max_workers=2,
+            backend_workers=1, backend_timeout=0
+        )
+        reports = sync_scheduler.run(range(3))
+        self.assertEqual([0, 1, 2], sorted(reports['a'].deferred))
+        self.assertEqual(0, reports['a'].succeeded)
+
+    def test_run_group_from_threads(self):
+        """Test that the groups run by several threads share the limits."""
+        backends = {'a': FakeBackend(0.01), 'b': FakeBackend(0.01)}
+
+        def group_func(appliance, group_backends):
+            return dict((name, backend.sync(appliance))
+                        for name, backend in group_backends.items())
+
+        sync_scheduler = scheduler.SyncScheduler(
+            backends, max_workers=4, backend_workers=1, backend_timeout=0
+        )
+        threads = [threading.Thread(target=sync_scheduler.run_group,
+                                    args=(i, ['a', 'b'], group_func))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, backends['a'].max_running)
+        self.assertEqual(4, sync_scheduler.reports['a'].succeeded)
+        self.assertEqual(4, sync_scheduler.reports['b'].total)
@@ -0,0 +1,84 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sync state database test class."""
+
+import os
+
+import fixtures
+
+from imagekeeper.common import config  # noqa: F401
+from imagekeeper.image import appliance
+from imagekeeper.sync import state
+from imagekeeper.tests import base
+
+
+class TestSyncState(base.TestCase):
+    """Test the sync state database."""
+
+    def setUp(self):
+        """Create an empty database."""
+        super(TestSyncState, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(tempdir, 'store', 'state.db')
+        self.state = state.SyncState(self.path)
+        self.addCleanup(self.state.close)
+        self.appliance = appliance.Appliance('a', '1', checksum='abc')
+
+    def test_record(self):
+        """Test that a recorded appliance is synchronized."""
+        self.assertFalse(self.state.is_synced('cloud', self.appliance))
+        self.state.record('cloud', self.appliance, 'image-1')
+        self.assertTrue(self.state.is_synced('cloud', self.appliance))
+        self.assertFalse(self.state.is_synced('other', self.appliance))
+        self.assertEqual('image-1',
+                         self.state.get('cloud', self.appliance).image_id)
+
+    def test_new_version(self):
+        """Test that a new version of an appliance is not synchronized."""
+        self.state.record('cloud', self.appliance, 'image-1')
+        new_version = appliance.Appliance('a', '2', checksum='def')
+        self.assertFalse(self.state.is_synced('cloud', new_version))
+
+    def test_max_age(self):
+        """Test that an old state must be verified again."""
+        self.state.record('cloud', self.appliance, 'image-1')
+        self.assertFalse(self.state.is_synced('cloud', self.appliance,
+                                              max_age=-1))
+        self.assertTrue(self.state.is_synced('cloud', self.appliance,
+                                             max_age=0))
+
+    def test_status(self):
+        """Test that a disabled appliance is not synchronized."""
+        self.state.record('cloud', self.appliance, 'image-1')
+        self.state.set_status('cloud', 'a', 'DISABLED')
+        self.assertFalse(self.state.is_synced('cloud', self.appliance))
+        self.state.forget('cloud', 'a')
+        self.assertEqual([], self.state.records('cloud'))
+
+    def test_forget_status(self):
+        """Test that only the records with a given status are removed."""
+        self.state.record('cloud', self.appliance, 'image-1')
+        self.state.record('cloud', appliance.Appliance('b', '1'), 'image-2',
+                          status='DISABLED')
+        self.state.forget('cloud', status='DISABLED')
+        self.assertEqual(['a'], [record.identifier
+                                 for record in self.state.records('cloud')])
+
+    def test_persistence(self):
+        """Test that the states are kept when the database is reopened."""
+        self.state.record('cloud', self.appliance, 'image-1')
+        self.state.close()
+        self.state = state.SyncState(self.path)
+        self.assertEqual(1, len(self.state.records()))
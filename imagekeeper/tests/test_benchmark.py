@@ -0,0 +1,68 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark test class."""
+
+import json
+
+from oslo_config import fixture as config_fixture
+
+from imagekeeper.tests import base
+from imagekeeper.tests import benchmark
+
+# Parameters small enough for the scenarios to run as unit tests
+SMALL = {'appliances': 3, 'image_size': 1024, 'backends': 2,
+         'catalogue': 30, 'latency': 0.0}
+
+
+class TestBenchmark(base.TestCase):
+    """Test that the benchmark scenarios run."""
+
+    def setUp(self):
+        """Set up the test."""
+        super(TestBenchmark, self).setUp()
+        self.useFixture(config_fixture.Config())
+
+    def test_cold_sync(self):
+        """Test that all the appliances are uploaded."""
+        result = benchmark.run_scenario('cold_sync', **SMALL)
+        sync = result['runs']['sync']
+        self.assertEqual(6, sync['succeeded'])
+        self.assertEqual(0, sync['failed'])
+        self.assertEqual(6 * 1024, sync['uploaded_bytes'])
+        self.assertEqual(3, sync['stages']['upload']['processed'])
+
+    def test_noop_resync(self):
+        """Test that nothing is sent to backends already up to date."""
+        result = benchmark.run_scenario('noop_resync', **SMALL)
+        resync = result['runs']['resync']
+        self.assertEqual(6, resync['up_to_date'])
+        self.assertEqual(0, resync['operations'])
+        self.assertEqual(0, resync['uploaded_bytes'])
+
+    def test_mass_deprecation(self):
+        """Test that the removed appliances are deprecated then deleted."""
+        result = benchmark.run_scenario('mass_deprecation', **SMALL)
+        self.assertEqual(6, result['runs']['deprecate']['operations'])
+        self.assertEqual(0, result['runs']['deprecate']['failed'])
+        self.assertEqual(0, result['runs']['delete']['failed'])
+
+    def test_results(self):
+        """Test that the results can be written as JSON."""
+        results = benchmark.run(['many_backends'],
+                                **dict(SMALL, backends=None))
+        scenario = json.loads(json.dumps(results))['scenarios'][
+            'many_backends']
+        self.assertEqual(10, scenario['parameters']['backends'])
+        self.assertEqual(30, scenario['runs']['sync']['succeeded'])
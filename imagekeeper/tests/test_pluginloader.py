@@ -0,0 +1,137 @@
+# Copyright 2020 CNRS and University of Strasbourg
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Plugin loader test class."""
+
+import os
+import sys
+
+import fixtures
+import mock
+
+from imagekeeper import pluginloader
+from imagekeeper.tests import base
+
+PACKAGE = """
+class Plugin(object):
+    feature = None
+
+    @classmethod
+    def get_feature(cls):
+        return cls.feature
+"""
+
+MODULE = """
+from fakeplugins import Plugin
+
+
+class Good(Plugin):
+    feature = 'good'
+"""
+
+
+class FakeEntryPoint(object):
+    """An entry point loading a given object."""
+
+    def __init__(self, name, obj):
+        """Initialize the class."""
+        self.name = name
+        self.obj = obj
+        self.loaded = 0
+
+    def load(self):
+        """Return the object."""
+        self.loaded += 1
+        return self.obj
+
+
+class TestPluginLoader(base.TestCase):
+    """Test the lazy discovery of the plugins."""
+
+    def setUp(self):
+        """Create a namespace with a plugin and a broken module."""
+        super(TestPluginLoader, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        package = os.path.join(tempdir, 'fakeplugins')
+        os.mkdir(package)
+        with open(os.path.join(package, '__init__.py'), 'w') as init:
+            init.write(PACKAGE)
+        with open(os.path.join(package, 'good.py'), 'w') as module:
+            module.write(MODULE)
+        with open(os.path.join(package, 'broken.py'), 'w') as module:
+            module.write("raise ImportError('heavy dependency')\n")
+        sys.path.insert(0, tempdir)
+        self.addCleanup(sys.path.remove, tempdir)
+        self.addCleanup(self._unload)
+        self.addCleanup(pluginloader.clear_cache)
+        pluginloader.clear_cache()
+        self.plugins = __import__('fakeplugins')
+        self.loader = pluginloader.PluginLoader('fakeplugins',
+                                                self.plugins.Plugin)
+
+    @staticmethod
+    def _unload():
+        """Forget the modules of the namespace."""
+        for name in list(sys.modules):
+            if name.split('.')[0] == 'fakeplugins':
+                del sys.modules[name]
+
+    def test_lazy_import(self):
+        """Test that only the module of the feature is imported."""
+        handler = self.loader.load_handler('good')
+        self.assertEqual('good', handler.get_feature())
+        self.assertIn('fakeplugins.good', sys.modules)
+        self.assertNotIn('fakeplugins.broken', sys.modules)
+        self.assertEqual(['broken', 'good'],
+                         self.loader.get_supported_handler())
+
+    def test_cache(self):
+        """Test that the classes are found once per process."""
+        handler = self.loader.load_handler('good')
+        with mock.patch.object(self.loader, '_find_class') as find:
+            self.assertIs(handler, self.loader.load_handler('good'))
+            other = pluginloader.PluginLoader('fakeplugins',
+                                              self.plugins.Plugin)
+            self.assertIs(handler, other.load_handler('good'))
+            self.assertFalse(find.called)
+
+    def test_unknown_feature(self):
+        """Test that a feature found nowhere has no handler."""
+        self.assertRaises(ImportError, self.loader.load_handler, 'missing')
+        os.remove(os.path.join(os.path.dirname(self.plugins.__file__),
+                               'broken.py'))
+        self.assertIsNone(self.loader.load_handler('other'))
+
+    def test_entry_point(self):
+        """Test that a feature is loaded from its entry point."""
+        entry_point = FakeEntryPoint('other', self.plugins.Plugin)
+        with mock.patch.object(pluginloader, '_entry_points',
+                               return_value={'other': entry_point}):
+            self.assertIs(self.plugins.Plugin,
+                          self.loader.load_handler('other'))
+            self.assertIs(self.plugins.Plugin,
+                          self.loader.load_handler('other'))
+            self.assertEqual(['other'], self.loader.get_supported_handler())
+        self.assertEqual(1, entry_point.loaded)
+        self.assertNotIn('fakeplugins.good', sys.modules)
+
+    def test_entry_points_fallback(self):
+        """Test that pkg_resources is used without importlib.metadata."""
+        entry_point = FakeEntryPoint('other', self.plugins.Plugin)
+        with mock.patch.object(pluginloader, 'metadata', None):
+            with mock.patch('pkg_resources.iter_entry_points',
+                            return_value=[entry_point]) as iter_entry_points:
+                self.assertEqual({'other': entry_point},
+                                 pluginloader._entry_points('fakeplugins'))
+        iter_entry_points.assert_called_once_with('fakeplugins')
@@ -12,7 +12,39 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import pbr.version
+"""Version of imagekeeper.
 
-version_info = pbr.version.VersionInfo('imagekeeper')
-__version__ = version_info.release_string()
+The version is read from the metadata of the installed package, pbr being
+only imported when there is none, as in a source checkout, since importing
+it takes longer than starting the command line tools.
+"""
+
+try:
+    from importlib import metadata
+except ImportError:
+    metadata = None
+
+
+def version_string():
+    """Return the version of imagekeeper.
+
+    :rtype: str
+    """
+    if metadata is not None:
+        try:
+            return metadata.version('imagekeeper')
+        except metadata.PackageNotFoundError:
+            pass
+    import pbr.version
+    return pbr.version.VersionInfo('imagekeeper').version_string()
+
+
+def __getattr__(name):
+    """Create the pbr version information when first used."""
+    if name not in ('version_info', '__version__'):
+        raise AttributeError(name)
+    import pbr.version
+    version_info = pbr.version.VersionInfo('imagekeeper')
+    if name == '__version__':
+        return version_info.release_string()
+    return version_info